@@ -5,7 +5,10 @@ import numpy as np
 import time
 from datetime import timedelta
 import os
-from dataclasses import dataclass
+import threading
+from dataclasses import dataclass, field, replace
+
+from rep_engine import RepCounter, rep_percentage
 
 # Configure page
 st.set_page_config(
@@ -14,25 +17,20 @@ st.set_page_config(
     layout="wide"
 )
 
-# Global variables
-if 'count' not in st.session_state:
-    st.session_state.count = 0
-if 'is_running' not in st.session_state:
-    st.session_state.is_running = False
-if 'start_time' not in st.session_state:
-    st.session_state.start_time = None
-if 'elapsed_time' not in st.session_state:
-    st.session_state.elapsed_time = timedelta(0)
-if 'exercise_type' not in st.session_state:
-    st.session_state.exercise_type = "pushup"
-if 'form_feedback' not in st.session_state:
-    st.session_state.form_feedback = "Waiting to detect form..."
-if 'confidence_score' not in st.session_state:
-    st.session_state.confidence_score = 0.0
-if 'rep_stage' not in st.session_state:
-    st.session_state.rep_stage = "waiting"
-if 'position_buffer' not in st.session_state:
-    st.session_state.position_buffer = []
+@dataclass
+class TrackerState:
+    """Tracking state, owned by the background processor instead of st.session_state"""
+    count: int = 0
+    is_running: bool = False
+    start_time: float = None
+    elapsed_time: timedelta = timedelta(0)
+    exercise_type: str = "pushup"
+    form_feedback: str = "Waiting to detect form..."
+    confidence_score: float = 0.0
+    rep_stage: str = "waiting"
+    position_buffer: list = field(default_factory=list)
+    rep_counter: RepCounter = field(default_factory=RepCounter)
+    error: str = None
 
 @dataclass
 class ExerciseConfig:
@@ -244,30 +242,24 @@ class PoseDetector:
         
         return is_good_form, angle, feedback if not is_good_form else "Good form"
 
-def process_frame(img, detector):
-    """Process a video frame for exercise tracking"""
-    if img is None or img.size == 0:
-        return np.zeros((480, 640, 3), dtype=np.uint8)
-        
-    # Flip image for more intuitive viewing
-    img = cv2.flip(img, 1)
-    
+def process_frame(img, detector, state):
+    """
+    Track the exercise on a flipped frame whose pose detector.find_pose has
+    already found, and draw the overlays
+    """
     # Get original dimensions
     h, w, c = img.shape
     
     try:
-        # Find pose landmarks
-        img = detector.find_pose(img)
         detector.find_position(img)
         
-        # Overlay semi-transparent background for UI elements
-        overlay = img.copy()
-        cv2.rectangle(overlay, (0, 0), (w, 130), (0, 0, 0), -1)
-        cv2.rectangle(overlay, (0, h-60), (w, h), (0, 0, 0), -1)
-        img = cv2.addWeighted(overlay, 0.3, img, 0.7, 0)
+        # Darken the top and bottom bands behind the UI text, in place. Same
+        # result as blending a black overlay at 30% over rows 0-130 and the last 60.
+        for band in (img[:131], img[h-60:]):
+            cv2.addWeighted(band, 0.7, band, 0.0, 0, dst=band)
         
         if len(detector.landmark_list) > 0:
-            exercise_config = EXERCISE_CONFIGS.get(st.session_state.exercise_type)
+            exercise_config = EXERCISE_CONFIGS.get(state.exercise_type)
             
             # Primary angle detection
             p1, p2, p3 = exercise_config.angle_points
@@ -284,12 +276,12 @@ def process_frame(img, detector):
                 angle = detector.find_angle(img, p1, p2, p3)
                 
                 # Add to buffer for smoothing
-                st.session_state.position_buffer.append(angle)
-                if len(st.session_state.position_buffer) > 5:  # Buffer size
-                    st.session_state.position_buffer.pop(0)
+                state.position_buffer.append(angle)
+                if len(state.position_buffer) > 5:  # Buffer size
+                    state.position_buffer.pop(0)
                 
                 # Calculate smoothed angle
-                smoothed_angle = sum(st.session_state.position_buffer) / len(st.session_state.position_buffer)
+                smoothed_angle = sum(state.position_buffer) / len(state.position_buffer)
                 
                 # Calculate secondary angle for symmetry check if available
                 symmetry_score = 1.0
@@ -301,7 +293,7 @@ def process_frame(img, detector):
                     symmetry_score = max(0, 1.0 - (angle_diff / 180))
                 
                 # Convert angle to rep percentage
-                percentage = np.interp(smoothed_angle, (down_threshold, up_threshold), (0, 100))
+                percentage = rep_percentage(smoothed_angle, down_threshold, up_threshold)
                 
                 # Check form
                 form_issues = []
@@ -311,7 +303,7 @@ def process_frame(img, detector):
                         if is_good is False:  # Explicitly check for False (not None)
                             form_issues.append(feedback)
                 
-                st.session_state.form_feedback = ", ".join(form_issues) if form_issues else "Good form"
+                state.form_feedback = ", ".join(form_issues) if form_issues else "Good form"
                 
                 # Calculate overall confidence score based on visibility and symmetry
                 visibility_scores = [detector.landmark_list[p][3] for p in key_points 
@@ -319,26 +311,21 @@ def process_frame(img, detector):
                 avg_visibility = sum(visibility_scores) / len(visibility_scores) if visibility_scores else 0
                 
                 # Combined score (70% visibility, 30% symmetry)
-                st.session_state.confidence_score = (0.7 * avg_visibility + 0.3 * symmetry_score) * 100
+                state.confidence_score = (0.7 * avg_visibility + 0.3 * symmetry_score) * 100
                 
                 # Count reps with improved detection algorithm
-                if st.session_state.is_running:
+                if state.is_running:
                     # Get elapsed time
-                    if st.session_state.start_time:
-                        st.session_state.elapsed_time = timedelta(seconds=int(time.time() - st.session_state.start_time))
+                    if state.start_time:
+                        state.elapsed_time = timedelta(seconds=int(time.time() - state.start_time))
                     
                     # Rep detection state machine
-                    if percentage <= 10 and st.session_state.rep_stage != "down":
-                        st.session_state.rep_stage = "down"
-                    elif percentage >= 90 and st.session_state.rep_stage == "down":
-                        st.session_state.rep_stage = "up"
-                        st.session_state.count += 1
-                        
-                        # Reset to waiting state
-                        st.session_state.rep_stage = "waiting"
+                    if state.rep_counter.update(percentage, time.time(), smoothed_angle) is not None:
+                        state.count += 1
+                    state.rep_stage = state.rep_counter.stage
                 
                 # Draw progress bar
-                bar_color = (0, 255, 0) if st.session_state.is_running else (0, 165, 255)
+                bar_color = (0, 255, 0) if state.is_running else (0, 165, 255)
                 cv2.rectangle(img, (w-200, 40), (w-40, 70), (255, 255, 255), 2)
                 filled_width = int(160 * (percentage / 100))
                 cv2.rectangle(img, (w-200, 40), (w-200 + filled_width, 70), bar_color, cv2.FILLED)
@@ -346,81 +333,161 @@ def process_frame(img, detector):
                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
         
         # Draw UI elements
-        draw_ui_elements(img, detector)
+        draw_ui_elements(img, detector, state)
         
+        state.error = None
     except Exception as e:
-        st.error(f"Error processing frame: {e}")
+        state.error = f"Error processing frame: {e}"
         cv2.putText(img, "Error processing frame", (10, h//2),
                    cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
     
     return img
 
-def draw_ui_elements(img, detector):
+def draw_ui_elements(img, detector, state):
     """Draw UI elements on the frame"""
     h, w, c = img.shape
     
     # Exercise type
-    cv2.putText(img, f'Exercise: {st.session_state.exercise_type.upper()}', (10, 30),
+    cv2.putText(img, f'Exercise: {state.exercise_type.upper()}', (10, 30),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2)
     
     # Rep counter with larger font
-    cv2.putText(img, f'Reps: {int(st.session_state.count)}', (10, 70),
+    cv2.putText(img, f'Reps: {int(state.count)}', (10, 70),
                 cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 2)
     
     # Timer
-    time_str = str(st.session_state.elapsed_time).split('.')[0]
+    time_str = str(state.elapsed_time).split('.')[0]
     cv2.putText(img, f'Time: {time_str}', (10, 110),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2)
     
     # Status with colored indicator
-    status = "RUNNING" if st.session_state.is_running else "PAUSED"
-    status_color = (0, 255, 0) if st.session_state.is_running else (0, 0, 255)
+    status = "RUNNING" if state.is_running else "PAUSED"
+    status_color = (0, 255, 0) if state.is_running else (0, 0, 255)
     cv2.putText(img, status, (w - 150, 30),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.9, status_color, 2)
     
     # Form feedback
-    if st.session_state.form_feedback:
-        feedback_color = (0, 255, 0) if st.session_state.form_feedback == "Good form" else (0, 0, 255)
-        cv2.putText(img, st.session_state.form_feedback, (10, h-30),
+    if state.form_feedback:
+        feedback_color = (0, 255, 0) if state.form_feedback == "Good form" else (0, 0, 255)
+        cv2.putText(img, state.form_feedback, (10, h-30),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, feedback_color, 2)
     
     # Draw confidence score
-    confidence_color = (0, 255, 0) if st.session_state.confidence_score > 80 else \
-                      (0, 165, 255) if st.session_state.confidence_score > 60 else (0, 0, 255)
-    cv2.putText(img, f"Detection: {int(st.session_state.confidence_score)}%", (10, h-10),
+    confidence_color = (0, 255, 0) if state.confidence_score > 80 else \
+                      (0, 165, 255) if state.confidence_score > 60 else (0, 0, 255)
+    cv2.putText(img, f"Detection: {int(state.confidence_score)}%", (10, h-10),
                cv2.FONT_HERSHEY_SIMPLEX, 0.6, confidence_color, 2)
     
     # Add rep stage indicator
-    stage_color = (0, 255, 0) if st.session_state.rep_stage == "up" else \
-                 (0, 165, 255) if st.session_state.rep_stage == "down" else (255, 255, 255)
-    cv2.putText(img, f"Stage: {st.session_state.rep_stage.upper()}", (w-200, h-10),
+    stage_color = (0, 255, 0) if state.rep_stage == "up" else \
+                 (0, 165, 255) if state.rep_stage == "down" else (255, 255, 255)
+    cv2.putText(img, f"Stage: {state.rep_stage.upper()}", (w-200, h-10),
                cv2.FONT_HERSHEY_SIMPLEX, 0.6, stage_color, 2)
 
-def toggle_start_stop():
+def toggle_start_stop(state):
     """Toggle between start and stop states"""
-    st.session_state.is_running = not st.session_state.is_running
-    if st.session_state.is_running:
-        if st.session_state.start_time is None:
-            st.session_state.start_time = time.time()
+    state.is_running = not state.is_running
+    if state.is_running:
+        if state.start_time is None:
+            state.start_time = time.time()
         else:
             # Adjust start time to account for pause time
-            pause_duration = time.time() - (st.session_state.start_time + st.session_state.elapsed_time.total_seconds())
-            st.session_state.start_time += pause_duration
+            pause_duration = time.time() - (state.start_time + state.elapsed_time.total_seconds())
+            state.start_time += pause_duration
 
-def reset_tracker():
+def reset_tracker(state):
     """Reset tracking state"""
-    st.session_state.count = 0
-    st.session_state.elapsed_time = timedelta(0)
-    st.session_state.start_time = time.time() if st.session_state.is_running else None
-    st.session_state.position_buffer = []
-    st.session_state.rep_stage = "waiting"
+    state.count = 0
+    state.elapsed_time = timedelta(0)
+    state.start_time = time.time() if state.is_running else None
+    state.position_buffer = []
+    state.rep_counter.reset()
+    state.rep_stage = "waiting"
 
-def change_exercise(exercise_type):
+def change_exercise(state, exercise_type):
     """Change the current exercise type"""
     if exercise_type in EXERCISE_CONFIGS:
-        st.session_state.exercise_type = exercise_type
+        state.exercise_type = exercise_type
         # Reset tracking state for new exercise
-        reset_tracker()
+        reset_tracker(state)
+
+class StreamProcessor:
+    """
+    Owns the detector and the camera, and runs capture and processing on a
+    background thread. Streamlit reruns the script on every interaction;
+    cached with st.cache_resource, the model and camera survive reruns and
+    the script only reads the latest frame and stats.
+    """
+    def __init__(self, camera_index=0):
+        self.camera_index = camera_index
+        self.detector = PoseDetector()
+        self.state = TrackerState()
+        # Guards state; held for the rules and drawing, not for inference
+        self.lock = threading.Lock()
+        self.latest_frame = None  # RGB, ready for st.image
+        self.frame_id = 0
+        self.thread = threading.Thread(target=self._run, name="stream-processor", daemon=True)
+        self.thread.start()
+    
+    def _run(self):
+        """Capture and process frames until the server exits"""
+        cap = cv2.VideoCapture(self.camera_index)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        try:
+            while True:
+                success, frame = cap.read()
+                if not success or frame is None or frame.size == 0:
+                    with self.lock:
+                        self.state.error = "Failed to access webcam. Please check your camera permissions."
+                    time.sleep(0.5)
+                    cap.release()
+                    cap = cv2.VideoCapture(self.camera_index)
+                    continue
+                
+                # Flip image for more intuitive viewing
+                img = cv2.flip(frame, 1)
+                # Inference runs outside the lock so button presses never wait for it
+                img = self.detector.find_pose(img)
+                with self.lock:
+                    img = process_frame(img, self.detector, self.state)
+                
+                rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+                with self.lock:
+                    self.latest_frame = rgb
+                    self.frame_id += 1
+        finally:
+            cap.release()
+    
+    def snapshot(self):
+        """
+        Latest processed frame and a copy of the tracking state
+        
+        Returns:
+            (frame_id, RGB frame or None, TrackerState)
+        """
+        with self.lock:
+            return self.frame_id, self.latest_frame, replace(self.state, position_buffer=[])
+    
+    def toggle_start_stop(self):
+        with self.lock:
+            toggle_start_stop(self.state)
+    
+    def reset(self):
+        with self.lock:
+            reset_tracker(self.state)
+    
+    def change_exercise(self, exercise_type):
+        with self.lock:
+            change_exercise(self.state, exercise_type)
+
+@st.cache_resource
+def get_processor():
+    """Start the processor once per server; reruns reuse it"""
+    return StreamProcessor()
+
+processor = get_processor()
+_, _, state = processor.snapshot()
 
 # Main app layout
 st.title("🏋️ ML Fitness Tracker")
@@ -429,11 +496,10 @@ st.title("🏋️ ML Fitness Tracker")
 st.sidebar.header("Controls")
 col1, col2 = st.sidebar.columns(2)
 with col1:
-    if st.button("▶️ Start" if not st.session_state.is_running else "⏸️ Pause"):
-        toggle_start_stop()
+    # Callbacks run before the rerun, so the label below already reflects the press
+    st.button("▶️ Start" if not state.is_running else "⏸️ Pause", on_click=processor.toggle_start_stop)
 with col2:
-    if st.button("🔄 Reset"):
-        reset_tracker()
+    st.button("🔄 Reset", on_click=processor.reset)
 
 # Exercise selection
 st.sidebar.header("Exercise Selection")
@@ -441,30 +507,30 @@ exercise_options = list(EXERCISE_CONFIGS.keys())
 selected_exercise = st.sidebar.selectbox(
     "Choose Exercise",
     exercise_options,
-    index=exercise_options.index(st.session_state.exercise_type)
+    index=exercise_options.index(state.exercise_type)
 )
-if selected_exercise != st.session_state.exercise_type:
-    change_exercise(selected_exercise)
+if selected_exercise != state.exercise_type:
+    processor.change_exercise(selected_exercise)
 
-# Statistics panel
+# Statistics panel, filled in by the display loop
 st.sidebar.header("Statistics")
 stats_col1, stats_col2 = st.sidebar.columns(2)
 with stats_col1:
-    st.metric("Repetitions", st.session_state.count)
+    count_placeholder = st.empty()
 with stats_col2:
-    st.metric("Time", str(st.session_state.elapsed_time).split('.')[0])
+    time_placeholder = st.empty()
 
 # Form feedback
 st.sidebar.header("Form Feedback")
-feedback_color = "green" if st.session_state.form_feedback == "Good form" else "red"
-st.sidebar.markdown(f"<p style='color:{feedback_color};'>{st.session_state.form_feedback}</p>", unsafe_allow_html=True)
+feedback_placeholder = st.sidebar.empty()
 
 # Confidence meter
 st.sidebar.header("Detection Confidence")
-st.sidebar.progress(int(st.session_state.confidence_score)/100)
-st.sidebar.text(f"{int(st.session_state.confidence_score)}%")
+confidence_bar = st.sidebar.empty()
+confidence_text = st.sidebar.empty()
 
 # Main content - video feed
+error_placeholder = st.empty()
 video_placeholder = st.empty()
 
 # Instructions
@@ -477,29 +543,25 @@ with st.expander("How to use"):
     5. Follow the form feedback to improve your technique
     """)
 
-# Start webcam
-detector = PoseDetector()
-cap = cv2.VideoCapture(0)
-cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-
-# Main app loop
-try:
-    while True:
-        success, frame = cap.read()
-        if not success:
-            st.error("Failed to access webcam. Please check your camera permissions.")
-            break
-            
-        # Process frame
-        processed_frame = process_frame(frame, detector)
+# Display loop: only pulls results, a widget interaction interrupts it and reruns the script
+last_frame_id = None
+while True:
+    frame_id, frame, state = processor.snapshot()
+    if frame_id != last_frame_id:
+        last_frame_id = frame_id
+        if frame is not None:
+            video_placeholder.image(frame, channels="RGB", use_container_width=True)
         
-        # Display frame
-        video_placeholder.image(cv2.cvtColor(processed_frame, cv2.COLOR_BGR2RGB), channels="RGB", use_column_width=True)
-        
-        # Add a small delay to reduce CPU usage
-        time.sleep(0.03)
-except Exception as e:
-    st.error(f"Error: {e}")
-finally:
-    cap.release()
\ No newline at end of file
+        count_placeholder.metric("Repetitions", state.count)
+        time_placeholder.metric("Time", str(state.elapsed_time).split('.')[0])
+        feedback_color = "green" if state.form_feedback == "Good form" else "red"
+        feedback_placeholder.markdown(f"<p style='color:{feedback_color};'>{state.form_feedback}</p>",
+                                      unsafe_allow_html=True)
+        confidence_bar.progress(min(int(state.confidence_score), 100)/100)
+        confidence_text.text(f"{int(state.confidence_score)}%")
+        if state.error:
+            error_placeholder.error(state.error)
+        else:
+            error_placeholder.empty()
+    
+    time.sleep(0.03)
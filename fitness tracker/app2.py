@@ -1,6 +1,5 @@
-from flask import Flask, Response, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request, redirect, url_for
 import cv2
-import mediapipe as mp
 import numpy as np
 import time
 from datetime import timedelta
@@ -8,8 +7,25 @@ import threading
 import queue
 import os
 import logging
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, asdict, field, replace
+from collections import deque
 import json
+import secrets
+import atexit
+import metrics
+from landmark_recording import LandmarkRecorder
+from jpeg_encoding import JpegEncoder, JpegDecoder, SUBSAMPLING_MODES
+from inference_pool import InferencePool
+from session_store import SessionStore
+from signal_filters import make_filter
+from rep_engine import RepCounter, rep_percentage
+from multi_pose import MODEL_URL, MultiPoseDetector, CentroidTracker
+
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:
+    Sock = None
 
 # Configure logging
 logging.basicConfig(
@@ -20,9 +36,43 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Global variables for tracking state
-global_frame = None
-command_queue = queue.Queue()
+# MediaPipe takes about a second to import. It is loaded on first use by
+# load_mediapipe, or ahead of time by prewarm, so the server answers
+# requests before it has finished loading.
+mp = None
+
+def load_mediapipe():
+    """Import MediaPipe on first use and return the module"""
+    global mp
+    if mp is None:
+        import mediapipe
+        mp = mediapipe
+    return mp
+# WebSocket transport of the landmark stream, Server-Sent Events are used without flask-sock
+sock = Sock(app) if Sock is not None else None
+
+# Performance metrics exposed on /metrics
+STAGE_SECONDS = metrics.Histogram(
+    "fitness_stage_seconds", "Per-frame latency of each processing stage in seconds", ["stage"])
+FRAMES_DROPPED = metrics.Counter(
+    "fitness_frames_dropped_total", "Frames replaced before the next stage took them", ["stage"])
+CAMERA_ERRORS = metrics.Counter("fitness_camera_errors_total", "Failed camera reads")
+CONNECTED_CLIENTS = metrics.Gauge(
+    "fitness_connected_clients",
+    "Connected streaming clients: /video_feed viewers plus Server-Sent Events and WebSocket listeners")
+ACTIVE_SESSIONS = metrics.Gauge("fitness_active_sessions", "Tracking sessions in the registry")
+MODEL_COMPLEXITY = metrics.Gauge("fitness_model_complexity", "Current MediaPipe Pose model complexity")
+
+# Histogram children bound once so the hot path skips the label lookup
+CAPTURE_WAIT_SECONDS = STAGE_SECONDS.labels(stage="capture_wait")
+COLOR_CONVERSION_SECONDS = STAGE_SECONDS.labels(stage="bgr_to_rgb")
+POSE_PROCESS_SECONDS = STAGE_SECONDS.labels(stage="pose_process")
+LANDMARK_EXTRACTION_SECONDS = STAGE_SECONDS.labels(stage="landmark_extraction")
+RULE_EVALUATION_SECONDS = STAGE_SECONDS.labels(stage="rule_evaluation")
+DRAWING_SECONDS = STAGE_SECONDS.labels(stage="drawing")
+ENCODE_SECONDS = STAGE_SECONDS.labels(stage="encode")
+DECODE_SECONDS = STAGE_SECONDS.labels(stage="decode")
+SOCKET_WRITE_SECONDS = STAGE_SECONDS.labels(stage="socket_write")
 
 @dataclass
 class ExerciseState:
@@ -33,9 +83,84 @@ class ExerciseState:
     status: str = "PAUSED"
     confidence_score: float = 0.0
     form_feedback: str = "Waiting to detect form..."
+    model_complexity: int = 2
+    inference_ms: float = 0.0
+    complexity_switches: list = field(default_factory=list)  # Most recent governor decisions
+    inference_interval: int = 1  # Frames per pose inference, predicted in between
+    prediction_drift: dict = field(default_factory=dict)  # Mean drift in px by exercise and horizon
+    angle_filter_lag_ms: float = 0.0  # Delay the angle smoothing adds to rep detection
+    people: list = field(default_factory=list)  # Per-person counts and form of group sessions
+    error: str = None  # Why the frame pipeline stopped, None while it runs
+
+# Number of landmarks produced by MediaPipe Pose
+NUM_LANDMARKS = 33
+
+# MediaPipe Pose skeleton edges, kept here so drawing a skeleton does not load MediaPipe
+POSE_CONNECTIONS = (
+    (0, 1), (0, 4), (1, 2), (2, 3), (3, 7), (4, 5), (5, 6), (6, 8), (9, 10),
+    (11, 12), (11, 13), (11, 23), (12, 14), (12, 24), (13, 15), (14, 16),
+    (15, 17), (15, 19), (15, 21), (16, 18), (16, 20), (16, 22), (17, 19), (18, 20),
+    (23, 24), (23, 25), (24, 26), (25, 27), (26, 28), (27, 29), (27, 31),
+    (28, 30), (28, 32), (29, 31), (30, 32)
+)
+
+# Frame rate the complexity governor tries to hold, 0 disables it
+TARGET_FPS = float(os.environ.get("FITNESS_TARGET_FPS", 15))
+
+# Run pose inference every N frames ("auto" adapts N to motion speed)
+INFERENCE_INTERVAL = os.environ.get("FITNESS_INFERENCE_INTERVAL", "1")
+
+# Crop inference to the tracked body instead of the whole frame (opt-in, it changes detection results)
+ROI_CROPPING = os.environ.get("FITNESS_ROI_CROPPING", "0") == "1"
+
+# Default JPEG settings for /video_feed, overridable per stream with query parameters
+JPEG_QUALITY = int(os.environ.get("FITNESS_JPEG_QUALITY", 80))
+JPEG_SUBSAMPLING = os.environ.get("FITNESS_JPEG_SUBSAMPLING", "420")
+
+# Pose inference worker processes shared by all sessions, 0 runs inference in-process
+INFERENCE_WORKERS = int(os.environ.get("FITNESS_INFERENCE_WORKERS", 0))
+
+# Seconds a session may go unused before it is evicted
+SESSION_IDLE_TIMEOUT = float(os.environ.get("FITNESS_SESSION_IDLE_TIMEOUT", 600))
+
+# Most live sessions besides the default one; each runs its own inference pipeline
+MAX_SESSIONS = int(os.environ.get("FITNESS_MAX_SESSIONS", 8))
+
+# Session the unscoped routes act on
+DEFAULT_SESSION = "default"
+
+# Maximum state stream events per second and client, 0 sends every change
+STATE_MAX_RATE = float(os.environ.get("FITNESS_STATE_MAX_RATE", 10))
 
-# Initialize the global state
-global_state = ExerciseState()
+# Directory for landmark recordings of live sessions, unset disables recording
+RECORD_DIR = os.environ.get("FITNESS_RECORD_DIR")
+
+# Directory for the server's own files, independent of the directory it is started from
+DATA_DIR = os.environ.get("FITNESS_DATA_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data"))
+
+# SQLite database keeping session and rep history, relative to DATA_DIR, empty disables it
+SESSION_DB = os.environ.get("FITNESS_SESSION_DB", "fitness_sessions.db")
+if SESSION_DB:
+    SESSION_DB = os.path.join(DATA_DIR, SESSION_DB)
+
+# Run new sessions without drawing or encoding video, results only through the JSON API
+HEADLESS = os.environ.get("FITNESS_HEADLESS", "0") == "1"
+
+# Restart the server when a source file changes, doubles the startup time
+RELOAD = os.environ.get("FITNESS_RELOAD", "0") == "1"
+
+# PoseLandmarker model bundle used by sessions that track several people, relative to
+# DATA_DIR. It is a separate download (multi_pose.MODEL_URL); without it only one person is tracked.
+POSE_MODEL = os.path.join(DATA_DIR, os.environ.get("FITNESS_POSE_MODEL", "pose_landmarker_full.task"))
+
+# Most people a group session tracks
+MAX_PEOPLE = 8
+
+# Largest JPEG a browser may upload to the frame-ingest endpoints
+INGEST_MAX_BYTES = int(os.environ.get("FITNESS_INGEST_MAX_BYTES", 2 * 1024 * 1024))
+
+# Reps kept in memory per tracker for the stats, the full history is in the session store
+REP_HISTORY_SIZE = 200
 
 @dataclass
 class ExerciseConfig:
@@ -45,6 +170,11 @@ class ExerciseConfig:
     down_threshold: int
     secondary_angle_points: list = None  # For additional angle validation
     form_cues: dict = None  # Form cues and feedback
+    angle_filter: dict = None  # Smoothing of the primary angle for make_filter, None uses DEFAULT_ANGLE_FILTER
+    landmark_filter: dict = None  # Smoothing of the landmark pixel coordinates, None leaves them raw
+
+# Angle smoothing used unless an exercise configures its own
+DEFAULT_ANGLE_FILTER = {"type": "moving_average", "window": 5}
 
 # Define exercises with enhanced configuration
 EXERCISE_CONFIGS = {
@@ -121,17 +251,272 @@ EXERCISE_CONFIGS = {
     )
 }
 
+@dataclass
+class FormEvaluation:
+    """Angles and form checks for one frame, produced by CompiledExercise.evaluate"""
+    angles: np.ndarray  # One angle per unique triplet
+    primary_angle: float
+    secondary_angle: float  # None when the exercise has no secondary triplet
+    cue_visible: np.ndarray  # Visibility gate per form cue
+    cue_passed: np.ndarray  # Tolerance check per form cue
+    form_issues: list  # Feedback for visible cues outside tolerance
+    avg_visibility: float  # Mean visibility of the primary and secondary points
+
+class CompiledExercise:
+    """
+    ExerciseConfig compiled into index arrays, so every angle, visibility
+    gate and tolerance check for a frame comes from one batched NumPy pass
+    """
+    def __init__(self, config, visibility_threshold=0.65):
+        """
+        Compile an exercise configuration
+        
+        Args:
+            config: ExerciseConfig to compile
+            visibility_threshold: Minimum visibility for a form cue to be checked
+        """
+        self.config = config
+        self.visibility_threshold = visibility_threshold
+        cues = list(config.form_cues.items()) if config.form_cues else []
+        
+        # Deduplicate triplets shared by the rep angle, symmetry check and form cues
+        triplets = [tuple(config.angle_points)]
+        if config.secondary_angle_points:
+            triplets.append(tuple(config.secondary_angle_points))
+        triplets.extend(tuple(cue["points"]) for _, cue in cues)
+        unique = list(dict.fromkeys(triplets))
+        
+        self.triplets = np.array(unique, dtype=np.intp).reshape(-1, 3)
+        if self.triplets.size and (self.triplets.min() < 0 or self.triplets.max() >= NUM_LANDMARKS):
+            raise ValueError(f"Landmark index out of range in exercise {config.name}")
+        
+        self.primary_index = unique.index(tuple(config.angle_points))
+        self.secondary_index = (unique.index(tuple(config.secondary_angle_points))
+                                if config.secondary_angle_points else None)
+        self.key_points = np.array(config.angle_points + (config.secondary_angle_points or []), dtype=np.intp)
+        
+        self.cue_names = [name for name, _ in cues]
+        self.cue_index = np.array([unique.index(tuple(cue["points"])) for _, cue in cues], dtype=np.intp)
+        self.cue_ideal = np.array([cue["ideal_angle"] for _, cue in cues], dtype=np.float32)
+        self.cue_tolerance = np.array([cue["tolerance"] for _, cue in cues], dtype=np.float32)
+        self.cue_feedback = [cue["feedback"] for _, cue in cues]
+    
+    def evaluate(self, landmarks):
+        """
+        Evaluate all angles and form cues for one frame
+        
+        Args:
+            landmarks: (33, 4) array of [x, y, z, visibility] rows
+            
+        Returns:
+            FormEvaluation for the frame
+        """
+        points = landmarks[self.triplets]  # (K, 3, 4)
+        vertex = points[:, 1, :2]
+        first = points[:, 0, :2] - vertex
+        third = points[:, 2, :2] - vertex
+        
+        # Same result as find_angle: the absolute angle folded into 0-180
+        angles = np.abs(np.degrees(np.arctan2(third[:, 1], third[:, 0]) - np.arctan2(first[:, 1], first[:, 0])))
+        angles = np.minimum(angles, 360 - angles)
+        
+        visible = points[:, :, 3].min(axis=1) >= self.visibility_threshold
+        cue_angles = angles[self.cue_index]
+        cue_visible = visible[self.cue_index]
+        cue_passed = np.abs(cue_angles - self.cue_ideal) <= self.cue_tolerance
+        failed = cue_visible & ~cue_passed
+        
+        return FormEvaluation(
+            angles=angles,
+            primary_angle=float(angles[self.primary_index]),
+            secondary_angle=None if self.secondary_index is None else float(angles[self.secondary_index]),
+            cue_visible=cue_visible,
+            cue_passed=cue_passed,
+            form_issues=[self.cue_feedback[i] for i in np.flatnonzero(failed)],
+            avg_visibility=float(landmarks[self.key_points, 3].mean())
+        )
+
+# Compiled evaluators, filled on first use by FitnessTracker.get_compiled_exercise
+COMPILED_EXERCISES = {}
+
+@dataclass
+class FrameAnalysis:
+    """Result of analyzing one frame, consumed by the render stage"""
+    frame: np.ndarray
+    fps: float = 0.0
+    error: bool = False
+    landmarks: np.ndarray = None  # Copy of the landmark array, None when no pose was found
+    predicted: bool = False  # Landmarks were extrapolated instead of inferred
+    angle: float = None  # Raw primary angle
+    angle_coords: list = None  # Pixel coordinates of the primary angle points
+    smoothed_angle: float = None
+    percentage: float = None  # Rep completion, None when key points are missing
+    timestamp: float = 0.0  # Tracker clock time of the frame
+    frame_size: tuple = None  # (width, height) of the frame the landmarks are in
+    rep: dict = None  # Rep completed on this frame
+    person_id: int = None  # Person of a group session the analysis belongs to
+    # Snapshot of tracker state for the HUD
+    exercise_type: str = "pushup"
+    count: int = 0
+    elapsed_time: str = "0:00:00"
+    is_running: bool = False
+    rep_stage: str = "waiting"
+    form_feedback: str = ""
+    confidence_score: float = 0.0
+    
+    def to_dict(self):
+        """Structured result for the JSON API, without the frame"""
+        return {
+            "timestamp": round(self.timestamp, 3),
+            "fps": round(self.fps, 1),
+            "error": self.error,
+            "has_pose": self.landmarks is not None,
+            "predicted": self.predicted,
+            "landmarks": np.round(self.landmarks, 3).tolist() if self.landmarks is not None else None,
+            "angle": None if self.angle is None else round(float(self.angle), 1),
+            "smoothed_angle": None if self.smoothed_angle is None else round(float(self.smoothed_angle), 1),
+            "percentage": None if self.percentage is None else round(float(self.percentage), 1),
+            "rep": self.rep,
+            "exercise_type": self.exercise_type,
+            "count": self.count,
+            "elapsed_time": self.elapsed_time,
+            "is_running": self.is_running,
+            "rep_stage": self.rep_stage,
+            "form_feedback": self.form_feedback,
+            "confidence_score": round(self.confidence_score, 1)
+        }
+    
+    def to_landmark_payload(self):
+        """
+        Compact result for drawing the skeleton and HUD in the browser, a few
+        hundred bytes of JSON per frame
+        
+        Returns:
+            Dictionary with the landmarks as a flat [x, y, visibility %, ...]
+            integer list in pixels of the mirrored frame, the primary angle
+            points and the HUD state
+        """
+        landmarks = None
+        if self.landmarks is not None:
+            packed = np.empty((len(self.landmarks), 3), dtype=np.int32)
+            np.rint(self.landmarks[:, :2], out=packed[:, :2], casting="unsafe")
+            np.rint(self.landmarks[:, 3] * 100, out=packed[:, 2], casting="unsafe")
+            landmarks = packed.ravel().tolist()
+        return {
+            "t": round(self.timestamp, 3),
+            "size": self.frame_size,
+            "landmarks": landmarks,
+            "angle_coords": ([[round(x), round(y)] for x, y in self.angle_coords]
+                             if self.percentage is not None else None),
+            "angle": None if self.angle is None else round(float(self.angle)),
+            "percentage": None if self.percentage is None else round(float(self.percentage)),
+            "rep": self.rep["rep"] if self.rep else None,
+            "exercise_type": self.exercise_type,
+            "count": self.count,
+            "elapsed_time": self.elapsed_time,
+            "is_running": self.is_running,
+            "rep_stage": self.rep_stage,
+            "form_feedback": self.form_feedback,
+            "confidence_score": round(self.confidence_score),
+            "fps": round(self.fps),
+            "error": self.error
+        }
+
+class ComplexityGovernor:
+    """
+    Chooses MediaPipe model_complexity from measured inference latency.
+    Steps down when the rolling mean exceeds the frame budget and back up
+    when it falls well below it. The gap between the two thresholds, a full
+    window of fresh samples and a cooldown after every switch keep it from
+    thrashing.
+    """
+    def __init__(self, target_fps=15, min_complexity=0, max_complexity=2, window=30,
+                 downgrade_ratio=1.0, upgrade_ratio=0.4, cooldown=5.0):
+        """
+        Initialize the governor
+        
+        Args:
+            target_fps: Frame rate to hold, sets the per-frame budget
+            min_complexity: Lowest model complexity to use
+            max_complexity: Highest model complexity to use
+            window: Number of latency samples averaged per decision
+            downgrade_ratio: Step down when mean latency exceeds budget * ratio
+            upgrade_ratio: Step up when mean latency is below budget * ratio
+            cooldown: Minimum seconds between switches
+        """
+        self.budget = 1.0 / target_fps
+        self.min_complexity = min_complexity
+        self.max_complexity = max_complexity
+        self.downgrade_ratio = downgrade_ratio
+        self.upgrade_ratio = upgrade_ratio
+        self.cooldown = cooldown
+        self.samples = deque(maxlen=window)
+        self.last_switch = time.monotonic()
+        self.switches = deque(maxlen=10)
+    
+    @property
+    def mean_latency(self):
+        """Rolling mean inference latency in seconds"""
+        return sum(self.samples) / len(self.samples) if self.samples else 0.0
+    
+    def observe(self, latency, complexity):
+        """
+        Record one inference latency and decide whether to switch
+        
+        Args:
+            latency: Seconds spent in pose inference for the frame
+            complexity: Model complexity that produced the sample
+            
+        Returns:
+            New model complexity, or None to keep the current one
+        """
+        self.samples.append(latency)
+        if len(self.samples) < self.samples.maxlen:
+            return None
+        now = time.monotonic()
+        if now - self.last_switch < self.cooldown:
+            return None
+        
+        mean_latency = self.mean_latency
+        if mean_latency > self.budget * self.downgrade_ratio and complexity > self.min_complexity:
+            new_complexity = complexity - 1
+        elif mean_latency < self.budget * self.upgrade_ratio and complexity < self.max_complexity:
+            new_complexity = complexity + 1
+        else:
+            return None
+        
+        self.switches.append({
+            "time": time.strftime("%H:%M:%S"),
+            "from": complexity,
+            "to": new_complexity,
+            "mean_ms": round(mean_latency * 1000, 1),
+            "budget_ms": round(self.budget * 1000, 1)
+        })
+        logger.info(f"Model complexity {complexity} -> {new_complexity} "
+                    f"(mean inference {mean_latency * 1000:.1f} ms, budget {self.budget * 1000:.1f} ms)")
+        # Samples from the old graph say nothing about the new one
+        self.samples.clear()
+        self.last_switch = now
+        return new_complexity
+
 class PoseDetector:
     """
     Handles pose detection using MediaPipe Pose model
     """
+    runs_model = True  # False for detectors whose landmarks come from elsewhere
+    
     def __init__(self, 
                  static_image_mode=False, 
                  model_complexity=2,  # Increased for better accuracy
                  smooth_landmarks=True,
                  enable_segmentation=False,
                  min_detection_confidence=0.6,  # Increased for more stable detection
-                 min_tracking_confidence=0.6):  # Increased for more stable tracking
+                 min_tracking_confidence=0.6,  # Increased for more stable tracking
+                 governor=None,
+                 roi_cropping=False,
+                 roi_padding=0.25,
+                 inference_pool=None,
+                 stream_id=None):
         """
         Initialize pose detector with MediaPipe
         
@@ -142,6 +527,12 @@ class PoseDetector:
             enable_segmentation: Whether to enable segmentation
             min_detection_confidence: Minimum confidence for detection
             min_tracking_confidence: Minimum confidence for tracking
+            governor: Optional ComplexityGovernor that adapts model_complexity
+            roi_cropping: Whether to run inference on a crop around the
+                previously tracked body instead of the whole frame
+            roi_padding: Padding added around the body, as a fraction of its size
+            inference_pool: Optional InferencePool running the graph in a worker process
+            stream_id: Identifier pinning this detector's stream to one pool worker
         """
         self.static_image_mode = static_image_mode
         self.model_complexity = model_complexity
@@ -149,12 +540,49 @@ class PoseDetector:
         self.enable_segmentation = enable_segmentation
         self.min_detection_confidence = min_detection_confidence
         self.min_tracking_confidence = min_tracking_confidence
-        
-        self.mp_pose = mp.solutions.pose
-        self.mp_drawing = mp.solutions.drawing_utils
-        self.mp_drawing_styles = mp.solutions.drawing_styles
-        
-        self.pose = self.mp_pose.Pose(
+        self.governor = governor
+        self.inference_time = 0.0
+        self.roi_cropping = roi_cropping
+        self.roi_padding = roi_padding
+        self.roi = None  # (x0, y0, x1, y1) crop for the next inference, None for full frame
+        self.active_roi = None  # Crop the current results are relative to
+        self.inference_pool = inference_pool
+        self.stream_id = stream_id if stream_id is not None else str(id(self))
+        
+        self.pose = self._build_pose()
+        
+        # Landmarks as (x_px, y_px, z, visibility) rows, overwritten in place every frame
+        self.landmarks = np.zeros((NUM_LANDMARKS, 4), dtype=np.float32)
+        self.has_landmarks = False
+        self._landmark_list = None
+        self.results = None
+        self._rgb = None  # Color conversion output, reused while the region size is unchanged
+    
+    @property
+    def landmark_list(self):
+        """
+        Legacy [id, x, y, visibility] list view of the landmarks, built
+        lazily on first access after each find_position call
+        """
+        if self._landmark_list is None:
+            self._landmark_list = [[id, int(x), int(y), float(v)]
+                                   for id, (x, y, z, v) in enumerate(self.landmarks)] if self.has_landmarks else []
+        return self._landmark_list
+    
+    def _build_pose(self):
+        """Create the MediaPipe Pose graph for the current settings"""
+        if self.inference_pool is not None:
+            return self.inference_pool.pose(
+                self.stream_id,
+                static_image_mode=self.static_image_mode,
+                model_complexity=self.model_complexity,
+                smooth_landmarks=self.smooth_landmarks,
+                enable_segmentation=self.enable_segmentation,
+                min_detection_confidence=self.min_detection_confidence,
+                min_tracking_confidence=self.min_tracking_confidence
+            )
+        mp = load_mediapipe()
+        return mp.solutions.pose.Pose(
             static_image_mode=self.static_image_mode,
             model_complexity=self.model_complexity,
             smooth_landmarks=self.smooth_landmarks,
@@ -162,9 +590,36 @@ class PoseDetector:
             min_detection_confidence=self.min_detection_confidence,
             min_tracking_confidence=self.min_tracking_confidence
         )
+    
+    def set_model_complexity(self, model_complexity):
+        """
+        Rebuild the Pose graph with a different model complexity
         
-        self.landmark_list = []
+        Args:
+            model_complexity: Model complexity (0, 1, or 2)
+        """
+        if model_complexity == self.model_complexity:
+            return
+        self.model_complexity = model_complexity
+        if self.inference_pool is not None:
+            # Rebuilt in place so the stream keeps its worker
+            self.pose.reconfigure(model_complexity=model_complexity)
+            return
+        self.pose.close()
+        self.pose = self._build_pose()
+    
+    def reset(self):
+        """Clear MediaPipe's tracking state, e.g. before starting a new video"""
+        self.pose.reset()
+        self.has_landmarks = False
+        self._landmark_list = None
         self.results = None
+        self.roi = None
+        self.active_roi = None
+    
+    def close(self):
+        """Release the pose graph"""
+        self.pose.close()
     
     def find_pose(self, img, draw=True):
         """
@@ -177,19 +632,114 @@ class PoseDetector:
         Returns:
             Processed image with landmarks drawn (if draw=True)
         """
-        img_rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-        self.results = self.pose.process(img_rgb)
+        start = time.perf_counter()
+        self.results = self._process_region(img, self.roi if self.roi_cropping else None)
+        if self.active_roi is not None and not self.results.pose_landmarks:
+            # Tracking lost inside the crop, fall back to full-frame detection
+            self.roi = None
+            self.pose.reset()
+            self.results = self._process_region(img, None)
+        self.inference_time = time.perf_counter() - start
+        
+        if self.governor is not None:
+            new_complexity = self.governor.observe(self.inference_time, self.model_complexity)
+            if new_complexity is not None:
+                self.set_model_complexity(new_complexity)
+        
+        if draw:
+            self.draw_pose(self._region(img, self.active_roi), self.results.pose_landmarks)
+        
+        return img
+    
+    def _region(self, img, roi):
+        """View of the image inside roi, or the whole image when roi is None"""
+        if roi is None:
+            return img
+        x0, y0, x1, y1 = roi
+        return img[y0:y1, x0:x1]
+    
+    def _process_region(self, img, roi):
+        """
+        Run MediaPipe Pose on a region of the image
+        
+        Args:
+            img: Input image (BGR)
+            roi: (x0, y0, x1, y1) crop, or None for the whole image
+            
+        Returns:
+            MediaPipe results with coordinates normalized to the region
+        """
+        self.active_roi = roi
+        # Only the cropped pixels go through color conversion and the model
+        start = time.perf_counter()
+        region = self._region(img, roi)
+        if self._rgb is None or self._rgb.shape != region.shape:
+            self._rgb = np.empty(region.shape, dtype=np.uint8)
+        img_rgb = cv2.cvtColor(region, cv2.COLOR_BGR2RGB, dst=self._rgb)
+        converted = time.perf_counter()
+        results = self.pose.process(img_rgb)
+        COLOR_CONVERSION_SECONDS.observe(converted - start)
+        POSE_PROCESS_SECONDS.observe(time.perf_counter() - converted)
+        return results
+    
+    def _update_roi(self, w, h, visibility_threshold=0.5):
+        """
+        Choose the crop for the next inference from the current landmarks.
+        The crop is sticky: it only moves when the body nears its edge or
+        becomes much smaller than it, because every move resets MediaPipe's
+        own tracking and smoothing.
+        
+        Args:
+            w, h: Full frame size
+            visibility_threshold: Minimum visibility for a landmark to count
+        """
+        visible = self.landmarks[:, 3] >= visibility_threshold
+        if not visible.any():
+            self.roi = None
+            return
+        xs = self.landmarks[visible, 0]
+        ys = self.landmarks[visible, 1]
+        bx0, bx1, by0, by1 = float(xs.min()), float(xs.max()), float(ys.min()), float(ys.max())
+        
+        if self.roi is not None:
+            x0, y0, x1, y1 = self.roi
+            mx, my = 0.05 * (x1 - x0), 0.05 * (y1 - y0)
+            # Edges on the frame border cannot be crossed, so they need no margin
+            inside = ((x0 == 0 or bx0 >= x0 + mx) and (x1 == w or bx1 <= x1 - mx) and
+                      (y0 == 0 or by0 >= y0 + my) and (y1 == h or by1 <= y1 - my))
+            large_enough = (bx1 - bx0) * (by1 - by0) >= 0.2 * (x1 - x0) * (y1 - y0)
+            if inside and large_enough:
+                return
+        
+        pad_x = max(32, (bx1 - bx0) * self.roi_padding)
+        pad_y = max(32, (by1 - by0) * self.roi_padding)
+        roi = (max(0, int(bx0 - pad_x)), max(0, int(by0 - pad_y)),
+               min(w, int(bx1 + pad_x)), min(h, int(by1 + pad_y)))
+        
+        # Not worth cropping when the body fills most of the frame
+        if (roi[2] - roi[0]) * (roi[3] - roi[1]) >= 0.9 * w * h:
+            roi = None
+        if roi != self.roi:
+            self.roi = roi
+            self.pose.reset()
+    
+    def draw_pose(self, img, pose_landmarks):
+        """
+        Draw pose landmarks and connections
         
-        if self.results.pose_landmarks and draw:
+        Args:
+            img: Image to draw on
+            pose_landmarks: MediaPipe landmarks from a previous find_pose call
+        """
+        if pose_landmarks:
             # Enhanced drawing style
-            self.mp_drawing.draw_landmarks(
+            mp = load_mediapipe()
+            mp.solutions.drawing_utils.draw_landmarks(
                 img, 
-                self.results.pose_landmarks, 
-                self.mp_pose.POSE_CONNECTIONS,
-                landmark_drawing_spec=self.mp_drawing_styles.get_default_pose_landmarks_style()
+                pose_landmarks, 
+                mp.solutions.pose.POSE_CONNECTIONS,
+                landmark_drawing_spec=mp.solutions.drawing_styles.get_default_pose_landmarks_style()
             )
-        
-        return img
     
     def find_position(self, img, draw=False):
         """
@@ -200,18 +750,76 @@ class PoseDetector:
             draw: Whether to draw landmark points
             
         Returns:
-            List of landmark positions [id, x, y, visibility]
+            (33, 4) float32 array of [x, y, z, visibility] rows in pixel
+            coordinates, or an empty (0, 4) view when no pose was found
+        """
+        self._landmark_list = None
+        self.has_landmarks = bool(self.results and self.results.pose_landmarks)
+        if not self.has_landmarks:
+            self.roi = None
+            return self.landmarks[:0]
+        
+        # Copy the whole result into the preallocated array in one assignment
+        h, w, c = img.shape
+        array = getattr(self.results.pose_landmarks, "array", None)
+        if array is not None:
+            # Pool workers already return an array
+            self.landmarks[:] = array
+        else:
+            self.landmarks[:] = [(lm.x, lm.y, lm.z, lm.visibility)
+                                 for lm in self.results.pose_landmarks.landmark]
+        if self.active_roi is None:
+            self.landmarks[:, 0] *= w
+            self.landmarks[:, 1] *= h
+        else:
+            # Map crop-normalized coordinates back to full-frame pixels
+            x0, y0, x1, y1 = self.active_roi
+            self.landmarks[:, 0] = self.landmarks[:, 0] * (x1 - x0) + x0
+            self.landmarks[:, 1] = self.landmarks[:, 1] * (y1 - y0) + y0
+        
+        if self.roi_cropping:
+            self._update_roi(w, h)
+        
+        if draw:
+            for cx, cy in self.landmarks[:, :2].astype(np.int32):
+                cv2.circle(img, (int(cx), int(cy)), 5, (255, 0, 0), cv2.FILLED)
+        
+        return self.landmarks
+    
+    def load_landmarks(self, landmarks):
+        """
+        Replace the current landmarks without running inference
+        
+        Args:
+            landmarks: (33, 4) array of [x, y, z, visibility] rows in pixel
+                coordinates, or None to clear them
         """
-        self.landmark_list = []
-        if self.results and self.results.pose_landmarks:
-            h, w, c = img.shape
-            for id, lm in enumerate(self.results.pose_landmarks.landmark):
-                cx, cy = int(lm.x * w), int(lm.y * h)
-                self.landmark_list.append([id, cx, cy, lm.visibility])
-                if draw:
-                    cv2.circle(img, (cx, cy), 5, (255, 0, 0), cv2.FILLED)
+        self._landmark_list = None
+        self.has_landmarks = landmarks is not None
+        if self.has_landmarks:
+            self.landmarks[:] = landmarks
+    
+    def draw_skeleton(self, img, landmarks, visibility_threshold=0.5):
+        """
+        Draw pose connections and joints from a landmark array
         
-        return self.landmark_list
+        Args:
+            img: Image to draw on
+            landmarks: (33, 4) array of [x, y, z, visibility] rows in pixel coordinates
+            visibility_threshold: Minimum visibility for a landmark to be drawn
+        """
+        points = landmarks[:, :2].astype(np.int32).tolist()
+        visible = (landmarks[:, 3] >= visibility_threshold).tolist()
+        
+        for start, end in POSE_CONNECTIONS:
+            if visible[start] and visible[end]:
+                cv2.line(img, points[start], points[end], (224, 224, 224), 2)
+        
+        # Left side landmarks have odd indices, right side even (nose is 0)
+        for id, (point, is_visible) in enumerate(zip(points, visible)):
+            if is_visible:
+                color = (0, 138, 255) if id % 2 else (231, 217, 0)
+                cv2.circle(img, point, 4, color, cv2.FILLED)
     
     def find_angle(self, img, p1, p2, p3, draw=True):
         """
@@ -225,16 +833,16 @@ class PoseDetector:
         Returns:
             Angle in degrees
         """
-        if len(self.landmark_list) <= max(p1, p2, p3):
+        if not self.has_landmarks or max(p1, p2, p3) >= NUM_LANDMARKS:
             return 0
             
         # Get landmarks
-        x1, y1 = self.landmark_list[p1][1:3]
-        x2, y2 = self.landmark_list[p2][1:3]
-        x3, y3 = self.landmark_list[p3][1:3]
+        x1, y1 = self.landmarks[p1, :2]
+        x2, y2 = self.landmarks[p2, :2]
+        x3, y3 = self.landmarks[p3, :2]
         
         # Calculate angle
-        angle = np.degrees(np.arctan2(y3 - y2, x3 - x2) - np.arctan2(y1 - y2, x1 - x2))
+        angle = float(np.degrees(np.arctan2(y3 - y2, x3 - x2) - np.arctan2(y1 - y2, x1 - x2)))
         if angle < 0:
             angle += 360
             
@@ -244,25 +852,38 @@ class PoseDetector:
         
         # Draw
         if draw:
-            # Draw lines between points
-            cv2.line(img, (x1, y1), (x2, y2), (255, 255, 255), 3)
-            cv2.line(img, (x3, y3), (x2, y2), (255, 255, 255), 3)
-            
-            # Draw circles at points
-            cv2.circle(img, (x1, y1), 10, (0, 0, 255), cv2.FILLED)
-            cv2.circle(img, (x2, y2), 10, (0, 255, 0), cv2.FILLED)
-            cv2.circle(img, (x3, y3), 10, (0, 0, 255), cv2.FILLED)
-            
-            # Add outlines for better visibility
-            cv2.circle(img, (x1, y1), 15, (0, 0, 255), 2)
-            cv2.circle(img, (x2, y2), 15, (0, 255, 0), 2)
-            cv2.circle(img, (x3, y3), 15, (0, 0, 255), 2)
-            
-            # Display angle
-            cv2.putText(img, f'{int(angle)}°', (x2 - 50, y2 + 50),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+            self.draw_angle(img, [(x1, y1), (x2, y2), (x3, y3)], angle)
         
         return angle
+    
+    def draw_angle(self, img, points, angle):
+        """
+        Draw the angle visualization for three points
+        
+        Args:
+            img: Image to draw on
+            points: Pixel coordinates [(x1, y1), (x2, y2), (x3, y3)], vertex second
+            angle: Angle in degrees to display
+        """
+        (x1, y1), (x2, y2), (x3, y3) = [(int(x), int(y)) for x, y in points]
+        
+        # Draw lines between points
+        cv2.line(img, (x1, y1), (x2, y2), (255, 255, 255), 3)
+        cv2.line(img, (x3, y3), (x2, y2), (255, 255, 255), 3)
+        
+        # Draw circles at points
+        cv2.circle(img, (x1, y1), 10, (0, 0, 255), cv2.FILLED)
+        cv2.circle(img, (x2, y2), 10, (0, 255, 0), cv2.FILLED)
+        cv2.circle(img, (x3, y3), 10, (0, 0, 255), cv2.FILLED)
+        
+        # Add outlines for better visibility
+        cv2.circle(img, (x1, y1), 15, (0, 0, 255), 2)
+        cv2.circle(img, (x2, y2), 15, (0, 255, 0), 2)
+        cv2.circle(img, (x3, y3), 15, (0, 0, 255), 2)
+        
+        # Display angle
+        cv2.putText(img, f'{int(angle)}°', (x2 - 50, y2 + 50),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
         
     def check_visibility(self, landmark_indices, threshold=0.65):
         """
@@ -275,13 +896,10 @@ class PoseDetector:
         Returns:
             Boolean indicating if landmarks are sufficiently visible
         """
-        if not self.landmark_list:
+        if not self.has_landmarks or max(landmark_indices) >= NUM_LANDMARKS:
             return False
             
-        for idx in landmark_indices:
-            if idx >= len(self.landmark_list) or self.landmark_list[idx][3] < threshold:
-                return False
-        return True
+        return bool(np.all(self.landmarks[landmark_indices, 3] >= threshold))
         
     def check_form(self, img, form_cue):
         """
@@ -311,13 +929,239 @@ class PoseDetector:
         
         return is_good_form, angle, feedback if not is_good_form else "Good form"
 
+class AssignedPoseDetector(PoseDetector):
+    """
+    PoseDetector that runs no model: its owner assigns the landmarks of each
+    frame, e.g. a GroupTracker from its multi-person inference or a replay
+    from a recording. MediaPipe is never loaded for it.
+    """
+    runs_model = False
+    
+    def __init__(self):
+        """Initialize without a MediaPipe graph"""
+        super().__init__()
+        self.assigned = None  # (33, 4) landmarks served by the next find_position call, None for no pose
+    
+    def _build_pose(self):
+        """No graph, the landmarks are assigned"""
+        return None
+    
+    def reset(self):
+        """Forget the current landmarks"""
+        self.load_landmarks(None)
+        self.assigned = None
+    
+    def close(self):
+        """Nothing to release"""
+    
+    def find_pose(self, img, draw=True):
+        """Inference is skipped, the landmarks are assigned"""
+        self.inference_time = 0.0
+        return img
+    
+    def find_position(self, img, draw=False):
+        """
+        Load the assigned landmarks
+        
+        Returns:
+            (33, 4) landmark array, or an empty (0, 4) view when none were assigned
+        """
+        self.load_landmarks(self.assigned)
+        return self.landmarks if self.has_landmarks else self.landmarks[:0]
+
+class FrameClock:
+    """
+    Clock driven by frame timestamps instead of the wall clock, so elapsed
+    times stay correct when recorded video is processed faster than real time
+    """
+    def __init__(self, start=0.0):
+        """
+        Initialize the clock
+        
+        Args:
+            start: Initial timestamp in seconds
+        """
+        self.now = start
+    
+    def set(self, timestamp):
+        """
+        Advance the clock to a frame timestamp
+        
+        Args:
+            timestamp: Frame timestamp in seconds
+        """
+        self.now = timestamp
+    
+    def __call__(self):
+        """Return the current frame timestamp"""
+        return self.now
+
+class LandmarkPredictor:
+    """
+    Constant-velocity extrapolation of the landmark array, used to fill the
+    frames between pose inferences
+    """
+    def __init__(self):
+        """Initialize an empty predictor"""
+        self.last = np.zeros((NUM_LANDMARKS, 4), dtype=np.float32)
+        self.velocity = np.zeros((NUM_LANDMARKS, 3), dtype=np.float32)
+        self.prediction = np.zeros((NUM_LANDMARKS, 4), dtype=np.float32)
+        self.last_time = None
+        self.has_velocity = False
+    
+    def reset(self):
+        """Forget the tracked pose, e.g. after tracking was lost"""
+        self.last_time = None
+        self.has_velocity = False
+    
+    def update(self, landmarks, timestamp):
+        """
+        Record inferred landmarks and refresh the velocity estimate
+        
+        Args:
+            landmarks: (33, 4) array from inference
+            timestamp: Frame time in seconds
+        """
+        if self.last_time is not None and timestamp > self.last_time:
+            np.subtract(landmarks[:, :3], self.last[:, :3], out=self.velocity)
+            self.velocity /= timestamp - self.last_time
+            self.has_velocity = True
+        self.last[:] = landmarks
+        self.last_time = timestamp
+    
+    def predict(self, timestamp):
+        """
+        Extrapolate the landmarks to a frame time
+        
+        Args:
+            timestamp: Frame time in seconds
+            
+        Returns:
+            (33, 4) predicted landmark array, reused between calls
+        """
+        self.prediction[:] = self.last
+        if self.has_velocity:
+            self.prediction[:, :3] += self.velocity * (timestamp - self.last_time)
+        return self.prediction
+    
+    def drift(self, landmarks, timestamp, visibility_threshold=0.5):
+        """
+        Measure how far the prediction for a frame is from inferred landmarks
+        
+        Args:
+            landmarks: (33, 4) array from inference for the same frame
+            timestamp: Frame time in seconds
+            visibility_threshold: Minimum visibility for a landmark to count
+            
+        Returns:
+            Mean pixel distance over visible landmarks
+        """
+        predicted = self.predict(timestamp)
+        visible = landmarks[:, 3] >= visibility_threshold
+        if not visible.any():
+            return 0.0
+        error = np.linalg.norm(predicted[visible, :2] - landmarks[visible, :2], axis=1)
+        return float(error.mean())
+    
+    def speed(self):
+        """Mean landmark speed in pixels per second"""
+        if not self.has_velocity:
+            return 0.0
+        return float(np.linalg.norm(self.velocity[:, :2], axis=1).mean())
+
+class FrameBufferPool:
+    """
+    Free list of frame-sized buffers, so the per-frame flip and HUD drawing
+    reuse memory instead of allocating a new frame every time. Whoever is
+    done with a frame last hands it back with release.
+    """
+    def __init__(self, max_free=8):
+        """
+        Initialize an empty pool
+        
+        Args:
+            max_free: Most idle buffers to keep
+        """
+        self.max_free = max_free
+        self._free = deque()  # Appends and pops are atomic, no lock needed
+        self.allocations = 0
+    
+    def acquire(self, shape, dtype=np.uint8):
+        """
+        Get a buffer, reusing a released one when its shape matches
+        
+        Args:
+            shape: Frame shape
+            dtype: Frame data type
+            
+        Returns:
+            Uninitialized array of the given shape
+        """
+        while True:
+            try:
+                buffer = self._free.pop()
+            except IndexError:
+                break
+            if buffer.shape == shape and buffer.dtype == dtype:
+                return buffer
+        # Nothing to reuse, e.g. at startup or after the resolution changed
+        self.allocations += 1
+        return np.empty(shape, dtype=dtype)
+    
+    def release(self, buffer):
+        """
+        Return a buffer nobody uses anymore
+        
+        Args:
+            buffer: Array obtained from acquire
+        """
+        if len(self._free) < self.max_free:
+            self._free.append(buffer)
+
 class FitnessTracker:
     """
     Main class for tracking fitness exercises
     """
-    def __init__(self):
-        """Initialize the fitness tracker"""
-        self.detector = PoseDetector()
+    def __init__(self, detector=None, clock=time.time, inference_interval=1,
+                 max_inference_interval=4, drift_budget_px=6.0, recorder=None,
+                 state=None, state_stream=None, frame_pool=None, session_store=None,
+                 session_id=None):
+        """
+        Initialize the fitness tracker
+        
+        Args:
+            detector: PoseDetector to use, a new one is created if omitted
+            clock: Callable returning the current time in seconds. Pass a
+                FrameClock to drive timing from frame timestamps.
+            inference_interval: Run pose inference every N frames and predict
+                landmarks in between, or "auto" to adapt N to motion speed
+            max_inference_interval: Upper bound on N in "auto" mode
+            drift_budget_px: Per-frame landmark motion allowed per skipped
+                inference in "auto" mode
+            recorder: Optional LandmarkRecorder receiving every analyzed frame
+            state: ExerciseState updated after every frame, a new one if omitted
+            state_stream: Optional StateStream the state is published to
+            frame_pool: FrameBufferPool the flipped frames come from, a new one if omitted
+            session_store: Optional SessionStore completed reps are saved to
+            session_id: Session the reps are saved under
+        """
+        self.detector = detector if detector is not None else PoseDetector()
+        self.clock = clock
+        self.inference_interval = inference_interval
+        self.max_inference_interval = max_inference_interval
+        self.drift_budget_px = drift_budget_px
+        self.recorder = recorder
+        self.state = state if state is not None else ExerciseState()
+        self.state_stream = state_stream
+        self.frame_pool = frame_pool if frame_pool is not None else FrameBufferPool()
+        self.session_store = session_store
+        self.session_id = session_id
+        self._last_output = None  # Frame returned by the previous process_frame call
+        self.current_interval = 1 if inference_interval == "auto" else int(inference_interval)
+        self.frames_since_inference = 0
+        self.frame_period = 0.0  # Smoothed seconds between frames
+        self.predictor = LandmarkPredictor()
+        self.prediction_drift = {}  # exercise -> {horizon: [total_px, samples]}
         self.count = 0
         self.dir = 0  # 0 for going down, 1 for going up
         self.exercise_type = "pushup"  # Default exercise
@@ -327,20 +1171,34 @@ class FitnessTracker:
         self.prev_time = 0
         self.confidence_score = 0.0
         self.form_feedback = "Waiting to detect form..."
-        self.rep_history = []  # Store data about each rep for analysis
+        self.rep_history = deque(maxlen=REP_HISTORY_SIZE)  # Most recent reps, for analysis
+        # Copy of rep_history for request threads, replaced whenever it changes so
+        # readers never iterate the deque while the inference thread appends to it
+        self.rep_snapshot = ()
         self.display_debug = False  # Toggle for debug visualization
+        self.reset_count = 0  # Number of resets, lets a replay reproduce them
         
         # Rep detection state
-        self.position_buffer = []  # Buffer for smoothing angle values
-        self.buffer_size = 5
+        self.angle_filter = None  # Built from the exercise config by update_filters
+        self.landmark_filter = None
+        self._filter_config = None  # ExerciseConfig the filters were built from
         self.rep_started = False
-        self.rep_stage = "waiting"  # waiting, down, up
+        self.rep_counter = RepCounter()
+        self.rep_stage = "waiting"  # waiting, down
         self.last_angle = 0
         
     def get_exercise_config(self):
         """Get configuration for current exercise type"""
         return EXERCISE_CONFIGS.get(self.exercise_type, EXERCISE_CONFIGS["pushup"])
     
+    def get_compiled_exercise(self):
+        """Get the compiled evaluator for the current exercise type"""
+        exercise_config = self.get_exercise_config()
+        compiled = COMPILED_EXERCISES.get(exercise_config.name)
+        if compiled is None:
+            compiled = COMPILED_EXERCISES[exercise_config.name] = CompiledExercise(exercise_config)
+        return compiled
+    
     def process_frame(self, img):
         """
         Process a video frame for exercise tracking
@@ -349,147 +1207,303 @@ class FitnessTracker:
             img: Input frame from camera
             
         Returns:
-            Processed frame with overlays
+            Processed frame with overlays. The buffer is reused by the next
+            call, copy it to keep it longer.
         """
         if img is None or img.size == 0:
             logger.warning("Empty frame received")
             return np.zeros((480, 640, 3), dtype=np.uint8)
-            
-        # Flip image for more intuitive viewing
-        img = cv2.flip(img, 1)
         
-        # Get original dimensions for overlay positioning
-        h, w, c = img.shape
+        if self._last_output is not None:
+            self.frame_pool.release(self._last_output)
+        self._last_output = self.render_frame(self.analyze_frame(img))
+        return self._last_output
+    
+    def analyze_frame(self, img, flip=True):
+        """
+        Run pose inference and the exercise rules on a frame without drawing
         
-        try:
-            # Find pose landmarks
-            img = self.detector.find_pose(img)
-            self.detector.find_position(img)
+        Args:
+            img: Input frame from camera
+            flip: Mirror the frame into a frame_pool buffer first. False
+                analyzes an already mirrored frame as it is, without a copy.
             
+        Returns:
+            FrameAnalysis snapshot used by render_frame. When flipped, its
+            frame comes from frame_pool and should be released once it has
+            been displayed.
+        """
+        # Flip image for more intuitive viewing, into a reused buffer
+        if flip:
+            img = cv2.flip(img, 1, dst=self.frame_pool.acquire(img.shape, img.dtype))
+        analysis = FrameAnalysis(frame=img)
+        
+        try:
             # Calculate current FPS
-            current_time = time.time()
-            fps = 1 / (current_time - self.prev_time) if self.prev_time > 0 else 0
+            current_time = self.clock()
+            analysis.fps = 1 / (current_time - self.prev_time) if self.prev_time > 0 else 0
+            if self.prev_time > 0:
+                self.frame_period = 0.9 * self.frame_period + 0.1 * (current_time - self.prev_time) \
+                    if self.frame_period else current_time - self.prev_time
             self.prev_time = current_time
+            analysis.timestamp = current_time
+            analysis.frame_size = (img.shape[1], img.shape[0])
             
-            # Overlay semi-transparent background for UI elements
-            overlay = img.copy()
-            cv2.rectangle(overlay, (0, 0), (w, 130), (0, 0, 0), -1)
-            cv2.rectangle(overlay, (0, h-60), (w, h), (0, 0, 0), -1)
-            img = cv2.addWeighted(overlay, 0.3, img, 0.7, 0)
+            # Find pose landmarks, or predict them between inferences
+            analysis.predicted = self.update_landmarks(img, current_time)
+            if self.detector.has_landmarks:
+                analysis.landmarks = self.detector.landmarks.copy()
             
-            if len(self.detector.landmark_list) > 0:
-                exercise_config = self.get_exercise_config()
-                
-                # Primary angle detection
-                p1, p2, p3 = exercise_config.angle_points
+            exercise_config = self.get_exercise_config()
+            self.update_filters(exercise_config)
+            if self.landmark_filter is not None:
+                if self.detector.has_landmarks:
+                    # Recordings keep the raw landmarks, replay filters them again
+                    landmarks = self.detector.landmarks
+                    landmarks[:, :2] = self.landmark_filter(landmarks[:, :2], current_time)
+                else:
+                    self.landmark_filter.reset()
+            
+            if self.detector.has_landmarks:
                 up_threshold = exercise_config.up_threshold
                 down_threshold = exercise_config.down_threshold
                 
-                # Check if required points are visible
-                key_points = exercise_config.angle_points.copy()
-                if exercise_config.secondary_angle_points:
-                    key_points.extend(exercise_config.secondary_angle_points)
+                # All angles, visibility gates and form checks in one batched pass
+                rule_start = time.perf_counter()
+                evaluation = self.get_compiled_exercise().evaluate(self.detector.landmarks)
+                angle = evaluation.primary_angle
+                analysis.angle = angle
+                analysis.angle_coords = self.detector.landmarks[exercise_config.angle_points, :2].tolist()
                 
-                if all(point < len(self.detector.landmark_list) for point in key_points):
-                    # Calculate primary angle
-                    angle = self.detector.find_angle(img, p1, p2, p3)
-                    
-                    # Add to buffer for smoothing
-                    self.position_buffer.append(angle)
-                    if len(self.position_buffer) > self.buffer_size:
-                        self.position_buffer.pop(0)
-                    
-                    # Calculate smoothed angle
-                    smoothed_angle = sum(self.position_buffer) / len(self.position_buffer)
-                    
-                    # Calculate secondary angle for symmetry check if available
-                    symmetry_score = 1.0
-                    if exercise_config.secondary_angle_points:
-                        s1, s2, s3 = exercise_config.secondary_angle_points
-                        sec_angle = self.detector.find_angle(img, s1, s2, s3, draw=False)
-                        # Calculate symmetry score (1.0 = perfect symmetry)
-                        angle_diff = abs(angle - sec_angle)
-                        symmetry_score = max(0, 1.0 - (angle_diff / 180))
-                    
-                    # Convert angle to rep percentage
-                    percentage = np.interp(smoothed_angle, (down_threshold, up_threshold), (0, 100))
-                    
-                    # Check form
-                    form_issues = []
-                    if exercise_config.form_cues:
-                        for cue_name, cue_params in exercise_config.form_cues.items():
-                            is_good, measured_angle, feedback = self.detector.check_form(img, cue_params)
-                            if is_good is False:  # Explicitly check for False (not None)
-                                form_issues.append(feedback)
-                    
-                    self.form_feedback = ", ".join(form_issues) if form_issues else "Good form"
-                    
-                    # Calculate overall confidence score based on visibility and symmetry
-                    visibility_scores = [self.detector.landmark_list[p][3] for p in key_points 
-                                         if p < len(self.detector.landmark_list)]
-                    avg_visibility = sum(visibility_scores) / len(visibility_scores) if visibility_scores else 0
-                    
-                    # Combined score (70% visibility, 30% symmetry)
-                    self.confidence_score = (0.7 * avg_visibility + 0.3 * symmetry_score) * 100
-                    
-                    # Count reps with improved detection algorithm
-                    if self.is_running:
-                        # Get elapsed time
-                        if self.start_time:
-                            self.elapsed_time = timedelta(seconds=int(time.time() - self.start_time))
-                        
-                        # Rep detection state machine
-                        if percentage <= 10 and self.rep_stage != "down":
-                            self.rep_stage = "down"
-                        elif percentage >= 90 and self.rep_stage == "down":
-                            self.rep_stage = "up"
-                            self.count += 1
-                            
-                            # Store rep data for analysis
-                            self.rep_history.append({
-                                "time": str(self.elapsed_time),
-                                "confidence": self.confidence_score,
-                                "form_issues": form_issues
-                            })
-                            
-                            # Reset to waiting state
-                            self.rep_stage = "waiting"
-                    
-                    # Draw exercise feedback
-                    self.draw_exercise_feedback(img, percentage, smoothed_angle)
-            
-            # Draw UI elements
-            self.draw_ui_elements(img, fps)
+                # Smooth the angle with the exercise's filter
+                smoothed_angle = self.angle_filter(angle, current_time)
+                analysis.smoothed_angle = smoothed_angle
+                self.state.angle_filter_lag_ms = round(self.angle_filter.lag * 1000, 1)
+                
+                # Calculate symmetry score (1.0 = perfect symmetry) if a secondary angle is available
+                symmetry_score = 1.0
+                if evaluation.secondary_angle is not None:
+                    angle_diff = abs(angle - evaluation.secondary_angle)
+                    symmetry_score = max(0, 1.0 - (angle_diff / 180))
+                
+                # Convert angle to rep percentage
+                percentage = rep_percentage(smoothed_angle, down_threshold, up_threshold)
+                analysis.percentage = percentage
+                
+                form_issues = evaluation.form_issues
+                self.form_feedback = ", ".join(form_issues) if form_issues else "Good form"
+                
+                # Combined score (70% visibility, 30% symmetry)
+                self.confidence_score = (0.7 * evaluation.avg_visibility + 0.3 * symmetry_score) * 100
+                
+                # Count reps with improved detection algorithm
+                if self.is_running:
+                    count_before = self.count
+                    self.update_rep_state(percentage, form_issues, smoothed_angle)
+                    if self.count != count_before:
+                        analysis.rep = self.rep_history[-1]
+                RULE_EVALUATION_SECONDS.observe(time.perf_counter() - rule_start)
             
-            # Update global state
-            global_state.count = int(self.count)
-            global_state.exercise_type = self.exercise_type
-            global_state.is_running = self.is_running
-            global_state.elapsed_time = str(self.elapsed_time).split('.')[0]
-            global_state.status = "RUNNING" if self.is_running else "PAUSED"
-            global_state.confidence_score = self.confidence_score
-            global_state.form_feedback = self.form_feedback
+            # Update the session state
+            self.state.count = int(self.count)
+            self.state.exercise_type = self.exercise_type
+            self.state.is_running = self.is_running
+            self.state.elapsed_time = str(self.elapsed_time).split('.')[0]
+            self.state.status = "RUNNING" if self.is_running else "PAUSED"
+            self.state.confidence_score = self.confidence_score
+            self.state.form_feedback = self.form_feedback
+            self.state.model_complexity = self.detector.model_complexity
+            if self.detector.runs_model:
+                MODEL_COMPLEXITY.set(self.detector.model_complexity)
+            self.state.inference_ms = round(self.detector.inference_time * 1000, 1)
+            if self.detector.governor is not None:
+                self.state.complexity_switches = list(self.detector.governor.switches)
+            self.state.inference_interval = self.current_interval
+            if self.frames_since_inference == 0 and self.prediction_drift:
+                self.state.prediction_drift = self.get_prediction_drift()
+            if self.state_stream is not None:
+                self.state_stream.publish(self.state)
             
         except Exception as e:
             logger.error(f"Error processing frame: {e}")
-            cv2.putText(img, "Error processing frame", (10, h//2),
-                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            analysis.error = True
+        
+        # Snapshot the HUD values so rendering can run on another thread
+        analysis.exercise_type = self.exercise_type
+        analysis.count = int(self.count)
+        analysis.elapsed_time = str(self.elapsed_time).split('.')[0]
+        analysis.is_running = self.is_running
+        analysis.rep_stage = self.rep_stage
+        analysis.form_feedback = self.form_feedback
+        analysis.confidence_score = self.confidence_score
+        
+        if self.recorder is not None:
+            self.recorder.write(self, analysis)
+        
+        return analysis
+    
+    def update_filters(self, exercise_config):
+        """
+        Build the angle and landmark filters when the exercise configuration changes
+        
+        Args:
+            exercise_config: ExerciseConfig of the current exercise
+        """
+        if exercise_config is self._filter_config:
+            return
+        self.angle_filter = make_filter(exercise_config.angle_filter or DEFAULT_ANGLE_FILTER)
+        self.landmark_filter = make_filter(exercise_config.landmark_filter)
+        self._filter_config = exercise_config
+    
+    def update_rep_state(self, percentage, form_issues, angle=None):
+        """
+        Advance the rep detection state machine by one frame
+        
+        Args:
+            percentage: Rep completion percentage for the frame
+            form_issues: Form feedback to store with a completed rep
+            angle: Smoothed primary angle, for the rep's range of motion
+        """
+        # Get elapsed time
+        now = self.clock()
+        if self.start_time is not None:
+            self.elapsed_time = timedelta(seconds=int(now - self.start_time))
+        
+        # Rep detection state machine, shared with the batch detect_reps
+        completed = self.rep_counter.update(percentage, now, angle)
+        self.rep_stage = self.rep_counter.stage
+        if completed is not None:
+            self.count += 1
+            
+            # Store rep data for analysis
+            rep = {
+                "rep": self.count,
+                "time": str(self.elapsed_time),
+                "confidence": self.confidence_score,
+                "form_issues": form_issues,
+                "duration": round(completed.duration, 3),
+                "min_angle": None if completed.min_angle is None else round(float(completed.min_angle), 1),
+                "max_angle": None if completed.max_angle is None else round(float(completed.max_angle), 1)
+            }
+            self.rep_history.append(rep)
+            self.rep_snapshot = tuple(self.rep_history)
+            if self.session_store is not None:
+                self.session_store.record_rep(self.session_id, self.reset_count, self.exercise_type, self.count, rep)
+    
+    def update_landmarks(self, img, timestamp):
+        """
+        Run pose inference, or extrapolate the last inferred landmarks when
+        the frame falls between inferences
+        
+        Args:
+            img: Flipped input frame
+            timestamp: Frame time in seconds
+            
+        Returns:
+            True if the landmarks were predicted rather than inferred
+        """
+        horizon = self.frames_since_inference + 1
+        if horizon < self.current_interval and self.detector.has_landmarks and self.predictor.has_velocity:
+            self.detector.load_landmarks(self.predictor.predict(timestamp))
+            self.frames_since_inference = horizon
+            return True
+        
+        self.detector.find_pose(img, draw=False)
+        with LANDMARK_EXTRACTION_SECONDS.time():
+            self.detector.find_position(img)
+        self.frames_since_inference = 0
+        
+        if not self.detector.has_landmarks:
+            self.predictor.reset()
+            return False
+        
+        # Inferring every frame predicts nothing, so there is no drift to track
+        if self.inference_interval != "auto" and self.current_interval == 1:
+            return False
+        
+        # Compare what we would have predicted for the skipped frames with the inferred landmarks
+        if horizon > 1 and self.predictor.has_velocity:
+            drift = self.predictor.drift(self.detector.landmarks, timestamp)
+            totals = self.prediction_drift.setdefault(self.exercise_type, {}).setdefault(horizon, [0.0, 0])
+            totals[0] += drift
+            totals[1] += 1
+        self.predictor.update(self.detector.landmarks, timestamp)
+        
+        if self.inference_interval == "auto":
+            # Skip more inferences the less the body moves per frame
+            motion = self.predictor.speed() * self.frame_period
+            interval = self.drift_budget_px / motion if motion > 0 else self.max_inference_interval
+            self.current_interval = int(min(max(interval, 1), self.max_inference_interval))
+        return False
+    
+    def get_prediction_drift(self):
+        """
+        Mean prediction drift per exercise and prediction horizon
+        
+        Returns:
+            {exercise: {horizon_frames: mean_px}}
+        """
+        return {
+            exercise: {horizon: round(total / samples, 2) for horizon, (total, samples) in sorted(horizons.items())}
+            for exercise, horizons in self.prediction_drift.items()
+        }
+    
+    def render_frame(self, analysis):
+        """
+        Draw the skeleton, angle and HUD for an analyzed frame
+        
+        Args:
+            analysis: FrameAnalysis returned by analyze_frame
+            
+        Returns:
+            Processed frame with overlays, drawn in place on analysis.frame
+        """
+        img = analysis.frame
+        h, w, c = img.shape
+        
+        if analysis.error:
+            cv2.putText(img, "Error processing frame", (10, h//2),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            return img
+        
+        try:
+            if analysis.landmarks is not None:
+                self.detector.draw_skeleton(img, analysis.landmarks)
+            
+            # Darken the top and bottom bands behind the UI text, in place. Same
+            # result as blending a black overlay at 30% over rows 0-130 and the last 60.
+            for band in (img[:131], img[h-60:]):
+                cv2.addWeighted(band, 0.7, band, 0.0, 0, dst=band)
+            
+            if analysis.percentage is not None:
+                self.detector.draw_angle(img, analysis.angle_coords, analysis.angle)
+                
+                # Draw exercise feedback
+                self.draw_exercise_feedback(img, analysis)
+            
+            # Draw UI elements
+            self.draw_ui_elements(img, analysis)
+            
+        except Exception as e:
+            logger.error(f"Error rendering frame: {e}")
+            cv2.putText(img, "Error processing frame", (10, h//2),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
         
         return img
         
-    def draw_exercise_feedback(self, img, percentage, angle):
+    def draw_exercise_feedback(self, img, analysis):
         """
         Draw exercise-specific feedback on frame
         
         Args:
             img: Input image
-            percentage: Exercise completion percentage
-            angle: Current angle
+            analysis: FrameAnalysis with the percentage and HUD snapshot
         """
         h, w, c = img.shape
+        percentage = analysis.percentage
         
         # Draw progress bar
-        bar_color = (0, 255, 0) if self.is_running else (0, 165, 255)
+        bar_color = (0, 255, 0) if analysis.is_running else (0, 165, 255)
         cv2.rectangle(img, (w-200, 40), (w-40, 70), (255, 255, 255), 2)
         filled_width = int(160 * (percentage / 100))
         cv2.rectangle(img, (w-200, 40), (w-200 + filled_width, 70), bar_color, cv2.FILLED)
@@ -497,54 +1511,53 @@ class FitnessTracker:
                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
         
         # Draw form feedback
-        if self.form_feedback:
-            feedback_color = (0, 255, 0) if self.form_feedback == "Good form" else (0, 0, 255)
-            cv2.putText(img, self.form_feedback, (10, h-30),
+        if analysis.form_feedback:
+            feedback_color = (0, 255, 0) if analysis.form_feedback == "Good form" else (0, 0, 255)
+            cv2.putText(img, analysis.form_feedback, (10, h-30),
                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, feedback_color, 2)
         
         # Draw confidence score
-        confidence_color = (0, 255, 0) if self.confidence_score > 80 else \
-                          (0, 165, 255) if self.confidence_score > 60 else (0, 0, 255)
-        cv2.putText(img, f"Detection: {int(self.confidence_score)}%", (10, h-10),
+        confidence_color = (0, 255, 0) if analysis.confidence_score > 80 else \
+                          (0, 165, 255) if analysis.confidence_score > 60 else (0, 0, 255)
+        cv2.putText(img, f"Detection: {int(analysis.confidence_score)}%", (10, h-10),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, confidence_color, 2)
         
         # Add rep stage indicator
-        stage_color = (0, 255, 0) if self.rep_stage == "up" else \
-                     (0, 165, 255) if self.rep_stage == "down" else (255, 255, 255)
-        cv2.putText(img, f"Stage: {self.rep_stage.upper()}", (w-200, h-10),
+        stage_color = (0, 255, 0) if analysis.rep_stage == "up" else \
+                     (0, 165, 255) if analysis.rep_stage == "down" else (255, 255, 255)
+        cv2.putText(img, f"Stage: {analysis.rep_stage.upper()}", (w-200, h-10),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, stage_color, 2)
     
-    def draw_ui_elements(self, img, fps):
+    def draw_ui_elements(self, img, analysis):
         """
         Draw UI elements on the frame
         
         Args:
             img: Input image
-            fps: Current frames per second
+            analysis: FrameAnalysis with the FPS and HUD snapshot
         """
         h, w, c = img.shape
         
         # Exercise type
-        cv2.putText(img, f'Exercise: {self.exercise_type.upper()}', (10, 30),
+        cv2.putText(img, f'Exercise: {analysis.exercise_type.upper()}', (10, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2)
         
         # Rep counter with larger font
-        cv2.putText(img, f'Reps: {int(self.count)}', (10, 70),
+        cv2.putText(img, f'Reps: {analysis.count}', (10, 70),
                     cv2.FONT_HERSHEY_SIMPLEX, 1.2, (255, 255, 255), 2)
         
         # Timer
-        time_str = str(self.elapsed_time).split('.')[0]
-        cv2.putText(img, f'Time: {time_str}', (10, 110),
+        cv2.putText(img, f'Time: {analysis.elapsed_time}', (10, 110),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2)
         
         # Status with colored indicator
-        status = "RUNNING" if self.is_running else "PAUSED"
-        status_color = (0, 255, 0) if self.is_running else (0, 0, 255)
+        status = "RUNNING" if analysis.is_running else "PAUSED"
+        status_color = (0, 255, 0) if analysis.is_running else (0, 0, 255)
         cv2.putText(img, status, (w - 150, 30),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.9, status_color, 2)
         
         # FPS counter (smaller and in corner)
-        cv2.putText(img, f'FPS: {int(fps)}', (w - 100, h - 40),
+        cv2.putText(img, f'FPS: {int(analysis.fps)}', (w - 100, h - 40),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
 
     def toggle_start_stop(self):
@@ -552,10 +1565,10 @@ class FitnessTracker:
         self.is_running = not self.is_running
         if self.is_running:
             if self.start_time is None:
-                self.start_time = time.time()
+                self.start_time = self.clock()
             else:
                 # Adjust start time to account for pause time
-                pause_duration = time.time() - (self.start_time + self.elapsed_time.total_seconds())
+                pause_duration = self.clock() - (self.start_time + self.elapsed_time.total_seconds())
                 self.start_time += pause_duration
         logger.info(f"Exercise tracking {'started' if self.is_running else 'paused'}")
     
@@ -564,10 +1577,16 @@ class FitnessTracker:
         self.count = 0
         self.dir = 0
         self.elapsed_time = timedelta(0)
-        self.start_time = time.time() if self.is_running else None
-        self.rep_history = []
-        self.position_buffer = []
+        self.start_time = self.clock() if self.is_running else None
+        self.rep_history.clear()
+        self.rep_snapshot = ()
+        if self.angle_filter is not None:
+            self.angle_filter.reset()
+        if self.landmark_filter is not None:
+            self.landmark_filter.reset()
+        self.rep_counter.reset()
         self.rep_stage = "waiting"
+        self.reset_count += 1
         logger.info("Exercise tracking reset")
     
     def change_exercise(self, exercise_type):
@@ -597,637 +1616,1632 @@ class FitnessTracker:
             "time": str(self.elapsed_time).split('.')[0],
             "exercise_type": self.exercise_type,
             "avg_confidence": sum([rep["confidence"] for rep in self.rep_history]) / len(self.rep_history) if self.rep_history else 0,
-            "rep_history": self.rep_history
+            "rep_history": list(self.rep_history)
+        }
+    
+    def close(self):
+        """Release the pose model"""
+        self.detector.close()
+
+@dataclass
+class GroupAnalysis:
+    """Result of analyzing one frame of a group session, consumed by the render stage"""
+    frame: np.ndarray
+    fps: float = 0.0
+    error: bool = False
+    timestamp: float = 0.0
+    frame_size: tuple = None
+    people: list = field(default_factory=list)  # FrameAnalysis without frame per person in view
+    # Snapshot of group state for the HUD
+    exercise_type: str = "pushup"
+    elapsed_time: str = "0:00:00"
+    is_running: bool = False
+    
+    def to_dict(self):
+        """Structured result for the JSON API, without the frame"""
+        return {
+            "timestamp": round(self.timestamp, 3),
+            "fps": round(self.fps, 1),
+            "error": self.error,
+            "exercise_type": self.exercise_type,
+            "elapsed_time": self.elapsed_time,
+            "is_running": self.is_running,
+            "people": [dict(person.to_dict(), person_id=person.person_id) for person in self.people]
+        }
+    
+    def to_landmark_payload(self):
+        """Compact result for drawing in the browser, one single-person payload per person"""
+        return {
+            "t": round(self.timestamp, 3),
+            "size": self.frame_size,
+            "exercise_type": self.exercise_type,
+            "elapsed_time": self.elapsed_time,
+            "is_running": self.is_running,
+            "fps": round(self.fps),
+            "error": self.error,
+            "people": [dict(person.to_landmark_payload(), person_id=person.person_id) for person in self.people]
         }
 
-def generate_frames():
-    """Generator function to yield video frames"""
-    cap = cv2.VideoCapture(0)
-    # Set resolution to improve performance
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+class GroupTracker:
+    """
+    Tracks several athletes in one camera view. A MultiPoseDetector finds
+    everybody in one inference pass per frame, a CentroidTracker keeps their
+    person IDs stable, and each ID gets its own FitnessTracker holding that
+    person's rep and form state. Offers the FitnessTracker methods the
+    frame pipeline and routes use.
+    """
+    def __init__(self, detector, clock=time.time, state=None, state_stream=None, frame_pool=None,
+                 session_store=None, session_id=None, id_tracker=None):
+        """
+        Initialize the group tracker
+        
+        Args:
+            detector: MultiPoseDetector finding the people
+            clock: Callable returning the current time in seconds
+            state: ExerciseState with the group totals, a new one if omitted
+            state_stream: Optional StateStream the state is published to
+            frame_pool: FrameBufferPool the flipped frames come from, a new one if omitted
+            session_store: Optional SessionStore; each person's reps are saved
+                under the session ID suffixed with ".<person ID>"
+            session_id: Session the group belongs to
+            id_tracker: CentroidTracker assigning the person IDs, a default one if omitted
+        """
+        self.detector = detector
+        self.clock = clock
+        self.state = state if state is not None else ExerciseState()
+        self.state_stream = state_stream
+        self.frame_pool = frame_pool if frame_pool is not None else FrameBufferPool()
+        self.session_store = session_store
+        self.session_id = session_id
+        self.id_tracker = id_tracker if id_tracker is not None else CentroidTracker()
+        self.people = {}  # person ID -> FitnessTracker
+        self.frame_clock = FrameClock()  # Frame time shared by the person trackers
+        self.recorder = None  # Recordings hold a single person, group sessions are not recorded
+        self.exercise_type = "pushup"
+        self.is_running = False
+        self.display_debug = False
+        self.start_time = None
+        self.elapsed_time = timedelta(0)
+        self.prev_time = 0
+        self.count = 0  # Reps of everybody since the last reset
+        self.rep_history = deque(maxlen=REP_HISTORY_SIZE)  # Most recent reps of everybody
+        self.rep_snapshot = ()  # Copy of rep_history for request threads, as in FitnessTracker
     
-    tracker = FitnessTracker()
+    def person_session_id(self, person_id):
+        """Session store ID a person's reps are saved under"""
+        return f"{self.session_id}.{person_id}"
     
-    try:
-        while True:
-            # Check for commands in the queue
-            try:
-                command = command_queue.get_nowait()
-                if command == "start_stop":
-                    tracker.toggle_start_stop()
-                elif command == "reset":
-                    tracker.reset()
-                elif command == "toggle_debug":
-                    tracker.toggle_debug()
-                elif command.startswith("exercise_"):
-                    exercise_type = command.split("_")[1]
-                    tracker.change_exercise(exercise_type)
-            except queue.Empty:
-                pass
-            
-            # Read frame
-            success, frame = cap.read()
-            if not success:
-                logger.error("Failed to capture frame")
-                # Generate blank frame
-                frame = np.zeros((480, 640, 3), dtype=np.uint8)
-                cv2.putText(frame, "Camera Error", (200, 240),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+    def _add_person(self, person_id):
+        """Start tracking a person who came into view"""
+        tracker = FitnessTracker(detector=AssignedPoseDetector(), clock=self.frame_clock,
+                                 frame_pool=self.frame_pool, session_store=self.session_store,
+                                 session_id=self.person_session_id(person_id))
+        tracker.exercise_type = self.exercise_type
+        if self.is_running:
+            tracker.toggle_start_stop()
+        if self.session_store is not None:
+            self.session_store.start_session(tracker.session_id, None)
+        self.people[person_id] = tracker
+        logger.info(f"Person {person_id} joined session {self.session_id}")
+        return tracker
+    
+    def _remove_person(self, person_id):
+        """Stop tracking a person who left the view"""
+        tracker = self.people.pop(person_id, None)
+        if tracker is not None and self.session_store is not None:
+            self.session_store.end_session(tracker.session_id)
+        logger.info(f"Person {person_id} left session {self.session_id}")
+    
+    def analyze_frame(self, img):
+        """
+        Find everybody in a frame and run the exercise rules per person, without drawing
+        
+        Args:
+            img: Input frame from camera
             
-            # Process the frame
-            processed_frame = tracker.process_frame(frame)
+        Returns:
+            GroupAnalysis. Its frame comes from frame_pool and should be
+            released once it has been displayed.
+        """
+        img = cv2.flip(img, 1, dst=self.frame_pool.acquire(img.shape, img.dtype))
+        analysis = GroupAnalysis(frame=img)
+        
+        try:
+            current_time = self.clock()
+            analysis.fps = 1 / (current_time - self.prev_time) if self.prev_time > 0 else 0
+            self.prev_time = current_time
+            analysis.timestamp = current_time
+            analysis.frame_size = (img.shape[1], img.shape[0])
+            self.frame_clock.set(current_time)
+            if self.start_time is not None and self.is_running:
+                self.elapsed_time = timedelta(seconds=int(current_time - self.start_time))
             
-            # Store the frame globally
-            global global_frame
-            global_frame = processed_frame
+            # One inference pass for everybody, then cheap per-person rules
+            with POSE_PROCESS_SECONDS.time():
+                landmarks = self.detector.detect(img, current_time)
+            person_ids = self.id_tracker.update(landmarks, analysis.frame_size)
+            for person_id in self.id_tracker.expired:
+                self._remove_person(person_id)
             
-            # Convert to JPEG for streaming
-            ret, buffer = cv2.imencode('.jpg', processed_frame)
-            if not ret:
-                continue
-                
-            frame_bytes = buffer.tobytes()
+            for person_id, person_landmarks in zip(person_ids, landmarks):
+                tracker = self.people.get(person_id) or self._add_person(person_id)
+                tracker.detector.assigned = person_landmarks
+                count_before = tracker.count
+                person = replace(tracker.analyze_frame(img, flip=False), frame=None, person_id=person_id)
+                if tracker.count != count_before:
+                    self.count += 1
+                    self.rep_history.append(dict(person.rep, rep=self.count, person_rep=person.rep["rep"],
+                                                 person_id=person_id))
+                    self.rep_snapshot = tuple(self.rep_history)
+                analysis.people.append(person)
+            analysis.people.sort(key=lambda person: person.person_id)
             
-            yield (b'--frame\r\n'
-                  b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-    except Exception as e:
-        logger.error(f"Error in frame generation: {e}")
-    finally:
-        cap.release()
-
-# Flask Routes
-@app.route('/')
-def index():
-    """Render main application page"""
-    return render_template('index.html')
-
-@app.route('/video_feed')
-def video_feed():
-    """Video streaming route"""
-    return Response(generate_frames(),
-                    mimetype='multipart/x-mixed-replace; boundary=frame')
-
-@app.route('/start_stop')
-def start_stop():
-    """API endpoint to start/stop exercise tracking"""
-    command_queue.put("start_stop")
-    return jsonify({"status": "success"})
-
-@app.route('/reset')
-def reset():
-    """API endpoint to reset exercise tracking"""
-    command_queue.put("reset")
-    return jsonify({"status": "success"})
-
-@app.route('/toggle_debug')
-def toggle_debug():
-    """API endpoint to toggle debug visualization"""
-    command_queue.put("toggle_debug")
-    return jsonify({"status": "success"})
-
-@app.route('/exercise/<exercise_type>')
-def change_exercise(exercise_type):
-    """API endpoint to change exercise type"""
-    if exercise_type in EXERCISE_CONFIGS:
-        command_queue.put(f"exercise_{exercise_type}")
-        return jsonify({"status": "success"})
-    return jsonify({"status": "error", "message": "Invalid exercise type"})
-
-@app.route('/get_state')
-def get_state():
-    """API endpoint to get current state"""
-    return jsonify(asdict(global_state))
-
-@app.route('/get_stats')
-def get_stats():
-    """API endpoint to get exercise statistics"""
-    # This would need to be modified to access tracker's stats
-    return jsonify({
-        "count": global_state.count,
-        "time": global_state.elapsed_time,
-        "exercise_type": global_state.exercise_type,
-        "confidence_score": global_state.confidence_score,
-        "form_feedback": global_state.form_feedback
-    })
-
-@app.route('/available_exercises')
-def available_exercises():
-    """API endpoint to get available exercises"""
-    return jsonify({
-        "exercises": list(EXERCISE_CONFIGS.keys())
-    })
-
-def create_templates():
-    """Create templates directory and HTML file"""
-    if not os.path.exists('templates'):
-        os.makedirs('templates')
-    
-    with open('templates/index.html', 'w') as f:
-        f.write('''
-<!DOCTYPE html>
-<html lang="en">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>ML Fitness Tracker</title>
-    <link href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css" rel="stylesheet">
-    <style>
-        :root {
-            --primary: #4361ee;
-            --success: #38b000;
-            --warning: #ff9500;
-            --danger: #ef233c;
-            --dark: #212529;
-            --light: #f8f9fa;
-        }
-        
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-        }
+            self.update_state(analysis)
+        except Exception as e:
+            logger.error(f"Error processing group frame: {e}")
+            analysis.error = True
         
-        body {
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-            margin: 0;
-            padding: 0;
-            background-color: #f0f4f8;
-            color: var(--dark);
-        }
+        analysis.exercise_type = self.exercise_type
+        analysis.elapsed_time = str(self.elapsed_time).split('.')[0]
+        analysis.is_running = self.is_running
+        return analysis
+    
+    def update_state(self, analysis):
+        """Publish the group totals and the state of each person in view"""
+        people = analysis.people
+        self.state.count = self.count
+        self.state.exercise_type = self.exercise_type
+        self.state.is_running = self.is_running
+        self.state.elapsed_time = str(self.elapsed_time).split('.')[0]
+        self.state.status = "RUNNING" if self.is_running else "PAUSED"
+        self.state.confidence_score = (sum(person.confidence_score for person in people) / len(people)
+                                       if people else 0.0)
+        self.state.form_feedback = (f"Tracking {len(people)} {'person' if len(people) == 1 else 'people'}"
+                                    if people else "Waiting to detect form...")
+        self.state.inference_ms = round(self.detector.inference_time * 1000, 1)
+        self.state.people = [{
+            "person_id": person.person_id,
+            "count": person.count,
+            "rep_stage": person.rep_stage,
+            "form_feedback": person.form_feedback,
+            "confidence_score": round(person.confidence_score, 1)
+        } for person in people]
+        if self.state_stream is not None:
+            self.state_stream.publish(self.state)
+    
+    def render_frame(self, analysis):
+        """
+        Draw every person's skeleton and rep label, and the group HUD
         
-        .container {
-            max-width: 1200px;
-            margin: 0 auto;
-            padding: 20px;
-        }
+        Args:
+            analysis: GroupAnalysis returned by analyze_frame
+            
+        Returns:
+            Processed frame with overlays, drawn in place on analysis.frame
+        """
+        img = analysis.frame
+        h, w, c = img.shape
+        if analysis.error:
+            cv2.putText(img, "Error processing frame", (10, h//2),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+            return img
         
-        header {
-            background-color: var(--primary);
-            color: white;
-            padding: 15px 0;
-            border-radius: 8px;
-            margin-bottom: 20px;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-        }
+        try:
+            band = img[:90]
+            cv2.addWeighted(band, 0.7, band, 0.0, 0, dst=band)
+            for person in analysis.people:
+                tracker = self.people.get(person.person_id)
+                if tracker is None or person.landmarks is None:
+                    continue
+                tracker.detector.draw_skeleton(img, person.landmarks)
+                if person.percentage is not None:
+                    tracker.detector.draw_angle(img, person.angle_coords, person.angle)
+                
+                # Label above the head: ID, reps and form
+                x, y = person.landmarks[0, :2].astype(int).tolist()
+                y = max(y - 40, 110)
+                cv2.putText(img, f"#{person.person_id}  Reps: {person.count}", (x - 60, y),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+                if person.form_feedback:
+                    color = (0, 255, 0) if person.form_feedback == "Good form" else (0, 0, 255)
+                    cv2.putText(img, person.form_feedback, (x - 60, y + 22),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+            
+            cv2.putText(img, f'Exercise: {analysis.exercise_type.upper()}', (10, 30),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2)
+            cv2.putText(img, f'People: {len(analysis.people)}  Time: {analysis.elapsed_time}', (10, 70),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.9, (255, 255, 255), 2)
+            status = "RUNNING" if analysis.is_running else "PAUSED"
+            cv2.putText(img, status, (w - 150, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.9,
+                        (0, 255, 0) if analysis.is_running else (0, 0, 255), 2)
+            cv2.putText(img, f'FPS: {int(analysis.fps)}', (w - 100, h - 20),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        except Exception as e:
+            logger.error(f"Error rendering group frame: {e}")
+        return img
+    
+    def toggle_start_stop(self):
+        """Start or pause tracking for everybody"""
+        self.is_running = not self.is_running
+        if self.is_running:
+            if self.start_time is None:
+                self.start_time = self.clock()
+            else:
+                self.start_time = self.clock() - self.elapsed_time.total_seconds()
+        for tracker in self.people.values():
+            tracker.toggle_start_stop()
+    
+    def reset(self):
+        """Reset everybody's counts; the people in view stay tracked"""
+        self.count = 0
+        self.elapsed_time = timedelta(0)
+        self.start_time = self.clock() if self.is_running else None
+        self.rep_history.clear()
+        self.rep_snapshot = ()
+        for tracker in self.people.values():
+            tracker.reset()
+    
+    def change_exercise(self, exercise_type):
+        """
+        Change the exercise of everybody
         
-        h1 {
-            text-align: center;
-            margin: 0;
-            font-size: 24px;
-            letter-spacing: 1px;
+        Args:
+            exercise_type: New exercise type
+        """
+        if exercise_type not in EXERCISE_CONFIGS:
+            logger.warning(f"Invalid exercise type: {exercise_type}")
+            return
+        self.exercise_type = exercise_type
+        for tracker in self.people.values():
+            tracker.exercise_type = exercise_type
+        self.reset()
+    
+    def toggle_debug(self):
+        """Toggle debug visualization mode"""
+        self.display_debug = not self.display_debug
+    
+    def get_exercise_stats(self):
+        """Get statistics about the current exercise session, per person"""
+        return {
+            "count": self.count,
+            "time": str(self.elapsed_time).split('.')[0],
+            "exercise_type": self.exercise_type,
+            "people": {person_id: tracker.get_exercise_stats() for person_id, tracker in self.people.items()},
+            "rep_history": list(self.rep_history)
         }
+    
+    def close(self):
+        """Release the pose model and end the stored sessions of the people in view"""
+        for person_id in list(self.people):
+            self._remove_person(person_id)
+        self.detector.close()
+
+class FrameBroadcaster:
+    """
+    Holds the latest encoded video frame and wakes every waiting subscriber
+    when a new one is published
+    """
+    def __init__(self):
+        """Initialize an empty broadcast buffer"""
+        self._condition = threading.Condition()
+        self._frame = None
+        self._sequence = 0
         
-        .content-wrapper {
-            display: flex;
-            flex-direction: column;
-            gap: 20px;
-        }
+    def publish(self, frame_bytes):
+        """
+        Replace the latest frame and notify subscribers
         
-        @media (min-width: 992px) {
-            .content-wrapper {
-                flex-direction: row;
-            }
-        }
+        Args:
+            frame_bytes: Fully framed multipart chunk for one JPEG
+        """
+        with self._condition:
+            self._frame = frame_bytes
+            self._sequence += 1
+            self._condition.notify_all()
+    
+    @property
+    def sequence(self):
+        """Sequence number of the latest frame, 0 before the first"""
+        return self._sequence
+    
+    def wait_for_frame(self, last_sequence, timeout=1.0):
+        """
+        Block until a frame newer than last_sequence is published
         
-        .video-container {
-            flex: 1;
-            background-color: #000;
-            border-radius: 8px;
-            overflow: hidden;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-        }
+        Args:
+            last_sequence: Sequence number of the last frame the caller saw
+            timeout: Maximum seconds to wait
+            
+        Returns:
+            (sequence, frame_bytes), frame_bytes is None on timeout
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._sequence != last_sequence, timeout)
+            if self._sequence == last_sequence:
+                return last_sequence, None
+            return self._sequence, self._frame
+
+class StateStream:
+    """
+    Publishes ExerciseState snapshots to /state_stream clients, but only
+    when a field shown on the page changes. Telemetry that moves on every
+    frame (inference time, drift) rides along without triggering events.
+    """
+    # Fields whose change triggers an event; the confidence is compared as a whole percent
+    WATCHED_FIELDS = ("count", "exercise_type", "is_running", "elapsed_time", "status", "form_feedback")
+    
+    def __init__(self, state):
+        """
+        Initialize with the current state
         
-        .video-container img {
-            width: 100%;
-            height: auto;
-            display: block;
-        }
+        Args:
+            state: ExerciseState to publish first
+        """
+        self._condition = threading.Condition()
+        self._key = None
+        self._payload = None
+        self._version = 0
+        self.publish(state)
+    
+    def publish(self, state):
+        """
+        Publish the state if a watched field changed since the last call
         
-        .controls-container {
-            flex: 0 0 300px;
-            display: flex;
-            flex-direction: column;
-            gap: 20px;
-        }
+        Args:
+            state: Current ExerciseState
+        """
+        key = tuple(getattr(state, name) for name in self.WATCHED_FIELDS) + (round(state.confidence_score),)
+        if key == self._key:
+            return
+        payload = json.dumps(asdict(state))
+        with self._condition:
+            self._key = key
+            self._payload = payload
+            self._version += 1
+            self._condition.notify_all()
+    
+    def wait_for_update(self, last_version, timeout=15.0):
+        """
+        Block until a state newer than last_version is published
         
-        .panel {
-            background-color: white;
-            border-radius: 8px;
-            padding: 20px;
-            box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-        }
+        Args:
+            last_version: Version of the last state the caller sent
+            timeout: Maximum seconds to wait
+            
+        Returns:
+            (version, json_payload), json_payload is None on timeout
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._version != last_version, timeout)
+            if self._version == last_version:
+                return last_version, None
+            return self._version, self._payload
+
+class LatestSlot:
+    """
+    Single-item hand-off between pipeline stages. Putting a new item replaces
+    one that has not been taken yet, so producers never block on consumers.
+    """
+    def __init__(self, name=None, on_drop=None):
+        """
+        Initialize an empty slot
         
-        .panel-header {
-            margin-bottom: 15px;
-            padding-bottom: 10px;
-            border-bottom: 1px solid #e0e0e0;
-            display: flex;
-            justify-content: space-between;
-            align-items: center;
-        }
+        Args:
+            name: Stage label for the dropped-frames metric
+            on_drop: Optional callable receiving each item replaced before it was taken
+        """
+        self._condition = threading.Condition()
+        self._item = None
+        self._has_item = False
+        self.dropped = 0
+        self._dropped_counter = FRAMES_DROPPED.labels(stage=name) if name else None
+        self.on_drop = on_drop
+    
+    def put(self, item):
+        """
+        Store an item, overwriting any unread one
         
-        .panel-title {
-            font-size: 18px;
-            font-weight: 600;
-            margin: 0;
-        }
+        Args:
+            item: Item to hand to the next stage
+        """
+        with self._condition:
+            dropped = self._item if self._has_item else None
+            if self._has_item:
+                self.dropped += 1
+                if self._dropped_counter:
+                    self._dropped_counter.inc()
+            self._item = item
+            self._has_item = True
+            self._condition.notify()
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+    
+    def get(self, timeout=1.0):
+        """
+        Take the newest item
         
-        .controls {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 10px;
-        }
+        Args:
+            timeout: Maximum seconds to wait
+            
+        Returns:
+            The item, or None on timeout
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._has_item, timeout):
+                return None
+            item = self._item
+            self._item = None
+            self._has_item = False
+            return item
+
+class CameraCapture:
+    """
+    Reads one camera on a background thread and hands every frame to all
+    attached LatestSlots, so sessions watching the same camera share it.
+    The camera is released as soon as nothing is attached.
+    """
+    def __init__(self, camera_index):
+        """
+        Initialize the capture
         
-        button {
-            padding: 10px;
-            font-size: 15px;
-            cursor: pointer;
-            background-color: var(--primary);
-            color: white;
-            border: none;
-            border-radius: 4px;
-            transition: all 0.2s ease;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            gap: 5px;
-        }
-        
-        button:hover {
-            filter: brightness(1.1);
-            transform: translateY(-1px);
-        }
-        
-        button:active {
-            transform: translateY(1px);
-        }
-        
-        .btn-start-stop {
-            grid-column: span 2;
-        }
-        
-        .btn-start-stop.running {
-            background-color: var(--danger);
-        }
-        
-        .btn-reset {
-            background-color: var(--warning);
-        }
-        
-        .btn-debug {
-            background-color: var(--dark);
-        }
-        
-        .exercise-btn {
-            background-color: var(--success);
-        }
-        
-        .stats {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 20px;
-        }
-        
-        .stat {
-            text-align: center;
-        }
-        
-        .stat-value {
-            font-size: 26px;
-            font-weight: bold;
-            margin: 5px 0;
-            color: var(--primary);
-        }
-        
-        .stat-label {
-            font-size: 14px;
-            color: #666;
-            text-transform: uppercase;
-        }
-        
-        .progress-container {
-            margin-top: 10px;
-        }
-        
-        .progress-label {
-            display: flex;
-            justify-content: space-between;
-            margin-bottom: 5px;
-            font-size: 14px;
-        }
-        
-        .progress-bar {
-            height: 10px;
-            background-color: #e0e0e0;
-            border-radius: 5px;
-            overflow: hidden;
-        }
-        
-        .progress-fill {
-            height: 100%;
-            background-color: var(--primary);
-            border-radius: 5px;
-            transition: width 0.3s ease;
-        }
+        Args:
+            camera_index: OpenCV camera index to capture from
+        """
+        self.camera_index = camera_index
+        self._slots = set()
+        self._lock = threading.Lock()
+        self._running = False
+    
+    def attach(self, slot):
+        """
+        Start delivering frames to a slot, opening the camera if needed
         
-        .feedback {
-            margin-top: 15px;
-            padding: 10px;
-            border-radius: 4px;
-            font-size: 14px;
-            color: var(--dark);
-            background-color: #f0f4f8;
-        }
+        Args:
+            slot: LatestSlot receiving the frames
+        """
+        with self._lock:
+            self._slots.add(slot)
+            if not self._running:
+                self._running = True
+                threading.Thread(target=self._run, name=f"camera-{self.camera_index}", daemon=True).start()
+    
+    def detach(self, slot):
+        """
+        Stop delivering frames to a slot
         
-        .feedback.good {
-            background-color: rgba(56, 176, 0, 0.1);
-            color: var(--success);
-        }
+        Args:
+            slot: LatestSlot passed to attach
+        """
+        with self._lock:
+            self._slots.discard(slot)
+    
+    def release(self, frame):
+        """Hand back a frame a slot is done with; camera frames are shared between slots and never reused"""
+    
+    def _run(self):
+        """Capture until no slot is attached, reopening if one attached while closing"""
+        while True:
+            self._capture()
+            with self._lock:
+                if not self._slots:
+                    self._running = False
+                    return
+    
+    def _capture(self):
+        """Read camera frames as fast as the camera delivers them"""
+        cap = cv2.VideoCapture(self.camera_index)
+        # Set resolution to improve performance
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
+        logger.info(f"Camera {self.camera_index} opened")
         
-        .feedback.bad {
-            background-color: rgba(239, 35, 60, 0.1);
-            color: var(--danger);
-        }
+        try:
+            while True:
+                with self._lock:
+                    slots = list(self._slots)
+                if not slots:
+                    break
+                
+                # Read frame
+                with CAPTURE_WAIT_SECONDS.time():
+                    success, frame = cap.read()
+                if not success:
+                    CAMERA_ERRORS.inc()
+                    logger.error("Failed to capture frame")
+                    # Generate blank frame
+                    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+                    cv2.putText(frame, "Camera Error", (200, 240),
+                               cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+                    time.sleep(0.1)
+                
+                # Consumers only read the frame, so one array serves them all
+                for slot in slots:
+                    slot.put(frame)
+        except Exception as e:
+            logger.error(f"Error in frame capture: {e}")
+        finally:
+            cap.release()
+            logger.info(f"Camera {self.camera_index} released")
+
+# Shared captures by camera index, created by get_camera
+cameras = {}
+cameras_lock = threading.Lock()
+
+def get_camera(camera_index):
+    """Get the shared CameraCapture for a camera index"""
+    with cameras_lock:
+        camera = cameras.get(camera_index)
+        if camera is None:
+            camera = cameras[camera_index] = CameraCapture(camera_index)
+        return camera
+
+class FrameIngest:
+    """
+    Frame source of a session whose camera is in the browser. Uploaded JPEG
+    frames are decoded into pooled buffers and handed to the attached
+    LatestSlot, like CameraCapture does with camera frames. An upload that
+    arrives while inference is still busy replaces the frame waiting in the
+    slot, so a slow inference stage drops stale uploads instead of queueing them.
+    """
+    def __init__(self, frame_pool, decoder=None):
+        """
+        Initialize the ingest
         
-        .exercise-list {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 10px;
-        }
+        Args:
+            frame_pool: FrameBufferPool the frames are decoded into
+            decoder: JpegDecoder, a default one if omitted
+        """
+        self.frame_pool = frame_pool
+        self.decoder = decoder or JpegDecoder()
+        self._slot = None
+        self._lock = threading.Lock()
+    
+    def attach(self, slot):
+        """
+        Start delivering uploaded frames to a slot
         
-        .exercise-card {
-            padding: 10px;
-            border-radius: 4px;
-            background-color: #f0f4f8;
-            cursor: pointer;
-            transition: all 0.2s ease;
-            text-align: center;
-        }
+        Args:
+            slot: LatestSlot receiving the frames
+        """
+        with self._lock:
+            self._slot = slot
+    
+    def detach(self, slot):
+        """
+        Stop delivering frames to a slot
         
-        .exercise-card:hover {
-            background-color: var(--primary);
-            color: white;
-        }
+        Args:
+            slot: LatestSlot passed to attach
+        """
+        with self._lock:
+            if self._slot is slot:
+                self._slot = None
+    
+    def submit(self, data):
+        """
+        Decode an uploaded frame and hand it to the attached slot
         
-        .exercise-card.active {
-            background-color: var(--primary);
-            color: white;
-            font-weight: bold;
-        }
+        Args:
+            data: Bytes of one JPEG frame
+            
+        Returns:
+            True if the frame was handed on, False when no pipeline is attached yet
+            
+        Raises:
+            ValueError: The data is not a valid JPEG within the decoder's size limit
+        """
+        with DECODE_SECONDS.time():
+            frame = self.decoder.decode(data, self.frame_pool.acquire, self.frame_pool.release)
+        with self._lock:
+            slot = self._slot
+        if slot is None:
+            self.frame_pool.release(frame)
+            return False
+        slot.put(frame)
+        return True
+    
+    def release(self, frame):
+        """Hand back a frame a slot is done with, for the next upload to be decoded into"""
+        self.frame_pool.release(frame)
+
+class FrameProducer:
+    """
+    Runs a session's inference -> render -> encode pipeline on background
+    threads, fed by the session's camera. Every distinct JPEG setting
+    requested by /video_feed clients gets its own encoder and
+    FrameBroadcaster, so each frame is encoded once per setting and shared
+    by every client using it. Stages are joined by LatestSlots, so each
+    stage works on the newest frame and a slow stage drops stale frames
+    instead of stalling the ones before it. Headless sessions run only the
+    inference stage, and frames are only drawn while a /video_feed client
+    is subscribed. After the inference stage fails, e.g. because the pose
+    model cannot be loaded, the pipeline is not restarted again before a
+    growing delay has passed or the user sends a command.
+    """
+    def __init__(self, session, idle_timeout=5.0, retry_delay=5.0, max_retry_delay=300.0):
+        """
+        Initialize the producer
         
-        footer {
-            text-align: center;
-            margin-top: 30px;
-            padding: 10px 0;
-            color: #666;
-            font-size: 14px;
-        }
+        Args:
+            session: Session whose tracker, commands and camera the pipeline uses
+            idle_timeout: Seconds without subscribers or API polls before the pipeline stops
+            retry_delay: Seconds before restarting after a failure, doubled per consecutive failure
+            max_retry_delay: Longest delay between restarts after failures
+        """
+        self.session = session
+        self.idle_timeout = idle_timeout
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._failures = 0  # Consecutive inference stage failures
+        self._retry_at = 0.0  # Monotonic time before which a failed pipeline is not restarted
+        self._commands_at_failure = 0  # Commands that were pending when the pipeline last failed
+        self.subscribers = 0
+        self._last_unsubscribe = time.time()
+        self._last_poll = 0.0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._streams = {}  # (quality, subsampling) -> [JpegEncoder, FrameBroadcaster, subscribers]
+        # Separate from _lock, which is held while joining the stage threads
+        self._streams_lock = threading.Lock()
+        
+        # Frames flow from the flip through render and encode in pooled buffers
+        self.frame_pool = FrameBufferPool()
+        
+        # Stage hand-offs, dropped frames go back to the pool or their source
+        self.captured = LatestSlot("inference", on_drop=self._release_input)
+        self.analyzed = LatestSlot("render", on_drop=lambda item: self.frame_pool.release(item[1].frame))
+        self.rendered = LatestSlot("encode", on_drop=self.frame_pool.release)
+        
+        # Latest FrameAnalysis without its frame, for the JSON API
+        self.analyses = FrameBroadcaster()
+    
+    def subscribe(self, quality=JPEG_QUALITY, subsampling=JPEG_SUBSAMPLING):
+        """
+        Register a client and make sure the pipeline is running
         
-        @media (max-width: 768px) {
-            .controls {
-                grid-template-columns: 1fr;
-            }
+        Args:
+            quality: JPEG quality the client receives
+            subsampling: Chroma subsampling the client receives
             
-            .btn-start-stop {
-                grid-column: span 1;
-            }
+        Returns:
+            FrameBroadcaster publishing frames with these settings
+        """
+        with self._streams_lock:
+            stream = self._streams.get((quality, subsampling))
+            if stream is None:
+                stream = self._streams[(quality, subsampling)] = [
+                    JpegEncoder(quality, subsampling), FrameBroadcaster(), 0]
+            stream[2] += 1
+            self.subscribers += 1
+        self.ensure_running()
+        return stream[1]
+    
+    def unsubscribe(self, quality=JPEG_QUALITY, subsampling=JPEG_SUBSAMPLING):
+        """
+        Unregister a client
+        
+        Args:
+            quality: JPEG quality passed to subscribe
+            subsampling: Chroma subsampling passed to subscribe
+        """
+        with self._streams_lock:
+            stream = self._streams.get((quality, subsampling))
+            if stream is not None:
+                stream[2] -= 1
+                if stream[2] <= 0:
+                    del self._streams[(quality, subsampling)]
+            self.subscribers = max(0, self.subscribers - 1)
+            if self.subscribers == 0:
+                self._last_unsubscribe = time.time()
+    
+    def add_listener(self):
+        """Register a client of the analysis results, e.g. a state stream, and make sure the pipeline is running"""
+        with self._streams_lock:
+            self.subscribers += 1
+        self.ensure_running()
+    
+    def remove_listener(self):
+        """Unregister a client registered with add_listener"""
+        with self._streams_lock:
+            self.subscribers = max(0, self.subscribers - 1)
+            if self.subscribers == 0:
+                self._last_unsubscribe = time.time()
+    
+    def poll(self):
+        """Note a JSON API request for the results; keeps the pipeline running for idle_timeout"""
+        self._last_poll = time.time()
+        self.ensure_running()
+    
+    def ensure_running(self):
+        """Start the pipeline threads if they are not already alive"""
+        with self._lock:
+            if self._threads and all(t.is_alive() for t in self._threads):
+                return
+            # A command sent since the failure, e.g. an exercise change, retries at once
+            if (time.monotonic() < self._retry_at
+                    and self.session.commands.qsize() <= self._commands_at_failure):
+                return
+            # Let a stopping pipeline finish before starting a fresh one
+            self._stop_event.set()
+            for thread in self._threads:
+                thread.join()
+            self._stop_event.clear()
             
-            .stats {
-                grid-template-columns: 1fr;
-            }
-        }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <header>
-            <h1><i class="fas fa-heartbeat"></i> ML Fitness Tracker</h1>
-        </header>
-        
-        <div class="content-wrapper">
-            <div class="video-container">
-                <img src="{{ url_for('video_feed') }}" alt="Fitness Tracker Video Feed">
-            </div>
+            stages = [("inference", self._inference_stage)]
+            if not self.session.headless:
+                stages += [("render", self._render_stage), ("encode", self._encode_stage)]
+            self._threads = [
+                threading.Thread(target=stage, name=f"{self.session.id}-{name}", daemon=True)
+                for name, stage in stages
+            ]
+            for thread in self._threads:
+                thread.start()
+            logger.info(f"Frame pipeline started for session {self.session.id}")
+    
+    def stop(self):
+        """Stop the pipeline threads and wait for them to finish"""
+        with self._lock:
+            self._stop_event.set()
+            for thread in self._threads:
+                thread.join()
+            self._threads = []
+    
+    def _release_input(self, frame):
+        """Hand a captured frame the pipeline is done with back to the session's frame source"""
+        self.session.frame_source().release(frame)
+    
+    def _is_idle(self):
+        """Whether nobody has watched the stream or polled the results for longer than idle_timeout"""
+        return (self.subscribers == 0
+                and time.time() - max(self._last_unsubscribe, self._last_poll) > self.idle_timeout)
+    
+    def _inference_stage(self):
+        """Apply queued commands and run pose inference on the newest frame"""
+        tracker = source = None
+        try:
+            # Loads MediaPipe and the pose model on the session's first start
+            tracker = self.session.get_tracker()
+            self.session.state.error = None
+            if RECORD_DIR and self.session.people == 1:
+                tracker.recorder = LandmarkRecorder(os.path.join(
+                    RECORD_DIR, time.strftime(f"session_{self.session.id}_%Y%m%d_%H%M%S.lmk")))
+                logger.info(f"Recording landmarks to {tracker.recorder.path}")
+            source = self.session.frame_source()
+            source.attach(self.captured)
+            self._run_inference(tracker)
+        except Exception as e:
+            delay = min(self.retry_delay * 2 ** self._failures, self.max_retry_delay)
+            self._failures += 1
+            self._retry_at = time.monotonic() + delay
+            self._commands_at_failure = self.session.commands.qsize()
+            logger.error(f"Error in inference stage: {e}, retrying in {delay:.0f} s")
+            self.session.report_error(f"Pose tracking stopped: {e}")
+            self._stop_event.set()
+        finally:
+            if source is not None:
+                source.detach(self.captured)
+            if tracker is not None and tracker.recorder is not None:
+                tracker.recorder.close()
+                tracker.recorder = None
+            logger.info(f"Frame pipeline stopped for session {self.session.id}")
+    
+    def _run_inference(self, tracker):
+        """Inference loop of _inference_stage"""
+        while not self._stop_event.is_set():
+            if self._is_idle():
+                self._stop_event.set()
+                break
             
-            <div class="controls-container">
-                <div class="panel">
-                    <div class="panel-header">
-                        <h2 class="panel-title">Controls</h2>
-                        <span id="status" class="badge">PAUSED</span>
-                    </div>
-                    <div class="controls">
-                        <button id="startStopBtn" class="btn-start-stop">
-                            <i class="fas fa-play"></i> Start
-                        </button>
-                        <button id="resetBtn" class="btn-reset">
-                            <i class="fas fa-redo"></i> Reset
-                        </button>
-                        <button id="debugBtn" class="btn-debug">
-                            <i class="fas fa-bug"></i> Debug
-                        </button>
-                    </div>
-                </div>
-                
-                <div class="panel">
-                    <div class="panel-header">
-                        <h2 class="panel-title">Statistics</h2>
-                    </div>
-                    <div class="stats">
-                        <div class="stat">
-                            <div class="stat-value" id="rep-count">0</div>
-                            <div class="stat-label">Repetitions</div>
-                        </div>
-                        <div class="stat">
-                            <div class="stat-value" id="elapsed-time">00:00:00</div>
-                            <div class="stat-label">Time</div>
-                        </div>
-                    </div>
-                    <div class="progress-container">
-                        <div class="progress-label">
-                            <span>Detection Confidence</span>
-                            <span id="confidence-value">0%</span>
-                        </div>
-                        <div class="progress-bar">
-                            <div class="progress-fill" id="confidence-bar" style="width: 0%"></div>
-                        </div>
-                    </div>
-                    <div class="feedback" id="form-feedback">
-                        Waiting to detect form...
-                    </div>
-                </div>
-                
-                <div class="panel">
-                    <div class="panel-header">
-                        <h2 class="panel-title">Exercises</h2>
-                    </div>
-                    <div class="exercise-list" id="exercise-list">
-                        <div class="exercise-card active" data-exercise="pushup">
-                            <i class="fas fa-dumbbell"></i> Push-up
-                        </div>
-                        <div class="exercise-card" data-exercise="situp">
-                            <i class="fas fa-dumbbell"></i> Sit-up
-                        </div>
-                        <div class="exercise-card" data-exercise="curlup">
-                            <i class="fas fa-dumbbell"></i> Curl-up
-                        </div>
-                        <div class="exercise-card" data-exercise="squat">
-                            <i class="fas fa-dumbbell"></i> Squat
-                        </div>
-                    </div>
-                </div>
-            </div>
-        </div>
-        
-        <footer>
-            &copy; 2025 ML Fitness Tracker - Powered by MediaPipe and Computer Vision
-        </footer>
-    </div>
-
-    <script>
-        document.addEventListener('DOMContentLoaded', function() {
-            // Elements
-            const startStopBtn = document.getElementById('startStopBtn');
-            const resetBtn = document.getElementById('resetBtn');
-            const debugBtn = document.getElementById('debugBtn');
-            const exerciseCards = document.querySelectorAll('.exercise-card');
-            const repCount = document.getElementById('rep-count');
-            const elapsedTime = document.getElementById('elapsed-time');
-            const status = document.getElementById('status');
-            const formFeedback = document.getElementById('form-feedback');
-            const confidenceBar = document.getElementById('confidence-bar');
-            const confidenceValue = document.getElementById('confidence-value');
+            # Check for commands in the queue
+            try:
+                command = self.session.commands.get_nowait()
+                if command == "start_stop":
+                    tracker.toggle_start_stop()
+                elif command == "reset":
+                    tracker.reset()
+                elif command == "toggle_debug":
+                    tracker.toggle_debug()
+                elif command.startswith("exercise_"):
+                    exercise_type = command.split("_")[1]
+                    tracker.change_exercise(exercise_type)
+            except queue.Empty:
+                pass
             
-            // Start/Stop button
-            startStopBtn.addEventListener('click', function() {
-                fetch('/start_stop')
-                    .then(response => response.json())
-                    .then(data => console.log(data))
-                    .catch(error => console.error('Error:', error));
-            });
+            frame = self.captured.get(timeout=0.1)
+            if frame is None:
+                continue
             
-            // Reset button
-            resetBtn.addEventListener('click', function() {
-                fetch('/reset')
-                    .then(response => response.json())
-                    .then(data => console.log(data))
-                    .catch(error => console.error('Error:', error));
-            });
+            analysis = tracker.analyze_frame(frame)
+            self._failures = 0
+            # The analysis works on its own flipped copy
+            self._release_input(frame)
+            self.analyses.publish(replace(analysis, frame=None))
+            if self.session.headless or not self._streams:
+                # Nothing is drawn or encoded: headless, or only landmark streams and
+                # API clients are watching and they draw for themselves
+                self.frame_pool.release(analysis.frame)
+            else:
+                self.analyzed.put((tracker, analysis))
+    
+    def _render_stage(self):
+        """Draw the skeleton and HUD for the newest analyzed frame"""
+        while not self._stop_event.is_set():
+            item = self.analyzed.get(timeout=0.1)
+            if item is None:
+                continue
             
-            // Debug button
-            debugBtn.addEventListener('click', function() {
-                fetch('/toggle_debug')
-                    .then(response => response.json())
-                    .then(data => console.log(data))
-                    .catch(error => console.error('Error:', error));
-            });
+            tracker, analysis = item
+            with DRAWING_SECONDS.time():
+                processed_frame = tracker.render_frame(analysis)
+            self.rendered.put(processed_frame)
+    
+    def _encode_stage(self):
+        """JPEG-encode the newest rendered frame once per requested setting"""
+        while not self._stop_event.is_set():
+            processed_frame = self.rendered.get(timeout=0.1)
+            if processed_frame is None:
+                continue
             
-            // Exercise type buttons
-            exerciseCards.forEach(card => {
-                card.addEventListener('click', function() {
-                    const exerciseType = this.getAttribute('data-exercise');
-                    
-                    // Remove active class from all cards
-                    exerciseCards.forEach(c => c.classList.remove('active'));
-                    
-                    // Add active class to clicked card
-                    this.classList.add('active');
-                    
-                    fetch(`/exercise/${exerciseType}`)
-                        .then(response => response.json())
-                        .then(data => console.log(data))
-                        .catch(error => console.error('Error:', error));
-                });
-            });
+            with self._streams_lock:
+                streams = list(self._streams.values())
+            for encoder, broadcaster, _ in streams:
+                # Convert to JPEG for streaming
+                with ENCODE_SECONDS.time():
+                    part = encoder.encode_part(processed_frame)
+                if part is not None:
+                    broadcaster.publish(part)
+            self.frame_pool.release(processed_frame)
+
+# Worker pool created on first use by get_inference_pool
+inference_pool = None
+inference_pool_lock = threading.Lock()
+
+def get_inference_pool():
+    """Get the shared InferencePool, or None when inference runs in-process"""
+    global inference_pool
+    if INFERENCE_WORKERS <= 0:
+        return None
+    with inference_pool_lock:
+        if inference_pool is None:
+            inference_pool = InferencePool(INFERENCE_WORKERS)
+            atexit.register(close_inference_pool)
+        return inference_pool
+
+# Session history database opened on first use by get_session_store
+session_store = None
+session_store_lock = threading.Lock()
+
+def get_session_store():
+    """Get the shared SessionStore, or None when SESSION_DB is empty"""
+    global session_store
+    if not SESSION_DB:
+        return None
+    with session_store_lock:
+        if session_store is None:
+            session_store = SessionStore(SESSION_DB)
+            atexit.register(session_store.close)
+            logger.info(f"Saving session history to {SESSION_DB}")
+        return session_store
+
+# Warm PoseDetector built by prewarm, taken by the first session that needs one
+spare_detector = None
+spare_detector_lock = threading.Lock()
+
+def prewarm():
+    """
+    Get the first viewer's pose model ready in the background: compile the
+    page template, import MediaPipe and build and run a Pose graph, or start
+    the inference workers, which warm up their own graphs
+    """
+    def warm():
+        global spare_detector
+        start = time.perf_counter()
+        app.jinja_env.get_template('index.html')
+        try:
+            if INFERENCE_WORKERS > 0:
+                get_inference_pool()
+            else:
+                detector = PoseDetector(roi_cropping=ROI_CROPPING)
+                detector.find_pose(np.zeros((480, 640, 3), dtype=np.uint8), draw=False)
+                detector.reset()
+                with spare_detector_lock:
+                    spare_detector = detector
+        except Exception as e:
+            # The first session builds its own and reports the problem to its viewer
+            logger.warning(f"Pose model warm-up failed: {e}")
+            return
+        logger.info(f"Pose model warmed up in {time.perf_counter() - start:.2f} s")
+    
+    threading.Thread(target=warm, name="prewarm", daemon=True).start()
+
+def take_spare_detector():
+    """Take the PoseDetector built by prewarm, None if it is not ready or already taken"""
+    global spare_detector
+    with spare_detector_lock:
+        detector, spare_detector = spare_detector, None
+    return detector
+
+def close_inference_pool():
+    """Stop every session's pipeline, then the workers they send frames to"""
+    for session in session_registry.sessions():
+        session.producer.stop()
+    inference_pool.close()
+
+class Session:
+    """
+    One athlete's tracking session: a FitnessTracker with its own state,
+    command channel, state stream and frame pipeline
+    """
+    def __init__(self, session_id, camera_index=0, headless=HEADLESS, people=1):
+        """
+        Initialize the session
+        
+        Args:
+            session_id: Identifier used in the session's routes
+            camera_index: OpenCV camera index the session watches, None for
+                frames uploaded by the browser
+            headless: Skip all drawing and encoding, results only through the JSON API
+            people: Most people tracked, more than 1 runs a GroupTracker on the multi-pose model
+        """
+        self.id = session_id
+        self.camera_index = camera_index
+        self.headless = headless
+        self.people = people
+        self.state = ExerciseState()
+        self.state_stream = StateStream(self.state)
+        self.commands = queue.Queue()
+        self.producer = FrameProducer(self)
+        self.ingest = FrameIngest(self.producer.frame_pool) if camera_index is None else None
+        self.tracker = None
+        self.created = self.last_seen = time.time()
+        self._tracker_lock = threading.Lock()
+        self.store = get_session_store()
+        if self.store is not None:
+            self.store.start_session(session_id, camera_index)
+    
+    def report_error(self, message):
+        """
+        Show a pipeline failure to the session's viewers through the state
+        
+        Args:
+            message: Description of the failure
+        """
+        self.state.status = "ERROR"
+        self.state.error = message
+        self.state.form_feedback = message
+        self.state_stream.publish(self.state)
+    
+    def get_tracker(self):
+        """Get the session's tracker, loading its pose model on first use"""
+        with self._tracker_lock:
+            if self.tracker is None and self.people > 1:
+                self.tracker = GroupTracker(MultiPoseDetector(POSE_MODEL, num_poses=self.people),
+                                            state=self.state, state_stream=self.state_stream,
+                                            frame_pool=self.producer.frame_pool,
+                                            session_store=self.store, session_id=self.id)
+            elif self.tracker is None:
+                governor = ComplexityGovernor(target_fps=TARGET_FPS) if TARGET_FPS > 0 else None
+                detector = take_spare_detector()
+                if detector is not None:
+                    detector.governor = governor
+                else:
+                    detector = PoseDetector(governor=governor, roi_cropping=ROI_CROPPING,
+                                            inference_pool=get_inference_pool(), stream_id=self.id)
+                self.tracker = FitnessTracker(detector=detector, inference_interval=INFERENCE_INTERVAL,
+                                              state=self.state, state_stream=self.state_stream,
+                                              frame_pool=self.producer.frame_pool,
+                                              session_store=self.store, session_id=self.id)
+            return self.tracker
+    
+    def frame_source(self):
+        """The session's FrameIngest, or the shared CameraCapture of its camera"""
+        return self.ingest if self.ingest is not None else get_camera(self.camera_index)
+    
+    def touch(self):
+        """Mark the session as used now"""
+        self.last_seen = time.time()
+    
+    def is_idle(self, timeout):
+        """Whether nobody watched or used the session for longer than timeout"""
+        return self.producer.subscribers == 0 and time.time() - self.last_seen > timeout
+    
+    def close(self):
+        """Stop the pipeline, release the pose model and mark the stored session ended"""
+        self.producer.stop()
+        if self.tracker is not None:
+            self.tracker.close()
+        if self.store is not None:
+            self.store.end_session(self.id)
+
+class SessionLimitError(RuntimeError):
+    """The registry already holds its maximum number of sessions"""
+
+class SessionRegistry:
+    """
+    Sessions by ID. Sessions unused for longer than idle_timeout are evicted
+    whenever the registry is accessed.
+    """
+    def __init__(self, idle_timeout=600.0, max_sessions=0):
+        """
+        Initialize an empty registry
+        
+        Args:
+            idle_timeout: Seconds a session may go unused before it is evicted
+            max_sessions: Most sessions besides the default one, 0 for no limit
+        """
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = {}
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._sessions)
+    
+    def create(self, camera_index=0, session_id=None, headless=HEADLESS, people=1):
+        """
+        Create a session
+        
+        Args:
+            camera_index: OpenCV camera index the session watches, None for uploaded frames
+            session_id: Identifier to use, a random one if omitted
+            headless: Skip all drawing and encoding for the session
+            people: Most people the session tracks in one frame
             
-            // Update stats
-            function updateStats() {
-                fetch('/get_state')
-                    .then(response => response.json())
-                    .then(data => {
-                        // Update rep count
-                        repCount.textContent = data.count;
-                        
-                        // Update elapsed time
-                        elapsedTime.textContent = data.elapsed_time;
-                        
-                        // Update status
-                        status.textContent = data.status;
-                        
-                        // Update form feedback
-                        formFeedback.textContent = data.form_feedback;
-                        
-                        // Update form feedback styling
-                        if (data.form_feedback === "Good form") {
-                            formFeedback.className = "feedback good";
-                        } else if (data.form_feedback === "Waiting to detect form...") {
-                            formFeedback.className = "feedback";
-                        } else {
-                            formFeedback.className = "feedback bad";
-                        }
-                        
-                        // Update confidence bar
-                        const confidenceScore = data.confidence_score;
-                        confidenceBar.style.width = `${confidenceScore}%`;
-                        confidenceValue.textContent = `${Math.round(confidenceScore)}%`;
-                        
-                        // Set confidence bar color based on score
-                        if (confidenceScore > 80) {
-                            confidenceBar.style.backgroundColor = 'var(--success)';
-                        } else if (confidenceScore > 60) {
-                            confidenceBar.style.backgroundColor = 'var(--warning)';
-                        } else {
-                            confidenceBar.style.backgroundColor = 'var(--danger)';
-                        }
-                        
-                        // Update exercise selection
-                        exerciseCards.forEach(card => {
-                            if (card.getAttribute('data-exercise') === data.exercise_type) {
-                                card.classList.add('active');
-                            } else {
-                                card.classList.remove('active');
-                            }
-                        });
-                        
-                        // Update button based on status
-                        if (data.status === 'RUNNING') {
-                            startStopBtn.classList.add('running');
-                            startStopBtn.innerHTML = '<i class="fas fa-pause"></i> Stop';
-                        } else {
-                            startStopBtn.classList.remove('running');
-                            startStopBtn.innerHTML = '<i class="fas fa-play"></i> Start';
-                        }
-                    })
-                    .catch(error => console.error('Error:', error));
-            }
+        Returns:
+            The new Session
             
-            // Update stats every second
-            setInterval(updateStats, 1000);
+        Raises:
+            SessionLimitError: If max_sessions sessions are live already
+        """
+        self.evict_idle()
+        with self._lock:
+            others = sum(1 for existing in self._sessions if existing != DEFAULT_SESSION)
+            if session_id != DEFAULT_SESSION and self.max_sessions and others >= self.max_sessions:
+                raise SessionLimitError(f"Session limit of {self.max_sessions} reached, end a session first")
+            session_id = session_id or secrets.token_hex(8)
+            session = self._sessions[session_id] = Session(session_id, camera_index, headless, people)
+        source = "uploaded frames" if camera_index is None else f"camera {camera_index}"
+        group = f" for up to {people} people" if people > 1 else ""
+        logger.info(f"Session {session_id} created on {source}{group}{' (headless)' if headless else ''}")
+        return session
+    
+    def get(self, session_id):
+        """
+        Look up a session and mark it as used
+        
+        Args:
+            session_id: Session identifier
             
-            // Initial update
-            updateStats();
+        Returns:
+            The Session, or None if it does not exist
+        """
+        self.evict_idle()
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.touch()
+        return session
+    
+    def get_or_create(self, session_id):
+        """Look up a session, creating it under that ID if it does not exist"""
+        session = self.get(session_id)
+        return session if session is not None else self.create(session_id=session_id)
+    
+    def remove(self, session_id):
+        """
+        End a session
+        
+        Args:
+            session_id: Session identifier
             
-            // Fetch available exercises from backend
-            fetch('/available_exercises')
-                .then(response => response.json())
-                .then(data => {
-                    // Create exercise cards dynamically if needed
-                    // This is already handled in the HTML for the provided exercises
-                })
-                .catch(error => console.error('Error:', error));
-        });
-    </script>
-</body>
-</html>
-        ''')
+        Returns:
+            True if the session existed
+        """
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        session.close()
+        logger.info(f"Session {session_id} ended")
+        return True
+    
+    def evict_idle(self):
+        """Close and drop every session idle for longer than idle_timeout"""
+        with self._lock:
+            idle = [session for session in self._sessions.values() if session.is_idle(self.idle_timeout)]
+            for session in idle:
+                del self._sessions[session.id]
+        for session in idle:
+            session.close()
+            logger.info(f"Session {session.id} evicted after {self.idle_timeout:.0f} s idle")
+    
+    def sessions(self):
+        """Snapshot of the current sessions"""
+        with self._lock:
+            return list(self._sessions.values())
 
-if __name__ == '__main__':
-    # Create templates directory and index.html
-    create_templates()
+session_registry = SessionRegistry(idle_timeout=SESSION_IDLE_TIMEOUT, max_sessions=MAX_SESSIONS)
+CONNECTED_CLIENTS.set_function(lambda: sum(session.producer.subscribers for session in session_registry.sessions()))
+ACTIVE_SESSIONS.set_function(lambda: len(session_registry))
+
+def get_session(session_id):
+    """Look up a session for a route, creating the default session on demand"""
+    if session_id == DEFAULT_SESSION:
+        return session_registry.get_or_create(session_id)
+    return session_registry.get(session_id)
+
+def unknown_session(session_id):
+    """Error response for a session that does not exist"""
+    return jsonify({"status": "error", "message": f"Unknown session {session_id}"}), 404
+
+def generate_frames(session, quality=JPEG_QUALITY, subsampling=JPEG_SUBSAMPLING):
+    """
+    Generator function to yield a session's shared video frames to one client
+    
+    Args:
+        session: Session whose frames to stream
+        quality: JPEG quality for this stream
+        subsampling: Chroma subsampling for this stream
+    """
+    frame_producer = session.producer
+    broadcaster = frame_producer.subscribe(quality, subsampling)
+    sequence = 0
+    try:
+        while True:
+            sequence, frame_bytes = broadcaster.wait_for_frame(sequence)
+            if frame_bytes is None:
+                # Restart the producer if it stopped while we were waiting
+                frame_producer.ensure_running()
+                continue
+            # The generator resumes once the server has written the chunk
+            write_start = time.perf_counter()
+            yield frame_bytes
+            SOCKET_WRITE_SECONDS.observe(time.perf_counter() - write_start)
+    finally:
+        frame_producer.unsubscribe(quality, subsampling)
+
+def generate_state_events(session):
+    """
+    Generator yielding Server-Sent Events with a session's state changes to one client
+    
+    Args:
+        session: Session whose state to stream
+    """
+    min_interval = 1.0 / STATE_MAX_RATE if STATE_MAX_RATE > 0 else 0.0
+    version = 0
+    last_sent = 0.0
+    # Without video clients, a headless session's pipeline runs for its state streams
+    if session.headless:
+        session.producer.add_listener()
+    try:
+        while True:
+            # Changes published while we wait here collapse into the next event
+            delay = last_sent + min_interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            version, payload = session.state_stream.wait_for_update(version)
+            # An open stream keeps the session from being evicted
+            session.touch()
+            if payload is None:
+                # Keeps proxies from closing the idle connection and detects gone clients
+                yield ": keepalive\n\n"
+                continue
+            last_sent = time.monotonic()
+            yield f"event: state\ndata: {payload}\n\n"
+    finally:
+        if session.headless:
+            session.producer.remove_listener()
+
+def generate_landmark_payloads(session):
+    """
+    Generator yielding a session's compact per-frame results to one client
+    that draws the skeleton itself, as JSON text. Yields None about once a
+    second when no frame arrives, so transports can send a keepalive.
+    
+    Args:
+        session: Session whose results to stream
+    """
+    producer = session.producer
+    # Landmark clients need no drawing or encoding, only the inference stage
+    producer.add_listener()
+    sequence = 0
+    try:
+        while True:
+            sequence, latest = producer.analyses.wait_for_frame(sequence)
+            # An open stream keeps the session from being evicted
+            session.touch()
+            if latest is None:
+                # Restart the producer if it stopped while we were waiting
+                producer.ensure_running()
+                yield None
+                continue
+            yield json.dumps(latest.to_landmark_payload(), separators=(",", ":"))
+    finally:
+        producer.remove_listener()
+
+def generate_landmark_events(session):
+    """
+    Generator yielding a session's landmark stream as Server-Sent Events, the
+    fallback when flask-sock is not installed
+    
+    Args:
+        session: Session whose results to stream
+    """
+    for payload in generate_landmark_payloads(session):
+        if payload is None:
+            yield ": keepalive\n\n"
+        else:
+            yield f"event: frame\ndata: {payload}\n\n"
+
+# Flask Routes
+def requested_camera():
+    """Camera index of a session creation request, None for ?source=upload"""
+    if request.args.get('source') == 'upload':
+        return None
+    return request.args.get('camera', 0, type=int)
+
+def requested_people():
+    """Number of people a session creation request asks to track, ?people=N"""
+    return request.args.get('people', 1, type=int)
+
+def missing_pose_model(people):
+    """Error response when a group session is requested without the multi-person model, else None"""
+    if people > 1 and not os.path.exists(POSE_MODEL):
+        return jsonify({"status": "error", "message": f"Tracking {people} people needs the PoseLandmarker model "
+                        f"{POSE_MODEL}, download it from {MODEL_URL} or set FITNESS_POSE_MODEL"}), 400
+    return None
+
+def session_limit_reached(error):
+    """Error response for a session creation refused by the registry"""
+    return jsonify({"status": "error", "message": str(error)}), 503
+
+@app.route('/')
+def index():
+    """
+    Render the shared default session, which every viewer of the page
+    watches. ?new=1 starts a separate session instead and sends the browser
+    to its page; then ?source=upload uses the browser's camera and
+    ?people=N tracks a group.
+    """
+    if request.args.get('new') != '1':
+        return session_page(DEFAULT_SESSION)
+    people = min(max(requested_people(), 1), MAX_PEOPLE)
+    error = missing_pose_model(people)
+    if error is not None:
+        return error
+    try:
+        session = session_registry.create(camera_index=requested_camera(), people=people)
+    except SessionLimitError as e:
+        return session_limit_reached(e)
+    return redirect(url_for('session_page', session_id=session.id))
+
+@app.route('/session/<session_id>/')
+def session_page(session_id):
+    """Render the application page for a session"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    return render_template('index.html', session_id=session.id, websocket_available=sock is not None,
+                           upload=session.ingest is not None)
+
+@app.route('/session', methods=['POST'])
+def create_session():
+    """
+    API endpoint to create a session. ?camera=N selects its camera,
+    ?source=upload takes frames uploaded to /frames instead, ?headless=1 skips
+    all drawing, ?people=N tracks up to N people at once.
+    """
+    headless = request.args.get('headless', '1' if HEADLESS else '0') == '1'
+    people = requested_people()
+    if not 1 <= people <= MAX_PEOPLE:
+        return jsonify({"status": "error", "message": f"people must be between 1 and {MAX_PEOPLE}"}), 400
+    error = missing_pose_model(people)
+    if error is not None:
+        return error
+    try:
+        session = session_registry.create(camera_index=requested_camera(), headless=headless, people=people)
+    except SessionLimitError as e:
+        return session_limit_reached(e)
+    return jsonify({"status": "success", "session_id": session.id, "headless": session.headless,
+                    "people": session.people})
+
+@app.route('/session/<session_id>', methods=['DELETE'])
+def end_session(session_id):
+    """API endpoint to end a session"""
+    if not session_registry.remove(session_id):
+        return unknown_session(session_id)
+    return jsonify({"status": "success"})
+
+@app.route('/sessions')
+def list_sessions():
+    """API endpoint to list the active sessions"""
+    return jsonify({
+        "sessions": [{
+            "session_id": session.id,
+            "camera": session.camera_index,
+            "clients": session.producer.subscribers,
+            "idle_seconds": round(time.time() - session.last_seen, 1),
+            "count": session.state.count,
+            "exercise_type": session.state.exercise_type,
+            "status": session.state.status,
+            "headless": session.headless,
+            "people": session.people
+        } for session in session_registry.sessions()]
+    })
+
+# The unscoped routes act on the default session
+@app.route('/video_feed', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/video_feed')
+def video_feed(session_id):
+    """Video streaming route, ?quality=1-100&subsampling=444|422|420|411 tune the JPEGs"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    quality = request.args.get('quality', JPEG_QUALITY, type=int)
+    subsampling = request.args.get('subsampling', JPEG_SUBSAMPLING)
+    if not 1 <= quality <= 100 or subsampling not in SUBSAMPLING_MODES:
+        return jsonify({"status": "error", "message": "Invalid JPEG quality or subsampling"}), 400
+    if session.headless:
+        return jsonify({"status": "error", "message": "Session is headless and has no video"}), 409
+    return Response(generate_frames(session, quality, subsampling),
+                    mimetype='multipart/x-mixed-replace; boundary=frame')
+
+@app.route('/start_stop', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/start_stop')
+def start_stop(session_id):
+    """API endpoint to start/stop exercise tracking"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    session.commands.put("start_stop")
+    return jsonify({"status": "success"})
+
+@app.route('/reset', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/reset')
+def reset(session_id):
+    """API endpoint to reset exercise tracking"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    session.commands.put("reset")
+    return jsonify({"status": "success"})
+
+@app.route('/toggle_debug', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/toggle_debug')
+def toggle_debug(session_id):
+    """API endpoint to toggle debug visualization"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    session.commands.put("toggle_debug")
+    return jsonify({"status": "success"})
+
+@app.route('/exercise/<exercise_type>', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/exercise/<exercise_type>')
+def change_exercise(session_id, exercise_type):
+    """API endpoint to change exercise type"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    if exercise_type in EXERCISE_CONFIGS:
+        session.commands.put(f"exercise_{exercise_type}")
+        return jsonify({"status": "success"})
+    return jsonify({"status": "error", "message": "Invalid exercise type"})
+
+@app.route('/get_state', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/get_state')
+def get_state(session_id):
+    """API endpoint to get current state"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    return jsonify(asdict(session.state))
+
+@app.route('/state_stream', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/state_stream')
+def state_stream_route(session_id):
+    """Server-Sent Events stream of state changes"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    return Response(generate_state_events(session), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/landmark_stream', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/landmark_stream')
+def landmark_stream_route(session_id):
+    """Server-Sent Events stream of the compact per-frame results for client-side drawing"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    return Response(generate_landmark_events(session), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/frames', methods=['POST'], defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/frames', methods=['POST'])
+def upload_frame(session_id):
+    """
+    Frame-ingest endpoint of a ?source=upload session, the body is one JPEG
+    from the browser's camera. Responds with the compact result of the first
+    analysis finished after the upload. A newer upload replaces one still
+    waiting for inference, so clients should keep one upload in flight.
+    """
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    if session.ingest is None:
+        return jsonify({"status": "error", "message": "Session reads a server camera, "
+                        "create it with ?source=upload to upload frames"}), 409
+    producer = session.producer
+    producer.poll()
+    sequence = producer.analyses.sequence
+    # Oversized bodies fail with 413 while being read
+    request.max_content_length = INGEST_MAX_BYTES
+    try:
+        accepted = session.ingest.submit(request.get_data())
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    if not accepted:
+        # The pipeline is still starting, the next upload gets through
+        return jsonify({"status": "pending", "sequence": sequence})
+    sequence, latest = producer.analyses.wait_for_frame(sequence, timeout=5.0)
+    if latest is None:
+        return jsonify({"status": "pending", "sequence": sequence})
+    result = latest.to_landmark_payload()
+    result["sequence"] = sequence
+    return jsonify(result)
+
+def send_landmarks(ws, session):
+    """Send a session's compact per-frame results over a WebSocket until it closes"""
+    payloads = generate_landmark_payloads(session)
+    try:
+        for payload in payloads:
+            # Sending fails with ConnectionClosed once the browser goes away
+            ws.send(payload if payload is not None else '{"keepalive":true}')
+    finally:
+        payloads.close()
+
+if sock is not None:
+    # Uploaded frames over the limit close the socket
+    app.config['SOCK_SERVER_OPTIONS'] = {'max_message_size': INGEST_MAX_BYTES}
+    
+    @sock.route('/landmarks_ws', defaults={'session_id': DEFAULT_SESSION})
+    @sock.route('/session/<session_id>/landmarks_ws')
+    def landmarks_ws(ws, session_id):
+        """WebSocket stream of the compact per-frame results for client-side drawing"""
+        session = get_session(session_id)
+        if session is None:
+            ws.close(1008, f"Unknown session {session_id}")
+            return
+        send_landmarks(ws, session)
     
+    @sock.route('/frames_ws', defaults={'session_id': DEFAULT_SESSION})
+    @sock.route('/session/<session_id>/frames_ws')
+    def frames_ws(ws, session_id):
+        """
+        WebSocket frame ingest of a ?source=upload session: binary JPEG
+        messages in, the compact result of every new analysis out
+        """
+        session = get_session(session_id)
+        if session is None or session.ingest is None:
+            ws.close(1008, f"Session {session_id} does not accept uploaded frames")
+            return
+        
+        def receive_frames():
+            try:
+                while True:
+                    data = ws.receive()
+                    if isinstance(data, (bytes, bytearray)):
+                        try:
+                            session.ingest.submit(data)
+                        except ValueError as e:
+                            logger.warning(f"Dropped upload for session {session.id}: {e}")
+            except ConnectionClosed:
+                pass
+        
+        threading.Thread(target=receive_frames, name=f"{session.id}-ingest", daemon=True).start()
+        send_landmarks(ws, session)
+
+@app.route('/get_stats', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/get_stats')
+def get_stats(session_id):
+    """API endpoint to get exercise statistics"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    state = session.state
+    tracker = session.tracker
+    return jsonify({
+        "count": state.count,
+        "time": state.elapsed_time,
+        "exercise_type": state.exercise_type,
+        "confidence_score": state.confidence_score,
+        "form_feedback": state.form_feedback,
+        "rep_history": list(tracker.rep_snapshot) if tracker is not None else []
+    })
+
+@app.route('/analysis', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/analysis')
+def analysis(session_id):
+    """
+    API endpoint to get the latest frame analysis: landmarks, angles, rep
+    event and form feedback. ?after=N waits up to 10 s for a result newer than
+    sequence N. Polling keeps the pipeline running.
+    """
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    session.producer.poll()
+    after = request.args.get('after', type=int)
+    # Without after, any published result is new enough and returns at once
+    sequence, latest = session.producer.analyses.wait_for_frame(-1 if after is None else after, timeout=10.0)
+    if latest is None:
+        return jsonify({"status": "pending", "sequence": sequence})
+    result = latest.to_dict()
+    result["sequence"] = sequence
+    return jsonify(result)
+
+@app.route('/reps', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/reps')
+def reps(session_id):
+    """API endpoint to get the reps completed since the last reset, ?since=N returns those after rep N"""
+    session = get_session(session_id)
+    if session is None:
+        return unknown_session(session_id)
+    since = request.args.get('since', 0, type=int)
+    tracker = session.tracker
+    history = tracker.rep_snapshot if tracker is not None else ()
+    return jsonify({"count": session.state.count, "reps": [rep for rep in history if rep["rep"] > since]})
+
+@app.route('/history', defaults={'session_id': DEFAULT_SESSION})
+@app.route('/session/<session_id>/history')
+def session_history(session_id):
+    """API endpoint to get a session's stored reps, grouped into sets, including ended sessions"""
+    store = get_session_store()
+    if store is None:
+        return jsonify({"status": "error", "message": "Session history is disabled"}), 404
+    store.flush()
+    history = store.session_history(session_id)
+    if history is None:
+        return unknown_session(session_id)
+    return jsonify(history)
+
+@app.route('/sessions/history')
+def stored_sessions():
+    """API endpoint to list stored sessions, newest first"""
+    store = get_session_store()
+    if store is None:
+        return jsonify({"status": "error", "message": "Session history is disabled"}), 404
+    limit = request.args.get('limit', 50, type=int)
+    store.flush()
+    return jsonify({"sessions": store.sessions(limit=max(1, min(limit, 1000)))})
+
+@app.route('/inference_workers')
+def inference_workers():
+    """API endpoint to get per-worker inference utilization"""
+    pool = inference_pool
+    return jsonify({"workers": pool.utilization() if pool is not None else []})
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint for pipeline performance metrics"""
+    return Response(metrics.render_prometheus(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/available_exercises')
+def available_exercises():
+    """API endpoint to get available exercises"""
+    return jsonify({
+        "exercises": list(EXERCISE_CONFIGS.keys())
+    })
+
+if __name__ == '__main__':
     # Log startup information
     logger.info("Starting ML Fitness Tracker application")
     logger.info(f"Available exercises: {', '.join(EXERCISE_CONFIGS.keys())}")
     
-    # Start the Flask app
-    app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
+    # Load the pose model while the server already answers requests
+    prewarm()
+    
+    # Start the Flask app. The reloader would import everything twice, in a
+    # watcher and a server process, so it is opt-in.
+    app.run(debug=True, use_reloader=RELOAD, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,246 @@
+"""
+Offline batch scoring of recorded workout videos.
+
+Runs the same PoseDetector / FitnessTracker logic as the live app over video
+files, without a webcam or Flask, spreading files across a process pool with
+one MediaPipe graph per worker.
+
+Usage:
+    python batch_process.py recordings/ "gym_cam_*.mp4" --exercise squat --workers 4
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+from app2 import EXERCISE_CONFIGS, FitnessTracker, FrameClock, PoseDetector
+from landmark_recording import LandmarkRecorder
+
+logger = logging.getLogger(__name__)
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".webm")
+
+FRAME_FIELDS = [
+    "frame", "timestamp", "has_pose", "angle", "smoothed_angle",
+    "percentage", "count", "rep_stage", "confidence_score", "form_feedback"
+]
+
+# One detector per worker process, created by _init_worker
+_worker_detector = None
+
+def find_videos(inputs):
+    """
+    Expand directories and glob patterns into a sorted list of video files
+
+    Args:
+        inputs: Directories, glob patterns or file paths
+
+    Returns:
+        List of video file paths
+    """
+    videos = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for name in os.listdir(pattern):
+                if name.lower().endswith(VIDEO_EXTENSIONS):
+                    videos.add(os.path.join(pattern, name))
+        else:
+            for path in glob.glob(pattern):
+                if os.path.isfile(path):
+                    videos.add(path)
+    return sorted(videos)
+
+def output_stems(videos):
+    """
+    Pick a result file stem per video
+
+    The stem is the file name without its extension. Videos that share a stem,
+    e.g. a/clip.mp4 and b/clip.mp4, or whose stem is "summary", get a short hash of their full path appended,
+    so their results do not overwrite each other.
+
+    Args:
+        videos: Video file paths
+
+    Returns:
+        Dictionary mapping each path to its stem
+    """
+    stems = {path: os.path.splitext(os.path.basename(path))[0] for path in videos}
+    # Case-insensitive, so names stay distinct on macOS and Windows file systems too.
+    # "summary" is taken by write_summary.
+    seen = {"summary": 1}
+    for stem in stems.values():
+        seen[stem.lower()] = seen.get(stem.lower(), 0) + 1
+    for path, stem in stems.items():
+        if seen[stem.lower()] > 1:
+            stems[path] = f"{stem}_{hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8]}"
+    return stems
+
+def _init_worker(model_complexity):
+    """Build the MediaPipe graph once per worker process"""
+    global _worker_detector
+    _worker_detector = PoseDetector(model_complexity=model_complexity)
+
+def process_video(path, exercise_type, output_dir, formats, record=False, stem=None):
+    """
+    Score one video and write its results
+
+    Args:
+        path: Video file path
+        exercise_type: Key into EXERCISE_CONFIGS
+        output_dir: Directory for result files
+        formats: Collection containing "json" and/or "csv"
+        record: Also write a landmark recording for replay.py
+        stem: Result file name without extension, defaults to the video's
+
+    Returns:
+        Summary dictionary for the video
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise IOError(f"Could not open video {path}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 0
+
+    if stem is None:
+        stem = os.path.splitext(os.path.basename(path))[0]
+    recorder = LandmarkRecorder(os.path.join(output_dir, f"{stem}.lmk")) if record else None
+
+    # A fresh tracker per video, sharing the worker's warm detector
+    _worker_detector.reset()
+    clock = FrameClock()
+    tracker = FitnessTracker(detector=_worker_detector, clock=clock, recorder=recorder)
+    tracker.change_exercise(exercise_type)
+
+    frames = []
+    frame_index = 0
+    try:
+        while True:
+            success, frame = cap.read()
+            if not success:
+                break
+
+            # Prefer the container timestamp, fall back to the nominal frame rate
+            timestamp = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            if timestamp <= 0 and frame_index > 0 and fps > 0:
+                timestamp = frame_index / fps
+            clock.set(timestamp)
+
+            if frame_index == 0:
+                tracker.toggle_start_stop()
+
+            analysis = tracker.analyze_frame(frame)
+            frames.append({
+                "frame": frame_index,
+                "timestamp": round(timestamp, 4),
+                "has_pose": analysis.landmarks is not None,
+                "angle": analysis.angle,
+                "smoothed_angle": analysis.smoothed_angle,
+                "percentage": None if analysis.percentage is None else float(analysis.percentage),
+                "count": analysis.count,
+                "rep_stage": analysis.rep_stage,
+                "confidence_score": analysis.confidence_score,
+                "form_feedback": analysis.form_feedback
+            })
+            tracker.frame_pool.release(analysis.frame)
+            frame_index += 1
+    finally:
+        cap.release()
+        if recorder is not None:
+            recorder.close()
+
+    stats = tracker.get_exercise_stats()
+    summary = {
+        "video": path,
+        "exercise_type": exercise_type,
+        "frames": frame_index,
+        "duration": frames[-1]["timestamp"] if frames else 0,
+        "count": stats["count"],
+        "time": stats["time"],
+        "avg_confidence": stats["avg_confidence"],
+        "rep_history": stats["rep_history"]
+    }
+
+    if "json" in formats:
+        with open(os.path.join(output_dir, f"{stem}.json"), "w") as f:
+            json.dump(dict(summary, per_frame=frames), f, indent=2)
+    if "csv" in formats:
+        with open(os.path.join(output_dir, f"{stem}_frames.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=FRAME_FIELDS)
+            writer.writeheader()
+            writer.writerows(frames)
+
+    return summary
+
+def write_summary(summaries, output_dir, formats):
+    """
+    Write the per-video rep counts for the whole batch
+
+    Args:
+        summaries: List of summary dictionaries from process_video
+        output_dir: Directory for result files
+        formats: Collection containing "json" and/or "csv"
+    """
+    if "json" in formats:
+        with open(os.path.join(output_dir, "summary.json"), "w") as f:
+            json.dump(summaries, f, indent=2)
+    if "csv" in formats:
+        fields = ["video", "exercise_type", "frames", "duration", "count", "time", "avg_confidence"]
+        with open(os.path.join(output_dir, "summary.csv"), "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(summaries)
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Score recorded workout videos offline")
+    parser.add_argument("inputs", nargs="+", help="Video files, directories or glob patterns")
+    parser.add_argument("-e", "--exercise", default="pushup", choices=list(EXERCISE_CONFIGS.keys()),
+                        help="Exercise performed in the videos")
+    parser.add_argument("-o", "--output-dir", default="batch_results", help="Directory for result files")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes")
+    parser.add_argument("-f", "--format", default="both", choices=["json", "csv", "both"],
+                        help="Output format")
+    parser.add_argument("--model-complexity", type=int, default=2, choices=[0, 1, 2],
+                        help="MediaPipe Pose model complexity")
+    parser.add_argument("--record", action="store_true",
+                        help="Also write a <video>.lmk landmark recording for replay.py")
+    args = parser.parse_args(argv)
+
+    videos = find_videos(args.inputs)
+    if not videos:
+        parser.error("no video files found")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    formats = {"json", "csv"} if args.format == "both" else {args.format}
+    stems = output_stems(videos)
+    workers = max(1, min(args.workers, len(videos)))
+    logger.info(f"Processing {len(videos)} videos with {workers} workers")
+
+    summaries = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(args.model_complexity,)) as executor:
+        futures = {executor.submit(process_video, path, args.exercise, args.output_dir, formats, args.record,
+                                   stems[path]): path
+                   for path in videos}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summary = future.result()
+            except Exception as e:
+                logger.error(f"Error processing {path}: {e}")
+                continue
+            logger.info(f"{path}: {summary['count']} reps in {summary['time']}")
+            summaries.append(summary)
+
+    summaries.sort(key=lambda summary: summary["video"])
+    write_summary(summaries, args.output_dir, formats)
+    return 0 if len(summaries) == len(videos) else 1
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,445 @@
+"""
+Micro-benchmarks for the per-frame hot path.
+
+Feeds synthetic frames and canned MediaPipe landmark results, without a
+camera, through each stage of FitnessTracker (landmark extraction, angle and
+form evaluation, rep state machine, HUD drawing, JPEG encoding), through
+batch rep detection over a long angle series, and through the whole
+process_frame. Reports latency percentiles, frames per second and the peak
+memory each stage allocates per frame, and compares them against a saved
+baseline.
+
+--startup instead times app2's cold start in fresh interpreters: the import
+and the first /, /get_state and /available_exercises requests, which must
+not wait for MediaPipe.
+
+Usage:
+    python benchmark.py --save-baseline bench_baseline.json
+    python benchmark.py --baseline bench_baseline.json --fail-on-regression
+    python benchmark.py --check-allocations
+    python benchmark.py --startup
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import cv2
+import mediapipe as mp
+import numpy as np
+from mediapipe.framework.formats import landmark_pb2
+
+from app2 import (EXERCISE_CONFIGS, JPEG_QUALITY, JPEG_SUBSAMPLING, CompiledExercise, FitnessTracker,
+                  FrameClock, PoseDetector)
+from jpeg_encoding import JpegEncoder
+from rep_engine import detect_reps
+
+# Stages that must not allocate a frame-sized buffer once warmed up
+ALLOCATION_FREE_STAGES = ("hud_drawing", "process_frame")
+
+# Target for importing app2 and answering its first requests, interpreter start excluded
+STARTUP_BUDGET_SECONDS = 0.5
+
+# Run in a fresh interpreter by measure_startup
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app2
+imported = time.perf_counter()
+client = app2.app.test_client()
+for path in ("/", "/get_state", "/available_exercises"):
+    assert client.get(path).status_code < 400, path
+answered = time.perf_counter()
+print(json.dumps({"import": imported - start, "first_requests": answered - imported,
+                  "total": answered - start, "mediapipe_loaded": "mediapipe" in sys.modules}))
+"""
+
+# Normalized (x, y) of a side-on standing pose, indexed like MediaPipe Pose
+BASE_POSE = [
+    (0.50, 0.20), (0.51, 0.18), (0.52, 0.18), (0.53, 0.18), (0.49, 0.18), (0.48, 0.18), (0.47, 0.18),
+    (0.55, 0.19), (0.45, 0.19), (0.52, 0.23), (0.48, 0.23), (0.58, 0.30), (0.42, 0.30), (0.60, 0.42),
+    (0.40, 0.42), (0.61, 0.53), (0.39, 0.53), (0.62, 0.56), (0.38, 0.56), (0.61, 0.56), (0.39, 0.56),
+    (0.60, 0.55), (0.40, 0.55), (0.56, 0.55), (0.44, 0.55), (0.57, 0.70), (0.43, 0.70), (0.57, 0.85),
+    (0.43, 0.85), (0.56, 0.87), (0.44, 0.87), (0.59, 0.89), (0.41, 0.89)
+]
+
+class CannedPose:
+    """Stand-in for mp.solutions.pose.Pose that replays prepared results"""
+    def __init__(self, results):
+        """
+        Initialize with a list of results to cycle through
+
+        Args:
+            results: Objects shaped like MediaPipe Pose results
+        """
+        self.results = results
+        self.index = 0
+
+    def process(self, img_rgb):
+        """Return the next canned result"""
+        result = self.results[self.index]
+        self.index = (self.index + 1) % len(self.results)
+        return result
+
+    def reset(self):
+        """Restart from the first canned result"""
+        self.index = 0
+
+    def close(self):
+        """Nothing to release"""
+
+class CannedPoseDetector(PoseDetector):
+    """PoseDetector whose graph is a CannedPose, so no model is loaded"""
+    canned_results = []
+
+    def _build_pose(self):
+        """Replay the canned results instead of building a MediaPipe graph"""
+        return CannedPose(self.canned_results)
+
+def make_canned_results(count):
+    """
+    Build landmark results for one full rep cycle
+
+    Args:
+        count: Number of frames in the cycle
+
+    Returns:
+        List of objects with a MediaPipe NormalizedLandmarkList in pose_landmarks
+    """
+    class Results:
+        def __init__(self, pose_landmarks):
+            self.pose_landmarks = pose_landmarks
+
+    results = []
+    for i in range(count):
+        # Swing both forearms so the elbow angle sweeps through a full rep
+        phase = math.radians(115 + 60 * math.sin(2 * math.pi * i / count))
+        points = list(BASE_POSE)
+        for shoulder, elbow, wrist in ((11, 13, 15), (12, 14, 16)):
+            ex, ey = points[elbow]
+            sx, sy = points[shoulder]
+            upper = math.atan2(sy - ey, sx - ex)
+            points[wrist] = (ex + 0.11 * math.cos(upper + phase), ey + 0.11 * math.sin(upper + phase))
+
+        landmark_list = landmark_pb2.NormalizedLandmarkList()
+        for x, y in points:
+            landmark_list.landmark.add(x=x, y=y, z=0.0, visibility=0.95)
+        results.append(Results(landmark_list))
+    return results
+
+def make_frame(width, height, seed=0):
+    """
+    Build a synthetic BGR frame with gradients and sensor-like noise
+
+    Args:
+        width, height: Frame size
+        seed: Random seed
+
+    Returns:
+        uint8 image of shape (height, width, 3)
+    """
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    frame = np.stack([np.broadcast_to(x, (height, width)),
+                      np.broadcast_to(y, (height, width)),
+                      (x + y) / 2], axis=2)
+    frame += rng.normal(0, 8, frame.shape)
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+def time_stage(fn, iterations, warmup):
+    """
+    Time repeated calls of a stage
+
+    Args:
+        fn: Zero-argument callable running one frame of the stage
+        iterations: Number of timed calls
+        warmup: Number of untimed calls first
+
+    Returns:
+        Array of latencies in milliseconds
+    """
+    for _ in range(warmup):
+        fn()
+    samples = np.empty(iterations, dtype=np.float64)
+    for i in range(iterations):
+        start = time.perf_counter_ns()
+        fn()
+        samples[i] = time.perf_counter_ns() - start
+    return samples / 1e6
+
+def peak_allocation(fn, calls=20):
+    """
+    Largest transient allocation of a stage, traced with tracemalloc.
+    NumPy arrays, including OpenCV outputs, are traced.
+
+    Args:
+        fn: Zero-argument callable running one frame of the stage
+        calls: Number of calls to trace, after the timed run warmed the stage up
+
+    Returns:
+        Peak bytes allocated above the starting point during any single call
+    """
+    tracemalloc.start()
+    try:
+        peak = 0
+        for _ in range(calls):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            fn()
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def summarize(samples):
+    """Latency percentiles in ms and the frame rate implied by the mean"""
+    mean = float(samples.mean())
+    return {
+        "p50": round(float(np.percentile(samples, 50)), 4),
+        "p90": round(float(np.percentile(samples, 90)), 4),
+        "p99": round(float(np.percentile(samples, 99)), 4),
+        "mean": round(mean, 4),
+        "fps": round(1000 / mean, 1) if mean > 0 else float("inf")
+    }
+
+def build_stages(exercise, width, height, model_complexity=None):
+    """
+    Prepare one callable per benchmarked stage
+
+    Args:
+        exercise: Key into EXERCISE_CONFIGS
+        width, height: Synthetic frame size
+        model_complexity: Also time real pose inference at this complexity
+
+    Returns:
+        Ordered list of (stage_name, callable)
+    """
+    results = make_canned_results(60)
+    frame = make_frame(width, height)
+
+    CannedPoseDetector.canned_results = results
+    detector = CannedPoseDetector()
+    clock = FrameClock()
+    tracker = FitnessTracker(detector=detector, clock=clock)
+    tracker.change_exercise(exercise)
+    tracker.toggle_start_stop()
+
+    # Precomputed inputs for the isolated stages
+    landmark_frames = []
+    for result in results:
+        detector.results = result
+        landmark_frames.append(detector.find_position(frame).copy())
+    compiled = CompiledExercise(EXERCISE_CONFIGS[exercise])
+    config = EXERCISE_CONFIGS[exercise]
+    angles = [compiled.evaluate(lm).primary_angle for lm in landmark_frames]
+    percentages = [float(np.interp(angle, (config.down_threshold, config.up_threshold), (0, 100)))
+                   for angle in angles]
+    # An hour of frames at 30 fps for the batch front end
+    angle_series = np.resize(np.array(angles), 30 * 3600)
+    series_times = np.arange(len(angle_series)) / 30
+    analysis = tracker.analyze_frame(frame)
+    rendered = tracker.render_frame(tracker.analyze_frame(frame))
+    encoder = JpegEncoder(JPEG_QUALITY, JPEG_SUBSAMPLING)
+
+    counter = {"i": 0}
+    def next_index():
+        counter["i"] = (counter["i"] + 1) % len(results)
+        return counter["i"]
+
+    def extraction():
+        detector.results = results[next_index()]
+        detector.find_position(frame)
+
+    def evaluation():
+        compiled.evaluate(landmark_frames[next_index()])
+
+    def rep_state():
+        tracker.update_rep_state(percentages[next_index()], [])
+
+    def batch_rep_detection():
+        detect_reps(angle_series, series_times, config.down_threshold, config.up_threshold)
+    batch_rep_detection.frames = len(angle_series)
+
+    def hud_drawing():
+        # Restore the unannotated pixels into the same buffer, as the flip does per frame
+        np.copyto(analysis.frame, frame)
+        tracker.render_frame(analysis)
+
+    def jpeg_encode():
+        encoder.encode_part(rendered)
+
+    def whole_frame():
+        clock.set(clock() + 1 / 30)
+        tracker.process_frame(frame)
+
+    stages = [
+        ("landmark_extraction", extraction),
+        ("form_evaluation", evaluation),
+        ("rep_state_machine", rep_state),
+        ("rep_detection_batch", batch_rep_detection),
+        ("hud_drawing", hud_drawing),
+        ("jpeg_encode", jpeg_encode),
+        ("process_frame", whole_frame),
+    ]
+
+    if model_complexity is not None:
+        real_pose = mp.solutions.pose.Pose(model_complexity=model_complexity)
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        stages.append(("pose_inference", lambda: real_pose.process(rgb)))
+
+    return stages
+
+def run(args):
+    """Run every stage and return the report dictionary"""
+    stages = build_stages(args.exercise, args.width, args.height, args.model_complexity)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+            "machine": platform.machine(),
+            "resolution": f"{args.width}x{args.height}",
+            "exercise": args.exercise,
+            "jpeg": f"{JpegEncoder(JPEG_QUALITY, JPEG_SUBSAMPLING).backend} q{JPEG_QUALITY} {JPEG_SUBSAMPLING}",
+            "iterations": args.iterations
+        },
+        "stages": {}
+    }
+    for name, fn in stages:
+        if args.stage and name not in args.stage:
+            continue
+        stats = summarize(time_stage(fn, args.iterations, args.warmup))
+        # Stages over a whole series report frames per second, not calls
+        stats["fps"] = round(stats["fps"] * getattr(fn, "frames", 1), 1)
+        stats["alloc_kb"] = round(peak_allocation(fn) / 1024, 1)
+        report["stages"][name] = stats
+    return report
+
+def frame_allocations(report, width, height):
+    """
+    Find allocation-free stages that allocated a frame-sized buffer
+
+    Returns:
+        Names of the offending stages
+    """
+    frame_kb = width * height * 3 / 1024
+    return [name for name in ALLOCATION_FREE_STAGES
+            if name in report["stages"] and report["stages"][name].get("alloc_kb", 0) >= frame_kb]
+
+def measure_startup(runs=5):
+    """
+    Time app2's cold start in fresh interpreters
+
+    Args:
+        runs: Interpreters started, the fastest counts
+
+    Returns:
+        Dictionary with the seconds spent importing, answering the first
+        requests and in total, and whether MediaPipe got loaded on the way
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    # No session database is written while measuring
+    env = dict(os.environ, FITNESS_SESSION_DB="")
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], cwd=directory, env=env,
+                                capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    return min(results, key=lambda result: result["total"])
+
+def print_report(report, baseline=None, tolerance=10.0):
+    """
+    Print the results, with p50 changes against a baseline when given
+
+    Returns:
+        Names of stages whose p50 regressed by more than tolerance percent
+    """
+    regressions = []
+    header = f"{'stage':<22}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'fps':>14}{'alloc KB':>10}"
+    if baseline:
+        header += f"{'vs base':>10}"
+    print(header)
+    print("-" * len(header))
+    for name, stats in report["stages"].items():
+        line = (f"{name:<22}{stats['p50']:>10.3f}{stats['p90']:>10.3f}{stats['p99']:>10.3f}{stats['fps']:>14.1f}"
+                f"{stats.get('alloc_kb', float('nan')):>10.1f}")
+        base = baseline["stages"].get(name) if baseline else None
+        if base and base["p50"] > 0:
+            change = (stats["p50"] - base["p50"]) / base["p50"] * 100
+            line += f"{change:>+9.1f}%"
+            if change > tolerance:
+                line += "  REGRESSION"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Benchmark the per-frame processing stages")
+    parser.add_argument("-n", "--iterations", type=int, default=500, help="Timed iterations per stage")
+    parser.add_argument("--warmup", type=int, default=50, help="Untimed iterations per stage")
+    parser.add_argument("--width", type=int, default=640, help="Synthetic frame width")
+    parser.add_argument("--height", type=int, default=480, help="Synthetic frame height")
+    parser.add_argument("-e", "--exercise", default="pushup", choices=list(EXERCISE_CONFIGS.keys()))
+    parser.add_argument("--stage", action="append", help="Only run the named stage (repeatable)")
+    parser.add_argument("--model-complexity", type=int, choices=[0, 1, 2],
+                        help="Also time real MediaPipe inference at this complexity")
+    parser.add_argument("--baseline", help="Baseline JSON to compare against")
+    parser.add_argument("--save-baseline", help="Write the results as a baseline JSON")
+    parser.add_argument("--tolerance", type=float, default=10.0,
+                        help="Allowed p50 slowdown in percent before flagging a regression")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with status 1 when a stage regresses")
+    parser.add_argument("--check-allocations", action="store_true",
+                        help="Exit with status 1 when HUD drawing or process_frame allocates a full frame")
+    parser.add_argument("--startup", action="store_true",
+                        help="Time app2's cold start instead, exit with status 1 over "
+                             f"{STARTUP_BUDGET_SECONDS} s or when it loads MediaPipe")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        startup = measure_startup()
+        print(f"import {startup['import'] * 1000:.0f} ms, first requests {startup['first_requests'] * 1000:.0f} ms, "
+              f"total {startup['total'] * 1000:.0f} ms (budget {STARTUP_BUDGET_SECONDS * 1000:.0f} ms)")
+        if startup["mediapipe_loaded"]:
+            print("MediaPipe was loaded during startup", file=sys.stderr)
+            return 1
+        if startup["total"] > STARTUP_BUDGET_SECONDS:
+            print("Startup exceeds its budget", file=sys.stderr)
+            return 1
+        return 0
+
+    # Keep per-frame log lines out of the timings
+    logging.getLogger("app2").setLevel(logging.WARNING)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    report = run(args)
+    regressions = print_report(report, baseline, args.tolerance)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline written to {args.save_baseline}")
+
+    if regressions and args.fail_on_regression:
+        print(f"Regressed stages: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    allocating = frame_allocations(report, args.width, args.height)
+    if allocating and args.check_allocations:
+        print(f"Stages allocating a full frame: {', '.join(allocating)}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,423 @@
+"""
+Pose inference in a pool of worker processes.
+
+Each worker process holds its own MediaPipe runtime, so concurrent sessions
+run inference in parallel instead of contending for the GIL in the server
+process. A session's stream is pinned to one worker, which keeps a Pose
+graph per stream so MediaPipe's tracking state stays consistent from frame
+to frame. Frames and landmarks cross the process boundary through a shared
+memory block per worker; only a small control tuple goes over the pipe.
+
+A request that fails in a worker is answered with an error, which the
+caller gets as an InferenceError. A worker that dies, or does not answer
+within the request timeout, is restarted, and the streams pinned to it
+rebuild their graphs there.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+NUM_LANDMARKS = 33
+LANDMARK_BYTES = NUM_LANDMARKS * 4 * 4
+
+# mp.solutions.pose.Pose arguments, in the order of the options tuples sent to the workers
+POSE_OPTIONS = ("static_image_mode", "model_complexity", "smooth_landmarks", "enable_segmentation",
+                "min_detection_confidence", "min_tracking_confidence")
+
+WORKER_BUSY_SECONDS = metrics.Counter(
+    "fitness_inference_worker_busy_seconds_total", "Seconds each inference worker spent in pose.process", ["worker"])
+WORKER_UTILIZATION = metrics.Gauge(
+    "fitness_inference_worker_utilization", "Fraction of recent wall time each inference worker was busy", ["worker"])
+WORKER_STREAMS = metrics.Gauge(
+    "fitness_inference_worker_streams", "Streams pinned to each inference worker", ["worker"])
+WORKER_RESTARTS = metrics.Counter(
+    "fitness_inference_worker_restarts_total", "Inference worker processes restarted after dying", ["worker"])
+
+class InferenceError(RuntimeError):
+    """A request failed in an inference worker, or the worker died while serving it"""
+
+def _worker_main(conn, shm_name, max_frame_bytes, warm_options):
+    """
+    Serve inference requests in a worker process
+
+    Args:
+        conn: Pipe end receiving requests and sending replies
+        shm_name: Shared memory block holding the frame and the landmark output
+        max_frame_bytes: Size of the frame area at the start of the block
+        warm_options: Pose options of the graph built before the first request
+    """
+    import mediapipe as mp
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frame_area = np.ndarray((max_frame_bytes,), dtype=np.uint8, buffer=shm.buf)
+    output = np.ndarray((NUM_LANDMARKS, 4), dtype=np.float32, buffer=shm.buf, offset=max_frame_bytes)
+
+    def build(options):
+        static_image_mode, model_complexity, smooth_landmarks, enable_segmentation, detection, tracking = options
+        return mp.solutions.pose.Pose(
+            static_image_mode=static_image_mode,
+            model_complexity=model_complexity,
+            smooth_landmarks=smooth_landmarks,
+            enable_segmentation=enable_segmentation,
+            min_detection_confidence=detection,
+            min_tracking_confidence=tracking
+        )
+
+    # Load the model before the first stream arrives, so its first frame is not slow.
+    # If that fails, the first request builds its graph and reports the error.
+    try:
+        spare = build(warm_options)
+        spare.process(np.zeros((256, 256, 3), dtype=np.uint8))
+        spare.reset()
+    except Exception:
+        spare = None
+    graphs = {}  # stream_id -> (options, Pose)
+    img = None
+
+    def graph(stream_id, options):
+        """Get a stream's graph, rebuilding it when the options changed"""
+        nonlocal spare
+        entry = graphs.get(stream_id)
+        if entry is None or entry[0] != options:
+            if entry is not None:
+                del graphs[stream_id]
+                entry[1].close()
+            if spare is not None and options == warm_options:
+                pose, spare = spare, None
+            else:
+                pose = build(options)
+            entry = graphs[stream_id] = (options, pose)
+        return entry[1]
+
+    try:
+        while True:
+            message = conn.recv()
+            command = message[0]
+            if command == "stop":
+                break
+            # Replies are ("ok", result) or ("error", message); a failed request
+            # must not take down the worker and every stream pinned to it
+            try:
+                reply = None
+                if command == "process":
+                    _, stream_id, options, shape = message
+                    pose = graph(stream_id, options)
+                    img = frame_area[:shape[0] * shape[1] * shape[2]].reshape(shape)
+                    start = time.perf_counter()
+                    results = pose.process(img)
+                    busy = time.perf_counter() - start
+                    has_pose = bool(results.pose_landmarks)
+                    if has_pose:
+                        output[:] = [(lm.x, lm.y, lm.z, lm.visibility) for lm in results.pose_landmarks.landmark]
+                    reply = (has_pose, busy)
+                elif command == "reconfigure":
+                    graph(message[1], message[2])
+                elif command == "reset":
+                    entry = graphs.get(message[1])
+                    if entry is not None:
+                        entry[1].reset()
+                elif command == "close":
+                    entry = graphs.pop(message[1], None)
+                    if entry is not None:
+                        entry[1].close()
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}"))
+            else:
+                conn.send(("ok", reply))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        for _, pose in graphs.values():
+            pose.close()
+        # The views must go before the block can be closed
+        del frame_area, output, img
+        shm.close()
+
+class PoolLandmarks:
+    """
+    Stand-in for MediaPipe's NormalizedLandmarkList backed by a (33, 4)
+    array. PoseDetector reads the array directly; the protobuf list is only
+    built if something draws with MediaPipe's drawing utilities.
+    """
+    def __init__(self, array):
+        """
+        Initialize from normalized landmarks
+
+        Args:
+            array: (33, 4) float32 array of [x, y, z, visibility] rows
+        """
+        self.array = array
+        self._landmark_list = None
+
+    @property
+    def landmark(self):
+        """Landmarks as MediaPipe NormalizedLandmark messages"""
+        if self._landmark_list is None:
+            from mediapipe.framework.formats import landmark_pb2
+            self._landmark_list = landmark_pb2.NormalizedLandmarkList()
+            for x, y, z, visibility in self.array.tolist():
+                self._landmark_list.landmark.add(x=x, y=y, z=z, visibility=visibility)
+        return self._landmark_list.landmark
+
+class PoolResults:
+    """Result of RemotePose.process, shaped like MediaPipe Pose results"""
+    def __init__(self, pose_landmarks):
+        self.pose_landmarks = pose_landmarks
+
+class _Worker:
+    """Parent-side handle of one worker process"""
+    def __init__(self, index, context, max_frame_bytes, warm_options, request_timeout):
+        self.index = index
+        self.context = context
+        self.max_frame_bytes = max_frame_bytes
+        self.warm_options = warm_options
+        self.request_timeout = request_timeout
+        self.shm = shared_memory.SharedMemory(create=True, size=max_frame_bytes + LANDMARK_BYTES)
+        self.frame_area = np.ndarray((max_frame_bytes,), dtype=np.uint8, buffer=self.shm.buf)
+        self.output = np.ndarray((NUM_LANDMARKS, 4), dtype=np.float32, buffer=self.shm.buf, offset=max_frame_bytes)
+        self._start()
+
+        # One request at a time: the shared memory block holds one frame
+        self.lock = threading.Lock()
+        self.streams = 0
+        self.busy_total = 0.0
+        self.busy_history = deque([(time.monotonic(), 0.0)])
+        self.busy_counter = WORKER_BUSY_SECONDS.labels(worker=index)
+        self.restart_counter = WORKER_RESTARTS.labels(worker=index)
+        WORKER_UTILIZATION.labels(worker=index).set_function(self.utilization)
+        WORKER_STREAMS.labels(worker=index).set_function(lambda: self.streams)
+
+    def _start(self):
+        """Start the worker process, attached to the existing shared memory block"""
+        self.conn, child_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=_worker_main, name=f"pose-worker-{self.index}", daemon=True,
+            args=(child_conn, self.shm.name, self.max_frame_bytes, self.warm_options))
+        self.process.start()
+        child_conn.close()
+
+    def _restart(self, reason):
+        """Replace a dead or hung worker process; its streams rebuild their graphs on their next frame"""
+        logger.error(f"Pose inference worker {self.index} {reason}, restarting it")
+        self.restart_counter.inc()
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=5)
+        self.conn.close()
+        self._start()
+
+    def _call(self, message):
+        """
+        Send a message and wait for the reply, with the lock held
+
+        Returns:
+            Result of the request
+
+        Raises:
+            InferenceError: If the request failed, or the worker died or hung
+        """
+        try:
+            self.conn.send(message)
+            # A hung worker would otherwise block every stream pinned to it, forever
+            if not self.conn.poll(self.request_timeout):
+                self._restart(f"did not answer within {self.request_timeout:.0f} s")
+                raise InferenceError(f"Pose inference worker {self.index} hung and was restarted")
+            status, result = self.conn.recv()
+        except (EOFError, OSError):
+            self._restart(f"died (exit code {self.process.exitcode})")
+            raise InferenceError(f"Pose inference worker {self.index} died and was restarted")
+        if status == "error":
+            raise InferenceError(result)
+        return result
+
+    def request(self, message):
+        """Send a control message and wait for the reply"""
+        with self.lock:
+            return self._call(message)
+
+    def process_frame(self, stream_id, options, img):
+        """
+        Run inference for a stream
+
+        Returns:
+            Normalized (33, 4) landmark array, or None when no pose was found
+        """
+        if img.nbytes > self.max_frame_bytes:
+            raise ValueError(f"Frame of {img.nbytes} bytes exceeds the worker frame buffer of "
+                             f"{self.max_frame_bytes} bytes")
+        with self.lock:
+            np.copyto(self.frame_area[:img.nbytes].reshape(img.shape), img)
+            has_pose, busy = self._call(("process", stream_id, options, img.shape))
+            landmarks = self.output.copy() if has_pose else None
+
+            now = time.monotonic()
+            self.busy_total += busy
+            self.busy_history.append((now, self.busy_total))
+            while len(self.busy_history) > 2 and now - self.busy_history[1][0] > 10.0:
+                self.busy_history.popleft()
+        self.busy_counter.inc(busy)
+        return landmarks
+
+    def utilization(self):
+        """Fraction of the last ~10 seconds spent in inference"""
+        start_time, start_busy = self.busy_history[0]
+        elapsed = time.monotonic() - start_time
+        return round((self.busy_total - start_busy) / elapsed, 3) if elapsed > 0 else 0.0
+
+    def stop(self):
+        """Stop the process and free the shared memory"""
+        try:
+            with self.lock:
+                self.conn.send(("stop",))
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.conn.close()
+        self.shm.unlink()
+        # The views must go before the block can be closed
+        self.frame_area = self.output = None
+        self.shm.close()
+
+class RemotePose:
+    """
+    Drop-in for mp.solutions.pose.Pose that runs on a pool worker. Returned
+    by InferencePool.pose, usually through PoseDetector's inference_pool.
+    """
+    def __init__(self, pool, stream_id, options):
+        """
+        Initialize a graph handle. The stream stays on its worker for the
+        life of the handle, reconfigure included.
+
+        Args:
+            pool: InferencePool that owns the worker
+            stream_id: Identifier of the stream, pins it to one worker
+            options: Tuple of Pose constructor arguments
+        """
+        self.pool = pool
+        self.stream_id = stream_id
+        self.options = options
+        self.worker = pool.assign(stream_id)
+
+    def process(self, img_rgb):
+        """
+        Run pose inference on an RGB image
+
+        Returns:
+            PoolResults with pose_landmarks set to PoolLandmarks or None
+        """
+        landmarks = self.worker.process_frame(self.stream_id, self.options, img_rgb)
+        return PoolResults(PoolLandmarks(landmarks) if landmarks is not None else None)
+
+    def reconfigure(self, **options):
+        """
+        Rebuild the stream's graph on the same worker with changed Pose arguments
+
+        Args:
+            options: Pose constructor arguments to change, e.g. model_complexity=1
+        """
+        values = dict(zip(POSE_OPTIONS, self.options))
+        values.update(options)
+        self.options = tuple(values[name] for name in POSE_OPTIONS)
+        self.worker.request(("reconfigure", self.stream_id, self.options))
+
+    def reset(self):
+        """Clear the stream's tracking state on the worker"""
+        self.worker.request(("reset", self.stream_id))
+
+    def close(self):
+        """Drop the stream's graph on the worker"""
+        try:
+            self.worker.request(("close", self.stream_id))
+        except InferenceError as e:
+            logger.warning(f"Closing stream {self.stream_id}: {e}")
+        finally:
+            self.pool.release(self.stream_id)
+
+class InferencePool:
+    """
+    N worker processes, each with a warm MediaPipe runtime. New streams are
+    pinned to the worker with the fewest streams.
+    """
+    def __init__(self, workers, model_complexity=2, max_frame_size=(1920, 1080), request_timeout=30.0):
+        """
+        Start the worker processes
+
+        Args:
+            workers: Number of worker processes
+            model_complexity: Complexity of the graph each worker loads up front
+            max_frame_size: Largest (width, height) RGB frame a worker accepts
+            request_timeout: Seconds a worker may take to answer before it is
+                restarted; generous, as building a graph loads its model
+        """
+        # Forking a threaded server is unsafe, start clean interpreters instead
+        context = multiprocessing.get_context("spawn")
+        max_frame_bytes = max_frame_size[0] * max_frame_size[1] * 3
+        warm_options = (False, model_complexity, True, False, 0.6, 0.6)
+        self.workers = [_Worker(index, context, max_frame_bytes, warm_options, request_timeout)
+                        for index in range(workers)]
+        self._assignments = {}  # stream_id -> (worker, graph handles)
+        self._lock = threading.Lock()
+        logger.info(f"Started {workers} pose inference workers")
+
+    def assign(self, stream_id):
+        """Get the worker a stream is pinned to, pinning it on first use"""
+        with self._lock:
+            assignment = self._assignments.get(stream_id)
+            if assignment is None:
+                worker = min(self.workers, key=lambda worker: worker.streams)
+                worker.streams += 1
+                assignment = self._assignments[stream_id] = [worker, 0]
+            assignment[1] += 1
+            return assignment[0]
+
+    def release(self, stream_id):
+        """Unpin a stream once its last graph handle is closed"""
+        with self._lock:
+            assignment = self._assignments.get(stream_id)
+            if assignment is None:
+                return
+            assignment[1] -= 1
+            if assignment[1] <= 0:
+                assignment[0].streams -= 1
+                del self._assignments[stream_id]
+
+    def pose(self, stream_id, static_image_mode=False, model_complexity=2, smooth_landmarks=True,
+             enable_segmentation=False, min_detection_confidence=0.5, min_tracking_confidence=0.5):
+        """
+        Create a Pose graph for a stream on its worker
+
+        Args:
+            stream_id: Identifier of the stream, e.g. the session ID
+            Other arguments as for mp.solutions.pose.Pose
+
+        Returns:
+            RemotePose
+        """
+        options = (static_image_mode, model_complexity, smooth_landmarks, enable_segmentation,
+                   min_detection_confidence, min_tracking_confidence)
+        return RemotePose(self, stream_id, options)
+
+    def utilization(self):
+        """Recent busy fraction and pinned stream count per worker"""
+        return [{"worker": worker.index, "streams": worker.streams, "utilization": worker.utilization(),
+                 "alive": worker.process.is_alive()}
+                for worker in self.workers]
+
+    def close(self):
+        """Stop every worker"""
+        for worker in self.workers:
+            worker.stop()
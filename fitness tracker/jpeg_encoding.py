@@ -0,0 +1,204 @@
+"""
+JPEG encoding for the MJPEG stream and decoding of frames uploaded by browsers.
+
+Uses simplejpeg (libjpeg-turbo with a fast DCT) when it is installed and
+falls back to OpenCV otherwise. Quality and chroma subsampling are
+configurable, so bandwidth can be traded against encoding CPU per stream.
+"""
+import cv2
+import numpy as np
+
+try:
+    import simplejpeg
+except ImportError:
+    simplejpeg = None
+
+# Chroma subsampling modes accepted by JpegEncoder
+SUBSAMPLING_MODES = ("444", "422", "420", "411")
+
+_OPENCV_SAMPLING = {
+    "444": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_444,
+    "422": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_422,
+    "420": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_420,
+    "411": cv2.IMWRITE_JPEG_SAMPLING_FACTOR_411
+}
+
+# Start of frame markers, whose segment holds the image size; C4, C8 and CC share the range but are not frames
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+def jpeg_dimensions(data):
+    """
+    Read the size of a JPEG from its start of frame segment, without decoding it
+
+    Args:
+        data: Bytes-like JPEG data
+
+    Returns:
+        (width, height)
+
+    Raises:
+        ValueError: The data has no start of frame segment before its first scan
+    """
+    view = memoryview(data).cast("B")
+    if len(view) < 4 or view[0] != 0xFF or view[1] != 0xD8:
+        raise ValueError("Invalid JPEG frame: missing start of image marker")
+    position = 2
+    while position + 4 <= len(view):
+        if view[position] != 0xFF:
+            break
+        marker = view[position + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            position += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:
+            # Markers without a segment
+            position += 2
+            continue
+        if marker in _SOF_MARKERS:
+            if position + 9 > len(view):
+                break
+            height = view[position + 5] << 8 | view[position + 6]
+            width = view[position + 7] << 8 | view[position + 8]
+            return width, height
+        if marker == 0xDA:
+            break
+        position += 2 + (view[position + 2] << 8 | view[position + 3])
+    raise ValueError("Invalid JPEG frame: no frame header")
+
+class JpegEncoder:
+    """
+    Encodes BGR frames to JPEG and frames them as multipart/x-mixed-replace
+    parts for /video_feed
+    """
+    def __init__(self, quality=80, subsampling="420", backend=None):
+        """
+        Initialize the encoder
+
+        Args:
+            quality: JPEG quality from 1 to 100
+            subsampling: Chroma subsampling, one of SUBSAMPLING_MODES
+            backend: "simplejpeg" or "opencv", the fastest available if omitted
+        """
+        if not 1 <= quality <= 100:
+            raise ValueError(f"JPEG quality must be between 1 and 100, got {quality}")
+        if subsampling not in SUBSAMPLING_MODES:
+            raise ValueError(f"Chroma subsampling must be one of {', '.join(SUBSAMPLING_MODES)}")
+        if backend is None:
+            backend = "simplejpeg" if simplejpeg is not None else "opencv"
+        if backend == "simplejpeg" and simplejpeg is None:
+            raise ValueError("simplejpeg is not installed")
+        if backend not in ("simplejpeg", "opencv"):
+            raise ValueError(f"Unknown JPEG backend: {backend}")
+
+        self.quality = int(quality)
+        self.subsampling = subsampling
+        self.backend = backend
+        self._params = [cv2.IMWRITE_JPEG_QUALITY, self.quality,
+                        cv2.IMWRITE_JPEG_SAMPLING_FACTOR, _OPENCV_SAMPLING[subsampling]]
+
+    def encode(self, img):
+        """
+        Encode a BGR frame
+
+        Args:
+            img: uint8 BGR image
+
+        Returns:
+            Bytes-like JPEG data (bytes or a uint8 array), or None on failure
+        """
+        if self.backend == "simplejpeg":
+            if not img.flags.c_contiguous:
+                img = img.copy()
+            return simplejpeg.encode_jpeg(img, quality=self.quality, colorspace="BGR",
+                                          colorsubsampling=self.subsampling, fastdct=True)
+        ret, buffer = cv2.imencode(".jpg", img, self._params)
+        return buffer if ret else None
+
+    def encode_part(self, img):
+        """
+        Encode a BGR frame as one multipart/x-mixed-replace part
+
+        Args:
+            img: uint8 BGR image
+
+        Returns:
+            Bytes of the complete part, or None on failure
+        """
+        jpeg = self.encode(img)
+        if jpeg is None:
+            return None
+        # join copies the encoder output straight into the part, once
+        header = b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg)
+        return b"".join((header, jpeg, b"\r\n"))
+
+class JpegDecoder:
+    """
+    Decodes uploaded JPEG frames to BGR. With simplejpeg the image is
+    decoded straight into a buffer supplied by the caller, so a stream of
+    uploads can reuse the same memory.
+    """
+    def __init__(self, max_size=(1920, 1080), backend=None):
+        """
+        Initialize the decoder
+
+        Args:
+            max_size: Largest (width, height) accepted
+            backend: "simplejpeg" or "opencv", the fastest available if omitted
+        """
+        if backend is None:
+            backend = "simplejpeg" if simplejpeg is not None else "opencv"
+        if backend == "simplejpeg" and simplejpeg is None:
+            raise ValueError("simplejpeg is not installed")
+        if backend not in ("simplejpeg", "opencv"):
+            raise ValueError(f"Unknown JPEG backend: {backend}")
+
+        self.max_size = max_size
+        self.backend = backend
+
+    def _check_size(self, width, height):
+        if width > self.max_size[0] or height > self.max_size[1]:
+            raise ValueError(f"Frame of {width}x{height} exceeds the maximum of "
+                             f"{self.max_size[0]}x{self.max_size[1]}")
+
+    def decode(self, data, acquire=None, release=None):
+        """
+        Decode a JPEG frame. The size is checked against max_size before
+        anything is decoded.
+
+        Args:
+            data: Bytes-like JPEG data
+            acquire: Optional callable (shape, dtype) -> array supplying the
+                output buffer, e.g. FrameBufferPool.acquire
+            release: Optional callable taking the acquired buffer back when
+                decoding into it fails, e.g. FrameBufferPool.release
+
+        Returns:
+            uint8 BGR image, the acquired buffer when simplejpeg is used
+
+        Raises:
+            ValueError: The data is not a valid JPEG or the image exceeds max_size
+        """
+        if self.backend == "simplejpeg":
+            try:
+                height, width, _, _ = simplejpeg.decode_jpeg_header(data)
+            except ValueError as e:
+                raise ValueError(f"Invalid JPEG frame: {e}") from e
+            self._check_size(width, height)
+            if acquire is None:
+                return simplejpeg.decode_jpeg(data, colorspace="BGR", fastdct=True, fastupsample=True)
+            buffer = acquire((height, width, 3), np.uint8)
+            try:
+                simplejpeg.decode_jpeg(data, colorspace="BGR", fastdct=True, fastupsample=True, buffer=buffer)
+            except ValueError as e:
+                if release is not None:
+                    release(buffer)
+                raise ValueError(f"Invalid JPEG frame: {e}") from e
+            return buffer
+
+        # OpenCV only reports the size after decoding, so a forged header could make it allocate any amount
+        self._check_size(*jpeg_dimensions(data))
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError("Invalid JPEG frame")
+        return img
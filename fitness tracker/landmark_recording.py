@@ -0,0 +1,175 @@
+"""
+Compact binary recording of per-frame landmarks and tracker state.
+
+A recording is a 64-byte header followed by fixed-width little-endian records,
+one per analyzed frame, holding the timestamp, the (33, 4) landmark array and
+the tracker state. Fixed-width records let a reader memory-map the file and
+index any frame directly, and a file cut short by a crash stays readable up
+to its last complete record.
+"""
+import os
+import time
+
+import numpy as np
+
+MAGIC = b"FTLMREC\0"
+VERSION = 1
+HEADER_SIZE = 64
+
+# Frame flags
+FLAG_HAS_POSE = 1
+FLAG_PREDICTED = 2
+FLAG_RUNNING = 4
+
+# Rep stages stored as codes, in this order
+REP_STAGES = ("waiting", "down", "up")
+
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("version", "<u4"),
+    ("record_size", "<u4"),
+    ("width", "<u4"),
+    ("height", "<u4"),
+    ("created", "<f8"),
+    ("reserved", "V32")
+])
+
+RECORD_DTYPE = np.dtype([
+    ("timestamp", "<f8"),  # Tracker clock in seconds
+    ("frame", "<u4"),  # Index of the frame in the recording
+    ("count", "<u4"),  # Reps counted so far
+    ("resets", "<u2"),  # Number of tracker resets so far
+    ("flags", "u1"),
+    ("rep_stage", "u1"),  # Index into REP_STAGES
+    ("exercise", "S16"),
+    ("angle", "<f4"),  # Raw primary angle, NaN without a pose
+    ("percentage", "<f4"),  # Rep completion, NaN without a pose
+    ("landmarks", "<f4", (33, 4))  # [x_px, y_px, z, visibility] rows
+])
+
+class LandmarkRecorder:
+    """
+    Appends one fixed-width record per analyzed frame to a recording file.
+    Attach it to a FitnessTracker with the recorder argument.
+    """
+    def __init__(self, path):
+        """
+        Open a new recording
+
+        Args:
+            path: File to write, replaced if it exists
+        """
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(path, "wb")
+        self._header_written = False
+        self.frames = 0
+        # One record reused for every frame
+        self._record = np.zeros(1, dtype=RECORD_DTYPE)
+
+    def _write_header(self, width, height):
+        """Write the header once the frame size is known"""
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header["magic"] = MAGIC
+        header["version"] = VERSION
+        header["record_size"] = RECORD_DTYPE.itemsize
+        header["width"] = width
+        header["height"] = height
+        header["created"] = time.time()
+        self._file.write(header.tobytes())
+        self._header_written = True
+
+    def write(self, tracker, analysis):
+        """
+        Append the record for one analyzed frame
+
+        Args:
+            tracker: FitnessTracker that analyzed the frame
+            analysis: FrameAnalysis returned by analyze_frame
+        """
+        if not self._header_written:
+            h, w = analysis.frame.shape[:2]
+            self._write_header(w, h)
+
+        record = self._record[0]
+        flags = 0
+        if analysis.landmarks is not None:
+            flags |= FLAG_HAS_POSE
+            record["landmarks"] = analysis.landmarks
+        else:
+            record["landmarks"] = 0
+        if analysis.predicted:
+            flags |= FLAG_PREDICTED
+        if analysis.is_running:
+            flags |= FLAG_RUNNING
+
+        record["timestamp"] = tracker.prev_time
+        record["frame"] = self.frames
+        record["count"] = analysis.count
+        record["resets"] = tracker.reset_count & 0xFFFF  # Replay only looks for changes
+        record["flags"] = flags
+        record["rep_stage"] = REP_STAGES.index(analysis.rep_stage)
+        record["exercise"] = analysis.exercise_type.encode()
+        record["angle"] = np.nan if analysis.angle is None else analysis.angle
+        record["percentage"] = np.nan if analysis.percentage is None else analysis.percentage
+
+        self._file.write(self._record.tobytes())
+        self.frames += 1
+
+    def close(self):
+        """Flush and close the file"""
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+class LandmarkRecording:
+    """
+    Read-only memory-mapped view of a recording. Records are only paged in
+    when accessed, so opening an hour-long session is instant.
+    """
+    def __init__(self, path):
+        """
+        Open and validate a recording
+
+        Args:
+            path: Recording file written by LandmarkRecorder
+        """
+        self.path = path
+        size = os.path.getsize(path)
+        if size < HEADER_SIZE:
+            raise ValueError(f"{path} is not a landmark recording")
+
+        header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)[0]
+        if header["magic"] != MAGIC.rstrip(b"\0"):
+            raise ValueError(f"{path} is not a landmark recording")
+        if header["version"] != VERSION or header["record_size"] != RECORD_DTYPE.itemsize:
+            raise ValueError(f"Unsupported recording version {header['version']} in {path}")
+
+        self.width = int(header["width"])
+        self.height = int(header["height"])
+        self.created = float(header["created"])
+
+        # Ignore a trailing partial record left by an interrupted session
+        count = (size - HEADER_SIZE) // RECORD_DTYPE.itemsize
+        self.records = (np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(count,))
+                        if count else np.zeros(0, dtype=RECORD_DTYPE))
+
+    def __len__(self):
+        return len(self.records)
+
+    def __getitem__(self, index):
+        return self.records[index]
+
+    @property
+    def duration(self):
+        """Seconds between the first and last record"""
+        if not len(self.records):
+            return 0.0
+        return float(self.records["timestamp"][-1] - self.records["timestamp"][0])
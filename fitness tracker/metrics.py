@@ -0,0 +1,212 @@
+"""
+Minimal in-process metrics with Prometheus text exposition.
+
+Counters, gauges and fixed-bucket histograms cheap enough to update on every
+frame: an observation is one bisect and a few additions under a lock.
+"""
+import bisect
+import threading
+import time
+
+# Latency buckets in seconds, from sub-millisecond rule evaluation up to slow inference
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0)
+
+# Every metric created, in creation order
+REGISTRY = []
+
+def _format_labels(labels):
+    """Render a label dictionary as {name="value",...}"""
+    if not labels:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in labels.items())
+    return "{" + pairs + "}"
+
+def _format_value(value):
+    """Render a sample value the way Prometheus expects"""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """
+    Base class for a named metric with optional labels. Each distinct label
+    set gets its own child holding the values.
+    """
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        """
+        Initialize and register the metric
+
+        Args:
+            name: Metric name
+            help_text: Description shown in the HELP line
+            labelnames: Names of the labels children are keyed by
+        """
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            # Expose unlabeled metrics as zero before their first update
+            self._default()
+        REGISTRY.append(self)
+
+    def labels(self, **labels):
+        """
+        Get the child for a label set, creating it on first use
+
+        Returns:
+            Child metric; keep a reference to it on hot paths
+        """
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _default(self):
+        """Child used when the metric has no labels"""
+        return self.labels()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        """Yield (suffix, labels, value) for every exposed sample"""
+        for key, child in list(self._children.items()):
+            labels = dict(zip(self.labelnames, key))
+            for suffix, extra, value in child.samples():
+                yield suffix, dict(labels, **extra), value
+
+    def render(self):
+        """Render the metric in Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines)
+
+class _CounterChild:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        """Increase the counter"""
+        with self._lock:
+            self.value += amount
+
+    def samples(self):
+        yield "", {}, self.value
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+    kind = "counter"
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount=1):
+        """Increase an unlabeled counter"""
+        self._default().inc(amount)
+
+class _GaugeChild:
+    def __init__(self):
+        self.value = 0
+        self.function = None
+
+    def set(self, value):
+        """Set the current value"""
+        self.value = value
+
+    def set_function(self, function):
+        """Read the value from a callable at scrape time"""
+        self.function = function
+
+    def samples(self):
+        yield "", {}, self.function() if self.function else self.value
+
+class Gauge(Metric):
+    """Value that can go up and down"""
+    kind = "gauge"
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value):
+        """Set an unlabeled gauge"""
+        self._default().set(value)
+
+    def set_function(self, function):
+        """Read an unlabeled gauge from a callable at scrape time"""
+        self._default().set_function(function)
+
+class _HistogramChild:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        """Record one observation"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager observing the duration of its block"""
+        return _Timer(self)
+
+    def samples(self):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            yield "_bucket", {"le": _format_value(bound)}, cumulative
+        yield "_sum", {}, total
+        yield "_count", {}, cumulative
+
+class _Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class Histogram(Metric):
+    """Distribution of observations over fixed buckets"""
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        """
+        Initialize and register the histogram
+
+        Args:
+            name: Metric name
+            help_text: Description shown in the HELP line
+            labelnames: Names of the labels children are keyed by
+            buckets: Sorted upper bounds, +Inf is added automatically
+        """
+        self.buckets = tuple(buckets)
+        super().__init__(name, help_text, labelnames)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value):
+        """Record one observation on an unlabeled histogram"""
+        self._default().observe(value)
+
+def render_prometheus():
+    """Render every registered metric in Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
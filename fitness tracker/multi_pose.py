@@ -0,0 +1,196 @@
+"""
+Multi-person pose detection for group classes.
+
+MultiPoseDetector wraps the MediaPipe Tasks PoseLandmarker, which finds up
+to num_poses people in one inference pass: the person detector runs once
+per frame and, in video mode, only while someone is untracked, so the cost
+grows with the landmark model per person rather than a whole pipeline per
+person. CentroidTracker gives the poses stable person IDs from frame to
+frame by matching the centroids of their visible landmarks.
+
+The PoseLandmarker needs a model bundle that is not part of the mediapipe
+package. Download pose_landmarker_full.task (or the lite or heavy variant)
+from MODEL_URL and pass its path; app2 looks for it in its data directory
+unless FITNESS_POSE_MODEL says otherwise.
+"""
+import os
+import time
+
+import cv2
+import numpy as np
+
+NUM_LANDMARKS = 33
+
+# Download location of the default model bundle
+MODEL_URL = ("https://storage.googleapis.com/mediapipe-models/pose_landmarker/"
+             "pose_landmarker_full/float16/latest/pose_landmarker_full.task")
+
+class MultiPoseDetector:
+    """
+    Finds the landmarks of several people per frame with the MediaPipe Tasks
+    PoseLandmarker in video mode
+    """
+    def __init__(self, model_path, num_poses=4, min_detection_confidence=0.5,
+                 min_presence_confidence=0.5, min_tracking_confidence=0.5):
+        """
+        Load the model
+
+        Args:
+            model_path: PoseLandmarker .task model bundle
+            num_poses: Most people detected per frame
+            min_detection_confidence: Minimum confidence of the person detector
+            min_presence_confidence: Minimum confidence that a tracked pose is still present
+            min_tracking_confidence: Minimum confidence for tracking instead of detecting again
+
+        Raises:
+            FileNotFoundError: If model_path does not exist
+        """
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(f"PoseLandmarker model {model_path} not found, download it from {MODEL_URL}")
+        # Imported here so single-person setups never load the Tasks runtime
+        import mediapipe as mp
+        from mediapipe.tasks.python import BaseOptions, vision
+
+        self._mp = mp
+        self.model_path = model_path
+        self.num_poses = num_poses
+        options = vision.PoseLandmarkerOptions(
+            base_options=BaseOptions(model_asset_path=model_path),
+            running_mode=vision.RunningMode.VIDEO,
+            num_poses=num_poses,
+            min_pose_detection_confidence=min_detection_confidence,
+            min_pose_presence_confidence=min_presence_confidence,
+            min_tracking_confidence=min_tracking_confidence
+        )
+        self.landmarker = vision.PoseLandmarker.create_from_options(options)
+        self.inference_time = 0.0
+        # Landmarks as (x_px, y_px, z, visibility) rows per person, overwritten in place every frame
+        self.landmarks = np.zeros((num_poses, NUM_LANDMARKS, 4), dtype=np.float32)
+        self._rgb = None  # Color conversion output, reused while the frame size is unchanged
+        self._last_ms = -1
+
+    def detect(self, img, timestamp):
+        """
+        Find every person in a frame
+
+        Args:
+            img: BGR frame
+            timestamp: Frame time in seconds, increasing from call to call
+
+        Returns:
+            (people, 33, 4) float32 view of [x, y, z, visibility] rows in pixel
+            coordinates, valid until the next call
+        """
+        h, w = img.shape[:2]
+        if self._rgb is None or self._rgb.shape != img.shape:
+            self._rgb = np.empty_like(img)
+        cv2.cvtColor(img, cv2.COLOR_BGR2RGB, dst=self._rgb)
+
+        # Video mode needs strictly increasing millisecond timestamps
+        timestamp_ms = max(int(timestamp * 1000), self._last_ms + 1)
+        self._last_ms = timestamp_ms
+
+        start = time.perf_counter()
+        image = self._mp.Image(image_format=self._mp.ImageFormat.SRGB, data=self._rgb)
+        result = self.landmarker.detect_for_video(image, timestamp_ms)
+        self.inference_time = time.perf_counter() - start
+
+        people = len(result.pose_landmarks)
+        for person, pose in enumerate(result.pose_landmarks):
+            self.landmarks[person] = [(lm.x, lm.y, lm.z, lm.visibility) for lm in pose]
+        found = self.landmarks[:people]
+        found[:, :, 0] *= w
+        found[:, :, 1] *= h
+        return found
+
+    def close(self):
+        """Release the model"""
+        self.landmarker.close()
+
+class CentroidTracker:
+    """
+    Assigns stable IDs to the poses of consecutive frames. Each pose is
+    reduced to the centroid of its visible landmarks, and poses are matched
+    to the tracks of the previous frames greedily, closest pair first.
+    """
+    def __init__(self, max_distance=0.2, max_missing=15, visibility_threshold=0.5):
+        """
+        Initialize without tracks
+
+        Args:
+            max_distance: Furthest a person's centroid may move between
+                matched frames, as a fraction of the frame diagonal
+            max_missing: Frames a track survives without a matching pose
+            visibility_threshold: Minimum visibility of the landmarks the centroid is taken over
+        """
+        self.max_distance = max_distance
+        self.max_missing = max_missing
+        self.visibility_threshold = visibility_threshold
+        self.reset()
+
+    def reset(self):
+        """Forget every track"""
+        self.next_id = 1
+        self.ids = []  # Track IDs, parallel to centroids and missing
+        self.centroids = np.empty((0, 2))
+        self.missing = []
+        self.expired = []  # IDs whose tracks ended in the last update
+
+    def _centroids(self, landmarks):
+        """(people, 2) centroids of the visible landmarks, of all of them for a pose with none visible"""
+        visible = landmarks[:, :, 3] >= self.visibility_threshold
+        weights = np.where(visible.any(axis=1, keepdims=True), visible, True).astype(np.float64)
+        return np.einsum("pl,plc->pc", weights, landmarks[:, :, :2]) / weights.sum(axis=1, keepdims=True)
+
+    def update(self, landmarks, frame_size):
+        """
+        Match a frame's poses to the tracks
+
+        Args:
+            landmarks: (people, 33, 4) landmark array in pixel coordinates
+            frame_size: (width, height) of the frame
+
+        Returns:
+            List of person IDs, one per pose in landmarks order
+        """
+        centroids = self._centroids(landmarks) if len(landmarks) else np.empty((0, 2))
+        assigned = [None] * len(centroids)
+        matched_tracks = set()
+
+        if len(centroids) and self.ids:
+            limit = self.max_distance * float(np.hypot(*frame_size))
+            distances = np.linalg.norm(centroids[:, None, :] - self.centroids[None, :, :], axis=2)
+            for flat in np.argsort(distances, axis=None):
+                pose, track = divmod(int(flat), len(self.ids))
+                if distances[pose, track] > limit:
+                    break
+                if assigned[pose] is None and track not in matched_tracks:
+                    assigned[pose] = self.ids[track]
+                    matched_tracks.add(track)
+
+        # Matched tracks move, the others age and end after max_missing frames
+        ids, kept, missing = [], [], []
+        self.expired = []
+        for track, track_id in enumerate(self.ids):
+            if track in matched_tracks:
+                continue
+            if self.missing[track] + 1 > self.max_missing:
+                self.expired.append(track_id)
+            else:
+                ids.append(track_id)
+                kept.append(self.centroids[track])
+                missing.append(self.missing[track] + 1)
+
+        # Unmatched poses start new tracks
+        for pose, centroid in enumerate(centroids):
+            if assigned[pose] is None:
+                assigned[pose] = self.next_id
+                self.next_id += 1
+            ids.append(assigned[pose])
+            kept.append(centroid)
+            missing.append(0)
+
+        self.ids = ids
+        self.centroids = np.array(kept).reshape(-1, 2)
+        self.missing = missing
+        return assigned
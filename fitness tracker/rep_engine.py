@@ -0,0 +1,162 @@
+"""
+Rep detection from the primary angle of an exercise.
+
+A rep goes down when the rep completion percentage drops to DOWN_PERCENT or
+below, and completes when it then rises to UP_PERCENT or above. The same
+rule has two front ends that give identical results:
+
+- RepCounter, updated once per frame by the live tracker
+- detect_reps, which takes a whole angle time series and finds the reps
+  with vectorized threshold crossings, for offline scoring and threshold
+  tuning
+"""
+from dataclasses import dataclass
+
+import numpy as np
+
+# Rep completion percentages that start and finish a rep
+DOWN_PERCENT = 10
+UP_PERCENT = 90
+
+def rep_percentage(angle, down_threshold, up_threshold):
+    """
+    Rep completion percentage of an angle, 0 at down_threshold and 100 at up_threshold
+
+    Args:
+        angle: Angle in degrees, scalar or array
+
+    Returns:
+        Percentage clipped to [0, 100], NaN where the angle is NaN
+    """
+    return np.interp(angle, (down_threshold, up_threshold), (0, 100))
+
+@dataclass
+class Rep:
+    """One completed rep"""
+    start: float  # Time the rep went down
+    end: float  # Time the rep completed
+    min_angle: float = None  # Angle range from going down to completion
+    max_angle: float = None
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+class RepCounter:
+    """Streaming front end: the rep state machine advanced one frame at a time"""
+    def __init__(self, down_percent=DOWN_PERCENT, up_percent=UP_PERCENT):
+        """
+        Args:
+            down_percent: Percentage at or below which a rep goes down
+            up_percent: Percentage at or above which a rep that went down completes
+        """
+        self.down_percent = down_percent
+        self.up_percent = up_percent
+        self.reset()
+
+    def reset(self):
+        """Forget the rep in progress and the count"""
+        self.stage = "waiting"  # waiting, down
+        self.count = 0
+        self.rep_start = None
+        self.min_angle = None
+        self.max_angle = None
+
+    def update(self, percentage, timestamp, angle=None):
+        """
+        Advance by one frame
+
+        Args:
+            percentage: Rep completion percentage of the frame
+            timestamp: Frame time in seconds
+            angle: Angle of the frame, for the range of motion
+
+        Returns:
+            The completed Rep, or None
+        """
+        if angle is not None and self.stage == "down":
+            self.min_angle = angle if self.min_angle is None else min(self.min_angle, angle)
+            self.max_angle = angle if self.max_angle is None else max(self.max_angle, angle)
+
+        if percentage <= self.down_percent and self.stage != "down":
+            self.stage = "down"
+            self.rep_start = timestamp
+            self.min_angle = self.max_angle = angle
+        elif percentage >= self.up_percent and self.stage == "down":
+            self.stage = "waiting"
+            self.count += 1
+            return Rep(self.rep_start, timestamp, self.min_angle, self.max_angle)
+        return None
+
+@dataclass
+class RepSeries:
+    """Reps found by detect_reps, one array element per rep"""
+    start_index: np.ndarray  # Frame the rep went down
+    end_index: np.ndarray  # Frame the rep completed
+    start: np.ndarray  # Times of those frames
+    end: np.ndarray
+    min_angle: np.ndarray  # Angle range from start_index to end_index inclusive
+    max_angle: np.ndarray
+
+    def __len__(self):
+        return len(self.start_index)
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def reps(self):
+        """The reps as Rep objects, as RepCounter returns them"""
+        return [Rep(*values) for values in zip(self.start.tolist(), self.end.tolist(),
+                                               self.min_angle.tolist(), self.max_angle.tolist())]
+
+def detect_reps(angles, timestamps, down_threshold, up_threshold,
+                down_percent=DOWN_PERCENT, up_percent=UP_PERCENT):
+    """
+    Batch front end: find every rep in an angle time series at once.
+    Gives the same reps as feeding the frames to a fresh RepCounter.
+
+    Args:
+        angles: 1-D array of smoothed angles, NaN for frames without a pose
+        timestamps: Frame times in seconds, same length as angles
+        down_threshold: Angle at 0% rep completion
+        up_threshold: Angle at 100% rep completion
+        down_percent, up_percent: As for RepCounter
+
+    Returns:
+        RepSeries
+    """
+    angles = np.asarray(angles, dtype=np.float64)
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    percentages = rep_percentage(angles, down_threshold, up_threshold)
+
+    # Only frames past either threshold can change the stage. Among those, the
+    # stage goes down at the first low frame of every run of low frames, and
+    # a rep completes at the first high frame of the run of high frames after it.
+    low = percentages <= down_percent
+    high = percentages >= up_percent
+    events = np.flatnonzero(low | high)
+    is_high = high[events]
+    run_start = np.empty(len(events), dtype=bool)
+    run_start[:1] = True
+    run_start[1:] = is_high[1:] != is_high[:-1]
+    starts = events[run_start]
+    starts_high = is_high[run_start]
+
+    # Runs alternate, so every high run but a leading one completes the rep of the low run before it
+    completed = np.flatnonzero(starts_high)
+    completed = completed[completed > 0]
+    start_index = starts[completed - 1]
+    end_index = starts[completed]
+
+    # Range of motion per rep: reduce over [start, end] segments, skipping NaN
+    if len(start_index):
+        padded = np.append(angles, np.nan)
+        bounds = np.column_stack((start_index, end_index + 1)).ravel()
+        min_angle = np.fmin.reduceat(padded, bounds)[::2]
+        max_angle = np.fmax.reduceat(padded, bounds)[::2]
+    else:
+        min_angle = max_angle = np.empty(0)
+
+    return RepSeries(start_index, end_index, timestamps[start_index], timestamps[end_index],
+                     min_angle, max_angle)
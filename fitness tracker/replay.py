@@ -0,0 +1,222 @@
+"""
+Replay a landmark recording through the exercise rules without inference.
+
+Feeds the recorded landmarks, timestamps and user actions (start/stop,
+reset, exercise changes) back into a FitnessTracker, so a session can be
+re-checked after the fact in a fraction of its length: why a rep was not
+counted, or what different thresholds would have counted.
+
+--sweep scores a grid of thresholds at once: the recorded angles are
+smoothed once, and batch rep detection runs over the whole session per
+threshold pair.
+
+Usage:
+    python replay.py recordings/session_20240101_180000.lmk
+    python replay.py session.lmk --down-threshold 100 --json replay.json
+    python replay.py session.lmk --sweep-up 150,160,170 --sweep-down 80,90,100
+"""
+import argparse
+import dataclasses
+import json
+import logging
+import time
+
+import numpy as np
+
+from app2 import (COMPILED_EXERCISES, DEFAULT_ANGLE_FILTER, EXERCISE_CONFIGS, AssignedPoseDetector,
+                  FitnessTracker, FrameClock)
+from landmark_recording import FLAG_HAS_POSE, FLAG_RUNNING, LandmarkRecording
+from rep_engine import detect_reps
+from signal_filters import make_filter
+
+def override_thresholds(exercises, up_threshold=None, down_threshold=None):
+    """
+    Replace the rep thresholds of exercises for this process
+
+    Args:
+        exercises: Exercise names to change
+        up_threshold: New up threshold, None keeps the configured one
+        down_threshold: New down threshold, None keeps the configured one
+    """
+    changes = {}
+    if up_threshold is not None:
+        changes["up_threshold"] = up_threshold
+    if down_threshold is not None:
+        changes["down_threshold"] = down_threshold
+    if not changes:
+        return
+    for name in exercises:
+        EXERCISE_CONFIGS[name] = dataclasses.replace(EXERCISE_CONFIGS[name], **changes)
+        COMPILED_EXERCISES.pop(name, None)
+
+def replay(recording):
+    """
+    Run the exercise rules over every record of a recording
+
+    Args:
+        recording: LandmarkRecording to replay
+
+    Returns:
+        Dictionary comparing the replayed and recorded rep counts
+    """
+    clock = FrameClock()
+    # Serves the recorded landmarks instead of running a model
+    detector = AssignedPoseDetector()
+    tracker = FitnessTracker(detector=detector, clock=clock)
+    # Only the rules run, so a single pixel stands in for the camera frame
+    frame = np.zeros((1, 1, 3), dtype=np.uint8)
+
+    records = recording.records
+    resets = None
+    first_divergence = None
+    start = time.perf_counter()
+
+    for record in records:
+        clock.set(float(record["timestamp"]))
+
+        # Re-apply the user actions in effect when the frame was analyzed
+        exercise_type = record["exercise"].decode()
+        if exercise_type != tracker.exercise_type:
+            tracker.change_exercise(exercise_type)
+        elif resets is not None and record["resets"] != resets:
+            tracker.reset()
+        resets = record["resets"]
+        if bool(record["flags"] & FLAG_RUNNING) != tracker.is_running:
+            tracker.toggle_start_stop()
+
+        detector.assigned = record["landmarks"] if record["flags"] & FLAG_HAS_POSE else None
+        tracker.analyze_frame(frame)
+
+        if first_divergence is None and tracker.count != record["count"]:
+            first_divergence = {
+                "frame": int(record["frame"]),
+                "timestamp": round(float(record["timestamp"]), 3),
+                "recorded_count": int(record["count"]),
+                "replayed_count": int(tracker.count)
+            }
+
+    elapsed = time.perf_counter() - start
+    stats = tracker.get_exercise_stats()
+    return {
+        "recording": recording.path,
+        "frames": len(records),
+        "duration": round(recording.duration, 3),
+        "exercise_type": stats["exercise_type"],
+        "recorded_count": int(records["count"][-1]) if len(records) else 0,
+        "replayed_count": stats["count"],
+        "first_divergence": first_divergence,
+        "time": stats["time"],
+        "rep_history": stats["rep_history"],
+        "replay_seconds": round(elapsed, 3)
+    }
+
+def smoothed_segments(recording):
+    """
+    Smooth the recorded angles the way the tracker did, once per segment
+
+    A segment is a stretch of records between two resets or exercise changes.
+    Frames without an angle or while paused are NaN, so rep detection skips them.
+
+    Returns:
+        List of (exercise_type, timestamps, smoothed angles)
+    """
+    records = recording.records
+    if not len(records):
+        return []
+    exercises = records["exercise"]
+    resets = records["resets"]
+    boundaries = np.flatnonzero((exercises[1:] != exercises[:-1]) | (resets[1:] != resets[:-1])) + 1
+    segments = []
+    for start, end in zip(np.concatenate(([0], boundaries)), np.concatenate((boundaries, [len(records)]))):
+        exercise_type = exercises[start].decode()
+        config = EXERCISE_CONFIGS[exercise_type]
+        angle_filter = make_filter(config.angle_filter or DEFAULT_ANGLE_FILTER)
+        timestamps = records["timestamp"][start:end].astype(np.float64)
+        raw = records["angle"][start:end].astype(np.float64)
+        running = (records["flags"][start:end] & FLAG_RUNNING) != 0
+        smoothed = np.full(len(raw), np.nan)
+        for i in np.flatnonzero(~np.isnan(raw)):
+            value = angle_filter(raw[i], timestamps[i])
+            if running[i]:
+                smoothed[i] = value
+        segments.append((exercise_type, timestamps, smoothed))
+    return segments
+
+def sweep(recording, up_thresholds, down_thresholds):
+    """
+    Count the reps of a recording for every pair of thresholds
+
+    Args:
+        recording: LandmarkRecording to score
+        up_thresholds: Up thresholds to try, None keeps each exercise's own
+        down_thresholds: Down thresholds to try, None keeps each exercise's own
+
+    Returns:
+        List of {"up_threshold", "down_threshold", "reps"} dictionaries
+    """
+    segments = smoothed_segments(recording)
+    results = []
+    for up_threshold in up_thresholds or [None]:
+        for down_threshold in down_thresholds or [None]:
+            reps = 0
+            for exercise_type, timestamps, angles in segments:
+                config = EXERCISE_CONFIGS[exercise_type]
+                up = config.up_threshold if up_threshold is None else up_threshold
+                down = config.down_threshold if down_threshold is None else down_threshold
+                if down < up:
+                    reps += len(detect_reps(angles, timestamps, down, up))
+            results.append({"up_threshold": up_threshold, "down_threshold": down_threshold, "reps": reps})
+    return results
+
+def parse_thresholds(value):
+    """Parse a comma-separated threshold list"""
+    return [int(item) for item in value.split(",")] if value else None
+
+def main(argv=None):
+    """Command-line entry point"""
+    parser = argparse.ArgumentParser(description="Replay a landmark recording through the exercise rules")
+    parser.add_argument("recording", help="Recording file written with FITNESS_RECORD_DIR or --record")
+    parser.add_argument("--up-threshold", type=int, help="Override the up threshold of the recorded exercises")
+    parser.add_argument("--down-threshold", type=int, help="Override the down threshold of the recorded exercises")
+    parser.add_argument("--json", help="Write the replay result to this JSON file")
+    parser.add_argument("--sweep-up", type=parse_thresholds, help="Comma-separated up thresholds to score")
+    parser.add_argument("--sweep-down", type=parse_thresholds, help="Comma-separated down thresholds to score")
+    args = parser.parse_args(argv)
+
+    # Exercise changes and resets would log once per replayed action
+    logging.getLogger("app2").setLevel(logging.WARNING)
+
+    recording = LandmarkRecording(args.recording)
+    if args.sweep_up or args.sweep_down:
+        start = time.perf_counter()
+        results = sweep(recording, args.sweep_up, args.sweep_down)
+        elapsed = time.perf_counter() - start
+        print(f"{len(results)} threshold pairs over {len(recording)} frames in {elapsed:.2f} s")
+        print(f"{'up':>6}{'down':>6}{'reps':>6}")
+        for result in results:
+            up = "-" if result["up_threshold"] is None else result["up_threshold"]
+            down = "-" if result["down_threshold"] is None else result["down_threshold"]
+            print(f"{up:>6}{down:>6}{result['reps']:>6}")
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(results, f, indent=2)
+        return 0
+
+    exercises = {name.decode() for name in np.unique(recording.records["exercise"])}
+    override_thresholds(exercises, args.up_threshold, args.down_threshold)
+
+    result = replay(recording)
+    print(f"{result['frames']} frames, {result['duration']:.1f} s recorded, "
+          f"replayed in {result['replay_seconds']:.2f} s")
+    print(f"Reps: recorded {result['recorded_count']}, replayed {result['replayed_count']}")
+    if result["first_divergence"]:
+        divergence = result["first_divergence"]
+        print(f"Counts first differ at frame {divergence['frame']} ({divergence['timestamp']} s)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,249 @@
+"""
+Durable store for workout sessions and their reps.
+
+Sessions and completed reps, with per-rep metrics, go to an SQLite database
+in WAL mode. The frame-processing threads only put a tuple on a queue; a
+single writer thread drains the queue and commits it in batches, so
+persistence never adds disk latency to a frame. Reads use their own
+connections and, thanks to WAL, never block the writer.
+"""
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    camera_index INTEGER,
+    created REAL NOT NULL,
+    ended REAL
+);
+CREATE TABLE IF NOT EXISTS reps (
+    id INTEGER PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES sessions(id),
+    set_index INTEGER NOT NULL,
+    exercise_type TEXT NOT NULL,
+    rep_number INTEGER NOT NULL,
+    completed_at REAL NOT NULL,
+    elapsed TEXT,
+    duration REAL,
+    min_angle REAL,
+    max_angle REAL,
+    confidence REAL,
+    form_issues TEXT
+);
+CREATE INDEX IF NOT EXISTS reps_by_session ON reps (session_id, id);
+"""
+
+STORE_BATCH_SIZE = metrics.Histogram(
+    "fitness_session_store_batch_size", "Writes committed per session store transaction",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500))
+STORE_QUEUE_DEPTH = metrics.Gauge(
+    "fitness_session_store_queue_depth", "Writes waiting for the session store writer")
+
+class SessionStore:
+    """
+    SQLite-backed session history with batched background writes. The
+    record methods are safe to call from any thread and never block on disk.
+    """
+    def __init__(self, path, flush_interval=1.0, max_batch=500):
+        """
+        Open the database and start the writer thread
+
+        Args:
+            path: Database file, created if it does not exist
+            flush_interval: Longest time in seconds a write waits for its batch
+            max_batch: Most writes committed in one transaction
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        connection = self._connect()
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.executescript(SCHEMA)
+        connection.close()
+
+        self._queue = queue.Queue()
+        STORE_QUEUE_DEPTH.set_function(self._queue.qsize)
+        self._closed = False
+        self._writer = threading.Thread(target=self._run, name="session-store", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        """Open a connection; each thread uses its own"""
+        connection = sqlite3.connect(self.path, timeout=10.0)
+        # WAL keeps committed data on a crash; NORMAL skips the fsync per commit
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.row_factory = sqlite3.Row
+        return connection
+
+    def start_session(self, session_id, camera_index=0):
+        """Record that a session started, or restarted under the same ID"""
+        self._queue.put(("start", (session_id, camera_index, time.time())))
+
+    def end_session(self, session_id):
+        """Record that a session ended"""
+        self._queue.put(("end", (time.time(), session_id)))
+
+    def record_rep(self, session_id, set_index, exercise_type, rep_number, rep):
+        """
+        Queue a completed rep
+
+        Args:
+            session_id: Session the rep belongs to
+            set_index: Number of resets before the rep, reps between two resets form a set
+            exercise_type: Exercise name
+            rep_number: Count after the rep
+            rep: Rep entry from FitnessTracker.rep_history
+        """
+        self._queue.put(("rep", (
+            session_id, set_index, exercise_type, rep_number, time.time(), rep["time"], rep.get("duration"),
+            rep.get("min_angle"), rep.get("max_angle"), rep["confidence"], list(rep["form_issues"])
+        )))
+
+    def _run(self):
+        """Writer thread: commit queued writes in batches"""
+        connection = self._connect()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                # Gather what arrives within the flush interval into the same transaction,
+                # committing early when closing or when somebody waits in flush
+                deadline = time.monotonic() + self.flush_interval
+                while len(batch) < self.max_batch and batch[-1] is not None and batch[-1][0] != "flush":
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(self._queue.get(timeout=timeout))
+                    except queue.Empty:
+                        break
+
+                self._write(connection, [item for item in batch if item is not None and item[0] != "flush"])
+                for item in batch:
+                    if item is not None and item[0] == "flush":
+                        item[1].set()
+                    self._queue.task_done()
+                if batch[-1] is None:
+                    break
+        finally:
+            connection.close()
+
+    def _write(self, connection, batch):
+        """Commit one batch of writes in a single transaction"""
+        if not batch:
+            return
+        try:
+            with connection:
+                for kind, params in batch:
+                    if kind == "rep":
+                        # Serialized here rather than in record_rep, off the frame thread
+                        params = params[:-1] + (json.dumps(params[-1]),)
+                        connection.execute(
+                            "INSERT INTO reps (session_id, set_index, exercise_type, rep_number, completed_at, "
+                            "elapsed, duration, min_angle, max_angle, confidence, form_issues) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", params)
+                    elif kind == "start":
+                        connection.execute(
+                            "INSERT INTO sessions (id, camera_index, created) VALUES (?, ?, ?) "
+                            "ON CONFLICT (id) DO UPDATE SET ended = NULL", params)
+                    elif kind == "end":
+                        connection.execute("UPDATE sessions SET ended = ? WHERE id = ?", params)
+            STORE_BATCH_SIZE.observe(len(batch))
+        except sqlite3.Error as e:
+            logger.error(f"Failed to write {len(batch)} session store entries: {e}")
+
+    def flush(self, timeout=5.0):
+        """
+        Wait until everything queued so far is committed
+
+        Returns:
+            True if the writes were committed within timeout
+        """
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._queue.put(("flush", done))
+        return done.wait(timeout)
+
+    def close(self):
+        """Commit the remaining writes and stop the writer"""
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(None)
+        self._writer.join(timeout=10)
+
+    def sessions(self, limit=50):
+        """
+        Most recently started sessions with their rep totals
+
+        Args:
+            limit: Most sessions to return
+
+        Returns:
+            List of session dictionaries, newest first
+        """
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT s.id, s.camera_index, s.created, s.ended, COUNT(r.id) AS reps "
+                "FROM sessions s LEFT JOIN reps r ON r.session_id = s.id "
+                "GROUP BY s.id ORDER BY s.created DESC LIMIT ?", (limit,)).fetchall()
+        finally:
+            connection.close()
+        return [dict(row) for row in rows]
+
+    def session_history(self, session_id):
+        """
+        A session's reps grouped into sets
+
+        Args:
+            session_id: Session identifier
+
+        Returns:
+            Dictionary with the session and its sets, or None if the session is unknown
+        """
+        connection = self._connect()
+        try:
+            session = connection.execute(
+                "SELECT id, camera_index, created, ended FROM sessions WHERE id = ?", (session_id,)).fetchone()
+            if session is None:
+                return None
+            rows = connection.execute(
+                "SELECT set_index, exercise_type, rep_number, completed_at, elapsed, duration, min_angle, "
+                "max_angle, confidence, form_issues FROM reps WHERE session_id = ? ORDER BY id",
+                (session_id,)).fetchall()
+        finally:
+            connection.close()
+
+        sets = []
+        for row in rows:
+            rep = dict(row)
+            set_index = rep.pop("set_index")
+            exercise_type = rep.pop("exercise_type")
+            rep["form_issues"] = json.loads(rep["form_issues"]) if rep["form_issues"] else []
+            if not sets or sets[-1]["set_index"] != set_index or sets[-1]["exercise_type"] != exercise_type:
+                sets.append({"set_index": set_index, "exercise_type": exercise_type, "reps": []})
+            sets[-1]["reps"].append(rep)
+        for workout_set in sets:
+            reps = workout_set["reps"]
+            workout_set["count"] = len(reps)
+            workout_set["avg_confidence"] = sum(rep["confidence"] for rep in reps) / len(reps)
+
+        history = dict(session)
+        history["total_reps"] = len(rows)
+        history["sets"] = sets
+        return history
@@ -0,0 +1,197 @@
+"""
+Smoothing filters for the rep angle and landmark signals.
+
+Every filter works on a scalar or on a whole array at once, e.g. the (33, 2)
+landmark coordinates, filtering each element independently. Each one reports
+the lag it currently adds, in seconds, so latency and jitter can be traded
+per exercise:
+
+- MovingAverageFilter: mean of the last N samples in a ring buffer.
+  Lag (N - 1) / 2 frames.
+- ExponentialFilter: first-order low-pass with a fixed weight.
+  Lag (1 - alpha) / alpha frames.
+- OneEuroFilter: low-pass whose cutoff rises with speed, so it smooths
+  jitter heavily while the signal is still and follows it closely while it
+  moves (Casiez et al., CHI 2012).
+"""
+import math
+
+import numpy as np
+
+class SignalFilter:
+    """
+    Base class of the filters. Call the filter with each new sample and its
+    timestamp to get the filtered value.
+    """
+    def __init__(self):
+        self.lag = 0.0  # Seconds of delay the last output carries
+        self._last_time = None
+        self._period = 0.0  # Smoothed seconds between samples
+
+    def __call__(self, value, timestamp):
+        """
+        Filter one sample
+
+        Args:
+            value: Scalar or array; the shape must not change until reset
+            timestamp: Sample time in seconds
+
+        Returns:
+            Filtered value, a float for scalar input, otherwise an array owned by the filter
+        """
+        value = np.asarray(value, dtype=np.float64)
+        if self._last_time is not None and timestamp > self._last_time:
+            dt = timestamp - self._last_time
+            self._period = 0.9 * self._period + 0.1 * dt if self._period else dt
+        self._last_time = timestamp
+        result = self._filter(value)
+        return float(result) if result.ndim == 0 else result
+
+    def _filter(self, value):
+        raise NotImplementedError
+
+    def reset(self):
+        """Forget the signal history"""
+        self.lag = 0.0
+        self._last_time = None
+        self._period = 0.0
+
+    @property
+    def lag_frames(self):
+        """Lag of the last output in frames"""
+        return self.lag / self._period if self._period else 0.0
+
+class MovingAverageFilter(SignalFilter):
+    """Mean of the last window samples, kept in a ring buffer with a running sum"""
+    def __init__(self, window=5):
+        """
+        Args:
+            window: Number of samples averaged
+        """
+        super().__init__()
+        if window < 1:
+            raise ValueError(f"Moving average window must be at least 1, got {window}")
+        self.window = int(window)
+        self._buffer = None
+        self.reset()
+
+    def reset(self):
+        super().reset()
+        self._count = 0
+        self._index = 0
+        self._sum = None
+
+    def _filter(self, value):
+        if self._buffer is None or self._buffer.shape[1:] != value.shape:
+            self._buffer = np.zeros((self.window,) + value.shape)
+        if self._count == 0:
+            self._sum = np.zeros(value.shape)
+        if self._count == self.window:
+            self._sum -= self._buffer[self._index]
+        else:
+            self._count += 1
+        self._buffer[self._index] = value
+        self._sum += value
+        self._index = (self._index + 1) % self.window
+        self.lag = (self._count - 1) / 2 * self._period
+        return self._sum / self._count
+
+class ExponentialFilter(SignalFilter):
+    """Exponential moving average with a fixed weight per sample"""
+    def __init__(self, alpha=0.5):
+        """
+        Args:
+            alpha: Weight of the newest sample, from 0 (frozen) to 1 (unfiltered)
+        """
+        super().__init__()
+        if not 0 < alpha <= 1:
+            raise ValueError(f"Exponential filter alpha must be in (0, 1], got {alpha}")
+        self.alpha = alpha
+        self._value = None
+
+    def reset(self):
+        super().reset()
+        self._value = None
+
+    def _filter(self, value):
+        if self._value is None or self._value.shape != value.shape:
+            self._value = value.copy()
+            self.lag = 0.0
+            return self._value
+        self._value += self.alpha * (value - self._value)
+        self.lag = (1 - self.alpha) / self.alpha * self._period
+        return self._value
+
+class OneEuroFilter(SignalFilter):
+    """
+    One Euro filter: an exponential filter whose cutoff frequency grows with
+    the filtered speed of the signal, per element
+    """
+    def __init__(self, min_cutoff=1.0, beta=0.01, d_cutoff=1.0):
+        """
+        Args:
+            min_cutoff: Cutoff in Hz while the signal is still; lower removes more jitter
+            beta: Cutoff increase per unit of speed; higher follows fast motion with less lag
+            d_cutoff: Cutoff in Hz of the speed estimate
+        """
+        super().__init__()
+        if min_cutoff <= 0 or d_cutoff <= 0 or beta < 0:
+            raise ValueError("One Euro cutoffs must be positive and beta non-negative")
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+        self._value = None
+
+    def reset(self):
+        super().reset()
+        self._value = None
+        self._speed = None
+
+    @staticmethod
+    def _alpha(cutoff, dt):
+        """Smoothing weight of a first-order low-pass at cutoff Hz sampled every dt seconds"""
+        tau = 1.0 / (2 * math.pi * cutoff)
+        return 1.0 / (1.0 + tau / dt)
+
+    def _filter(self, value):
+        if self._value is None or self._value.shape != value.shape or not self._period:
+            self._value = value.copy()
+            self._speed = np.zeros(value.shape)
+            self.lag = 0.0
+            return self._value
+        dt = self._period
+        speed = (value - self._value) / dt
+        self._speed += self._alpha(self.d_cutoff, dt) * (speed - self._speed)
+        cutoff = self.min_cutoff + self.beta * np.abs(self._speed)
+        tau = 1.0 / (2 * math.pi * cutoff)
+        alpha = 1.0 / (1.0 + tau / dt)
+        self._value += alpha * (value - self._value)
+        # A first-order low-pass delays slow signals by its time constant
+        self.lag = float(np.mean(tau))
+        return self._value
+
+FILTER_TYPES = {
+    "moving_average": MovingAverageFilter,
+    "exponential": ExponentialFilter,
+    "one_euro": OneEuroFilter
+}
+
+def make_filter(spec):
+    """
+    Build a filter from an ExerciseConfig filter specification
+
+    Args:
+        spec: Dictionary with "type", one of FILTER_TYPES, and the filter's
+            keyword arguments, e.g. {"type": "one_euro", "beta": 0.02}. None
+            disables filtering.
+
+    Returns:
+        SignalFilter, or None when spec is None
+    """
+    if spec is None:
+        return None
+    options = dict(spec)
+    kind = options.pop("type", None)
+    if kind not in FILTER_TYPES:
+        raise ValueError(f"Unknown filter type {kind!r}, expected one of {', '.join(FILTER_TYPES)}")
+    return FILTER_TYPES[kind](**options)